@@ -10,8 +10,146 @@ class Settings(BaseSettings):
     ALGORITHM: str = os.getenv("ALGORITHM", "HS256")
     ACCESS_TOKEN_EXPIRE_MINUTES: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
     GROQ_API_KEY: str = os.getenv("GROQ_API_KEY", "")
+    # Point the client at another OpenAI-compatible endpoint (e.g. a local fake for testing).
+    GROQ_BASE_URL: str = os.getenv("GROQ_BASE_URL", "")
     GOOGLE_CLIENT_ID: str = os.getenv("GOOGLE_CLIENT_ID", "")
 
+    # Grading backends as comma-separated "<backend>:<model>" specs, tried in
+    # order; backend is groq, openai (any OpenAI-compatible server at
+    # OPENAI_COMPATIBLE_BASE_URL, e.g. a local vLLM or Ollama) or fake.
+    # e.g. "groq:llama3-70b-8192,groq:llama3-8b-8192"
+    EVALUATOR_BACKENDS: str = os.getenv("EVALUATOR_BACKENDS", "groq:llama3-70b-8192")
+    OPENAI_COMPATIBLE_BASE_URL: str = os.getenv("OPENAI_COMPATIBLE_BASE_URL", "http://127.0.0.1:8000/v1")
+    OPENAI_COMPATIBLE_API_KEY: str = os.getenv("OPENAI_COMPATIBLE_API_KEY", "")
+    # Bypass the first backend for the cooldown when its p95 latency over the
+    # last EVALUATOR_FALLBACK_WINDOW calls exceeds this (0 disables; failed
+    # calls always fall through to the next backend).
+    EVALUATOR_FALLBACK_P95_MS: float = float(os.getenv("EVALUATOR_FALLBACK_P95_MS", 0))
+    EVALUATOR_FALLBACK_WINDOW: int = int(os.getenv("EVALUATOR_FALLBACK_WINDOW", 50))
+    EVALUATOR_FALLBACK_COOLDOWN_SECONDS: float = float(os.getenv("EVALUATOR_FALLBACK_COOLDOWN_SECONDS", 60))
+    # The "fake" backend: deterministic scores, log-normal latency, injected errors.
+    FAKE_EVALUATOR_MEDIAN_LATENCY_MS: float = float(os.getenv("FAKE_EVALUATOR_MEDIAN_LATENCY_MS", 300))
+    FAKE_EVALUATOR_LATENCY_SIGMA: float = float(os.getenv("FAKE_EVALUATOR_LATENCY_SIGMA", 0.5))
+    FAKE_EVALUATOR_ERROR_RATE: float = float(os.getenv("FAKE_EVALUATOR_ERROR_RATE", 0))
+    FAKE_EVALUATOR_SEED: int = int(os.getenv("FAKE_EVALUATOR_SEED", 0))
+
+    # Changing BCRYPT_ROUNDS rehashes existing passwords on their next login.
+    BCRYPT_ROUNDS: int = int(os.getenv("BCRYPT_ROUNDS", 12))
+    # Cost used for passwords created by roster imports. Lower values make
+    # large imports faster; those hashes are upgraded to BCRYPT_ROUNDS when
+    # the student first logs in.
+    IMPORT_BCRYPT_ROUNDS: int = int(os.getenv("IMPORT_BCRYPT_ROUNDS", os.getenv("BCRYPT_ROUNDS", 12)))
+    HASHING_WORKERS: int = int(os.getenv("HASHING_WORKERS", min(4, os.cpu_count() or 1)))
+    HASHING_MAX_PENDING: int = int(os.getenv("HASHING_MAX_PENDING", 64))
+
+    PRINCIPAL_CACHE_MAX_ENTRIES: int = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", 4096))
+    PRINCIPAL_CACHE_TTL_SECONDS: int = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))
+
+    EVAL_CACHE_ENABLED: bool = os.getenv("EVAL_CACHE_ENABLED", "true").lower() == "true"
+    EVAL_CACHE_MAX_ENTRIES: int = int(os.getenv("EVAL_CACHE_MAX_ENTRIES", 2048))
+    EVAL_CACHE_TTL_SECONDS: int = int(os.getenv("EVAL_CACHE_TTL_SECONDS", 3600))
+    EVAL_CACHE_DB_TTL_SECONDS: int = int(os.getenv("EVAL_CACHE_DB_TTL_SECONDS", 30 * 24 * 3600))
+
+    # Provider limits used by the LLM rate limiter (Groq free tier defaults).
+    # They apply to the groq backend only, and to every attempt: retries and
+    # hedged duplicates count against them too.
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", 8))
+    LLM_REQUESTS_PER_MINUTE: int = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 30))
+    LLM_TOKENS_PER_MINUTE: int = int(os.getenv("LLM_TOKENS_PER_MINUTE", 6000))
+    LLM_EXPECTED_COMPLETION_TOKENS: int = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", 300))
+
+    # Resilience of LLM calls (app.services.llm_client).
+    LLM_ATTEMPT_TIMEOUT_SECONDS: float = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", 20))
+    LLM_CONNECT_TIMEOUT_SECONDS: float = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", 5))
+    LLM_DEADLINE_SECONDS: float = float(os.getenv("LLM_DEADLINE_SECONDS", 45))
+    LLM_MAX_ATTEMPTS: int = int(os.getenv("LLM_MAX_ATTEMPTS", 4))
+    LLM_BACKOFF_BASE_SECONDS: float = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 0.5))
+    LLM_BACKOFF_MAX_SECONDS: float = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 8))
+    LLM_BREAKER_FAILURE_THRESHOLD: int = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", 5))
+    LLM_BREAKER_RESET_SECONDS: float = float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30))
+    # Send a second, identical request when the first has not answered after
+    # this many seconds (0 disables hedging). Each hedge takes its own
+    # limiter slot and tokens, so keep this well above the usual latency.
+    LLM_HEDGE_AFTER_SECONDS: float = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", 0))
+    LLM_MAX_CONNECTIONS: int = int(os.getenv("LLM_MAX_CONNECTIONS", 20))
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", 10))
+    # Admission control in front of LLM evaluations (app.services.admission):
+    # student submissions are admitted before teacher evaluations, and
+    # evaluations beyond the queue limits or the per-user and per-teacher
+    # token budgets (sliding windows; 0 disables) get 429 + Retry-After.
+    # Budgets are kept per process.
+    ADMISSION_MAX_IN_FLIGHT: int = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", os.getenv("LLM_MAX_CONCURRENCY", 8)))
+    ADMISSION_MAX_QUEUED_STUDENT: int = int(os.getenv("ADMISSION_MAX_QUEUED_STUDENT", 500))
+    ADMISSION_MAX_QUEUED_TEACHER: int = int(os.getenv("ADMISSION_MAX_QUEUED_TEACHER", 100))
+    ADMISSION_MAX_WAIT_SECONDS: float = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", 30))
+    LLM_BUDGET_WINDOW_SECONDS: float = float(os.getenv("LLM_BUDGET_WINDOW_SECONDS", 3600))
+    LLM_USER_TOKEN_BUDGET: int = int(os.getenv("LLM_USER_TOKEN_BUDGET", 50000))
+    LLM_TEACHER_TOKEN_BUDGET: int = int(os.getenv("LLM_TEACHER_TOKEN_BUDGET", 500000))
+    # Longest accepted answer or model answer, in characters (about 4 per token).
+    ANSWER_MAX_CHARS: int = int(os.getenv("ANSWER_MAX_CHARS", 8000))
+    # Micro-batching (app.services.micro_batching): while an answer to a model
+    # answer is being graded, further answers to it that arrive within the
+    # window are graded in one LLM call of up to MAX_SIZE answers and about
+    # MAX_TOKENS tokens of answers and feedback; an answer with nothing in
+    # flight is sent at once. Each waiting answer holds an admission slot,
+    # so batches are also bounded by ADMISSION_MAX_IN_FLIGHT. A size of 1
+    # disables it.
+    EVAL_MICROBATCH_MAX_SIZE: int = int(os.getenv("EVAL_MICROBATCH_MAX_SIZE", 8))
+    EVAL_MICROBATCH_WINDOW_MS: float = float(os.getenv("EVAL_MICROBATCH_WINDOW_MS", 50))
+    EVAL_MICROBATCH_MAX_TOKENS: int = int(os.getenv("EVAL_MICROBATCH_MAX_TOKENS", 4000))
+    EVAL_BATCH_MAX_ITEMS: int = int(os.getenv("EVAL_BATCH_MAX_ITEMS", 100))
+    # Rows validated, resolved and inserted together by the JSONL imports.
+    IMPORT_CHUNK_SIZE: int = int(os.getenv("IMPORT_CHUNK_SIZE", 500))
+    FINALIZE_BATCH_MAX_ITEMS: int = int(os.getenv("FINALIZE_BATCH_MAX_ITEMS", 500))
+
+    # Serve creator/student details from the summaries embedded in question
+    # sets and submissions. Run app.db.migrations.backfill_user_summaries first.
+    DENORMALIZED_READS: bool = os.getenv("DENORMALIZED_READS", "false").lower() == "true"
+
+    # GET /metrics (Prometheus text format); off by default, since it shows
+    # per-route traffic, cache sizes and LLM token usage. With METRICS_TOKEN
+    # scrapers must send "Authorization: Bearer <token>". With
+    # METRICS_TIMING_HEADER every response carries a Server-Timing header
+    # (db, llm, app and total ms).
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "false").lower() == "true"
+    METRICS_TOKEN: str = os.getenv("METRICS_TOKEN", "")
+    METRICS_TIMING_HEADER: bool = os.getenv("METRICS_TIMING_HEADER", "false").lower() == "true"
+
+    # Serialized list responses kept per ETag (app.services.change_versions);
+    # 0 disables the cache, ETags and 304s are always on. MAX_BYTES bounds
+    # the bodies held per worker; a larger listing is not cached.
+    LIST_RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("LIST_RESPONSE_CACHE_MAX_ENTRIES", 512))
+    LIST_RESPONSE_CACHE_MAX_BYTES: int = int(os.getenv("LIST_RESPONSE_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+    LIST_RESPONSE_CACHE_TTL_SECONDS: int = int(os.getenv("LIST_RESPONSE_CACHE_TTL_SECONDS", 300))
+
+    # List endpoints return everything unless a limit or cursor is given;
+    # PAGE_SIZE_DEFAULT is the page size when only a cursor is.
+    PAGE_SIZE_DEFAULT: int = int(os.getenv("PAGE_SIZE_DEFAULT", 100))
+    PAGE_SIZE_MAX: int = int(os.getenv("PAGE_SIZE_MAX", 500))
+    # Rows fetched from MongoDB and written to the client per step of an export.
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+    # "sync" grades inside POST /api/student/submissions, "async" accepts the
+    # submission immediately and leaves grading to the background workers.
+    GRADING_MODE: str = os.getenv("GRADING_MODE", "sync")
+    GRADING_WORKERS: int = int(os.getenv("GRADING_WORKERS", 4))
+    GRADING_MAX_ATTEMPTS: int = int(os.getenv("GRADING_MAX_ATTEMPTS", 3))
+    GRADING_RETRY_BACKOFF_SECONDS: float = float(os.getenv("GRADING_RETRY_BACKOFF_SECONDS", 2))
+    # How long a worker's claim on a pending submission lasts; after that
+    # (e.g. the process died mid-evaluation) another worker may take it over.
+    GRADING_LEASE_SECONDS: int = int(os.getenv("GRADING_LEASE_SECONDS", 300))
+
+    # Local pre-scoring of submissions (app.services.similarity): answers
+    # without a letter or digit get 0, near-copies of the model answer 10, and near-copies of
+    # an already graded answer reuse its grade, without calling the LLM.
+    PRESCORE_ENABLED: bool = os.getenv("PRESCORE_ENABLED", "true").lower() == "true"
+    PRESCORE_DUPLICATE_THRESHOLD: float = float(os.getenv("PRESCORE_DUPLICATE_THRESHOLD", 0.95))
+    PRESCORE_INDEX_MAX_SETS: int = int(os.getenv("PRESCORE_INDEX_MAX_SETS", 256))
+    PRESCORE_INDEX_MAX_ANSWERS: int = int(os.getenv("PRESCORE_INDEX_MAX_ANSWERS", 2000))
+    PRESCORE_INDEX_TTL_SECONDS: int = int(os.getenv("PRESCORE_INDEX_TTL_SECONDS", 3600))
+    PLAGIARISM_SIMILARITY_THRESHOLD: float = float(os.getenv("PLAGIARISM_SIMILARITY_THRESHOLD", 0.8))
+    PLAGIARISM_MIN_DISTINCT_TOKENS: int = int(os.getenv("PLAGIARISM_MIN_DISTINCT_TOKENS", 3))
+
     class Config:
         env_file = ".env"
         env_file_encoding = 'utf-8'
@@ -0,0 +1,13 @@
+from typing import Any
+import orjson
+from fastapi.responses import JSONResponse
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson. Routes return it with plain,
+    already JSON-ready data, which skips FastAPI's response_model
+    re-validation; the response_model then only documents the shape.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
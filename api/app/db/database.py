@@ -1,43 +1,160 @@
-from typing import Optional, Annotated, List # Import List
-from beanie import Document, init_beanie, Link, Indexed
+from datetime import datetime, timezone
+from typing import Optional, Annotated, Dict, List # Import List
+from beanie import Document, init_beanie, Link, Indexed, PydanticObjectId, after_event, Replace, Save, SaveChanges, Update, Delete
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
 from app.core.config import settings
+from app.services.metrics import MongoCommandListener
 
 class User(Document):
     username: Annotated[str, Indexed(unique=True)]
-    email: EmailStr
+    email: Annotated[EmailStr, Indexed(unique=True)]
     hashed_password: str
     role: str
 
     class Settings:
         name = "users"
 
+    @after_event(Replace, Save, SaveChanges, Update, Delete)
+    def invalidate_cached_principal(self):
+        # Imported lazily: the auth dependencies import this module.
+        from app.services.auth_dependencies import invalidate_user
+        invalidate_user(self.id)
+
+    @after_event(Replace, Save, SaveChanges, Update)
+    def propagate_summary(self):
+        from app.services.user_summaries import schedule_user_summary_propagation
+        schedule_user_summary_propagation(self.id)
+
+class EmbeddedUser(BaseModel):
+    """
+    Denormalized copy of a user's public fields, stored next to the Link so
+    that reads do not need to resolve it. Kept in sync by
+    app.services.user_summaries.
+    """
+    id: PydanticObjectId
+    username: str
+    email: str
+    role: str
+
 class QuestionSet(Document):
     title: str
     question: str
     model_answer: str
     creator: Link[User]
     assigned_students: List[Link[User]] = []
+    # Visible to every student: no students are assigned. Stored so that the
+    # visibility check can use an index ($size cannot).
+    is_public: bool = False
+    creator_summary: Optional[EmbeddedUser] = None
+    assigned_summaries: List[EmbeddedUser] = []
 
     class Settings:
         name = "question_sets"
+        indexes = [
+            # Also serves the _id-ordered keyset pagination of a teacher's sets.
+            IndexModel([("creator.$id", ASCENDING), ("_id", ASCENDING)]),
+            # The two branches of the student visibility check, each in _id
+            # order so that a page of their union needs no in-memory sort.
+            IndexModel([("is_public", ASCENDING), ("_id", ASCENDING)]),
+            IndexModel([("assigned_students.$id", ASCENDING), ("_id", ASCENDING)]),
+        ]
 
 class Submission(Document):
     question_set: Link[QuestionSet]
     student: Link[User]
+    student_summary: Optional[EmbeddedUser] = None
     student_answer: str
-    ai_score: int
-    ai_feedback: str
+    ai_score: Optional[int] = None
+    ai_feedback: Optional[str] = None
     final_score: Optional[int] = None
+    status: str = "graded"  # "pending", "graded" or "failed"
+    grading_attempts: int = 0
+    # While set and in the future, a grading worker (of any process) has
+    # claimed the pending submission and the others leave it alone.
+    grading_lease_until: Optional[datetime] = None
+    # How ai_score was obtained: "llm", or locally as "duplicate" (grade of
+    # the similar_to submission reused), "model_answer" or "trivial".
+    grading_source: str = "llm"
+    similar_to: Optional[PydanticObjectId] = None
 
     class Settings:
         name = "submissions"
+        indexes = [
+            IndexModel([("student.$id", ASCENDING), ("_id", ASCENDING)]),
+            IndexModel([("question_set.$id", ASCENDING), ("_id", ASCENDING)]),
+            # One submission per student and set.
+            IndexModel([("question_set.$id", ASCENDING), ("student.$id", ASCENDING)], unique=True),
+            IndexModel("status", partialFilterExpression={"status": "pending"}),
+        ]
+
+class QuestionSetStats(Document):
+    """
+    Running grading statistics of one question set, keyed by its id.
+    Maintained with $inc by app.services.question_set_stats.
+    """
+    submission_count: int = 0
+    ai_count: int = 0
+    ai_sum: int = 0
+    ai_histogram: Dict[str, int] = {}
+    final_count: int = 0
+    final_sum: int = 0
+    final_histogram: Dict[str, int] = {}
+    # final_score - ai_score, over submissions that have both.
+    drift_count: int = 0
+    drift_sum: int = 0
+    drift_abs_sum: int = 0
+
+    class Settings:
+        name = "question_set_stats"
+
+class ChangeVersion(Document):
+    """
+    A counter bumped after every write that changes a listing, keyed by
+    what it covers (e.g. "student:<id>"). Maintained by
+    app.services.change_versions.
+    """
+    id: Optional[str] = None
+    version: int = 0
+
+    class Settings:
+        name = "change_versions"
+
+class EvaluationCacheEntry(Document):
+    key: Annotated[str, Indexed(unique=True)]
+    score: int
+    feedback: str
+    model: str
+    prompt_version: str
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    # Set from EVAL_CACHE_DB_TTL_SECONDS when the entry is written. The TTL
+    # lives in the documents rather than in the index options, so changing
+    # it does not conflict with the index created by an earlier start.
+    expires_at: Optional[datetime] = None
+
+    class Settings:
+        name = "evaluation_cache"
+        indexes = [
+            IndexModel("expires_at", expireAfterSeconds=0),
+        ]
+
+DOCUMENT_MODELS = [User, QuestionSet, Submission, QuestionSetStats, ChangeVersion, EvaluationCacheEntry]
 
-async def init_db():
-    client = AsyncIOMotorClient(settings.DATABASE_URL)
-    await init_beanie(
-        database=client.get_default_database(), 
-        document_models=[User, QuestionSet, Submission]
-    )
+async def init_db(database=None):
+    """Initializes Beanie on the default database of DATABASE_URL, or on `database` if given (e.g. by benchmarks)."""
+    if database is None:
+        client = AsyncIOMotorClient(settings.DATABASE_URL, event_listeners=[MongoCommandListener()])
+        database = client.get_default_database()
+    try:
+        await init_beanie(database=database, document_models=DOCUMENT_MODELS)
+    except OperationFailure as e:
+        if e.code != 11000:
+            raise
+        # A unique index cannot be built over existing duplicates (e.g. User.email).
+        raise RuntimeError(
+            "Existing documents violate a unique index; list and resolve them with "
+            f"`python -m app.db.migrations.check_unique_indexes` before starting. ({e})"
+        ) from e
     print("Database initialized successfully with all models.")
@@ -0,0 +1,33 @@
+"""
+Sets QuestionSet.is_public on question sets created before it existed.
+Idempotent and cheap once done (the missing field is found through the
+is_public index), so it also runs on every start.
+
+Run from the `api` directory:
+
+    python -m app.db.migrations.backfill_question_set_visibility
+"""
+import asyncio
+
+from app.db.database import QuestionSet, init_db
+
+async def backfill_question_set_visibility() -> int:
+    """Returns the number of question sets updated."""
+    collection = QuestionSet.get_motor_collection()
+    public = await collection.update_many(
+        {
+            "is_public": {"$exists": False},
+            "$or": [{"assigned_students": {"$size": 0}}, {"assigned_students": {"$exists": False}}],
+        },
+        {"$set": {"is_public": True}},
+    )
+    assigned = await collection.update_many({"is_public": {"$exists": False}}, {"$set": {"is_public": False}})
+    return public.modified_count + assigned.modified_count
+
+async def main():
+    await init_db()
+    count = await backfill_question_set_visibility()
+    print(f"Set the visibility of {count} question sets.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
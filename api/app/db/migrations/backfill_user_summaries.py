@@ -0,0 +1,20 @@
+"""
+Fills in the user summaries embedded in question sets and submissions
+for documents created before they were introduced.
+
+Run from the `api` directory before enabling DENORMALIZED_READS:
+
+    python -m app.db.migrations.backfill_user_summaries
+"""
+import asyncio
+
+from app.db.database import init_db
+from app.services.user_summaries import backfill_user_summaries
+
+async def main():
+    await init_db()
+    counts = await backfill_user_summaries()
+    print(f"Backfilled {counts['question_sets']} question sets and {counts['submissions']} submissions.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
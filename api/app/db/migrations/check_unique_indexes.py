@@ -0,0 +1,70 @@
+"""
+Lists the documents that keep the unique indexes from being built on an
+existing database: users sharing an email or username, and several
+submissions of one student to the same question set. init_db fails
+until they are resolved.
+
+Run from the `api` directory before deploying over an existing database:
+
+    python -m app.db.migrations.check_unique_indexes
+
+Duplicate users have to be merged or renamed by hand. With
+--delete-duplicate-submissions, only the submission that matters most of
+each group is kept (finalized, then graded, then the latest) and the
+others are deleted; run recompute_question_set_stats afterwards.
+"""
+import asyncio
+import sys
+from typing import Dict, List
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.core.config import settings
+
+# collection -> the fields of each unique index added after data existed
+UNIQUE_KEYS = {
+    "users": [["email"], ["username"]],
+    "submissions": [["question_set.$id", "student.$id"]],
+}
+
+async def find_duplicates(database) -> Dict[str, List[dict]]:
+    """Per collection, one {"key", "ids"} group for every duplicated unique key."""
+    duplicates: Dict[str, List[dict]] = {}
+    for collection, keys in UNIQUE_KEYS.items():
+        for fields in keys:
+            group_key = {field.replace(".$id", "").replace(".", "_"): f"${field}" for field in fields}
+            pipeline = [
+                {"$group": {"_id": group_key, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+                {"$match": {"count": {"$gt": 1}}},
+            ]
+            async for group in database[collection].aggregate(pipeline, allowDiskUse=True):
+                duplicates.setdefault(collection, []).append({"key": group["_id"], "ids": group["ids"]})
+    return duplicates
+
+def _keep_rank(submission: dict):
+    return (submission.get("final_score") is not None, submission.get("status") == "graded", submission["_id"])
+
+async def delete_duplicate_submissions(database, groups: List[dict]) -> int:
+    deleted = 0
+    for group in groups:
+        submissions = await database.submissions.find({"_id": {"$in": group["ids"]}}).to_list(length=None)
+        keep = max(submissions, key=_keep_rank)
+        result = await database.submissions.delete_many({"_id": {"$in": [s["_id"] for s in submissions if s is not keep]}})
+        deleted += result.deleted_count
+    return deleted
+
+async def main():
+    database = AsyncIOMotorClient(settings.DATABASE_URL).get_default_database()
+    duplicates = await find_duplicates(database)
+    for collection, groups in duplicates.items():
+        for group in groups:
+            print(f"{collection}: {group['key']} is shared by {', '.join(map(str, group['ids']))}")
+    if "--delete-duplicate-submissions" in sys.argv and duplicates.get("submissions"):
+        deleted = await delete_duplicate_submissions(database, duplicates.pop("submissions"))
+        print(f"Deleted {deleted} duplicate submissions; now run app.db.migrations.recompute_question_set_stats.")
+    if duplicates:
+        sys.exit(1)
+    print("No duplicates; the unique indexes can be built.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,34 @@
+"""
+Moves the evaluation cache from a TTL index on created_at (whose
+expireAfterSeconds was fixed when the index was first built) to a
+per-entry expires_at. Drops the old index and gives existing entries an
+expires_at of created_at + EVAL_CACHE_DB_TTL_SECONDS.
+
+Run from the `api` directory once, when upgrading a database that was
+created with the old index (the old index would otherwise keep expiring
+entries after the old TTL):
+
+    python -m app.db.migrations.migrate_evaluation_cache_ttl
+"""
+import asyncio
+
+from app.core.config import settings
+from app.db.database import EvaluationCacheEntry, init_db
+
+OLD_INDEX_NAME = "created_at_1"
+
+async def main():
+    await init_db()
+    collection = EvaluationCacheEntry.get_motor_collection()
+    if OLD_INDEX_NAME in await collection.index_information():
+        await collection.drop_index(OLD_INDEX_NAME)
+        print(f"Dropped the {OLD_INDEX_NAME} TTL index.")
+    result = await collection.update_many(
+        {"expires_at": None},
+        # Date + milliseconds is a date.
+        [{"$set": {"expires_at": {"$add": ["$created_at", settings.EVAL_CACHE_DB_TTL_SECONDS * 1000]}}}],
+    )
+    print(f"Set expires_at on {result.modified_count} cache entries.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
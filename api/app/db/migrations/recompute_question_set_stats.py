@@ -0,0 +1,21 @@
+"""
+Rebuilds the grading statistics of every question set from its submissions.
+Needed once for question sets created before the statistics existed, and
+to repair counters that drifted.
+
+Run from the `api` directory:
+
+    python -m app.db.migrations.recompute_question_set_stats
+"""
+import asyncio
+
+from app.db.database import init_db
+from app.services.question_set_stats import recompute_all_question_set_stats
+
+async def main():
+    await init_db()
+    count = await recompute_all_question_set_stats()
+    print(f"Recomputed the statistics of {count} question sets.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
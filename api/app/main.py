@@ -1,16 +1,28 @@
-from fastapi import FastAPI
+import hmac
+
+from fastapi import FastAPI, Header, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from contextlib import asynccontextmanager
+from typing import Optional
 
+from app.core.config import settings
 from app.db.database import init_db
+from app.db.migrations.backfill_question_set_visibility import backfill_question_set_visibility
+from app.services.metrics import MetricsMiddleware, render_metrics
+from app.services.pagination import NEXT_CURSOR_HEADER
+from app.services.grading_queue import start_grading_workers, stop_grading_workers
 from app.routes import auth_routes, evaluation_routes, teacher_routes, student_routes
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Starting up...")
     await init_db()
+    await backfill_question_set_visibility()
+    await start_grading_workers()
     yield
     print("Shutting down...")
+    await stop_grading_workers()
 
 app = FastAPI(
     title="Perception API",
@@ -25,8 +37,12 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 app.include_router(auth_routes.router, prefix="/auth", tags=["Authentication"])
 
 app.include_router(teacher_routes.router, prefix="/api/teacher", tags=["Teacher"])
@@ -40,3 +56,16 @@ app.include_router(evaluation_routes.router, prefix="/api", tags=["Evaluation"])
 async def read_root():
     return {"message": "Welcome to the Perception API!"}
 
+if settings.METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics(authorization: Optional[str] = Header(None)):
+        if settings.METRICS_TOKEN and not hmac.compare_digest(
+            authorization or "", f"Bearer {settings.METRICS_TOKEN}"
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Not authenticated",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
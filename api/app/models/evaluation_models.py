@@ -1,12 +1,33 @@
-from pydantic import BaseModel
+from typing import List, Optional
+from pydantic import BaseModel, Field
+from app.core.config import settings
 
 class EvaluationRequest(BaseModel):
     """Request body for the evaluation endpoint."""
-    model_answer: str
-    student_answer: str
+    model_answer: str = Field(..., max_length=settings.ANSWER_MAX_CHARS)
+    student_answer: str = Field(..., max_length=settings.ANSWER_MAX_CHARS)
 
 class EvaluationResponse(BaseModel):
     """Response body for the evaluation endpoint."""
     score: int
     feedback: str
-    
\ No newline at end of file
+
+class BatchEvaluationRequest(BaseModel):
+    """Request body for the batch evaluation endpoint."""
+    items: List[EvaluationRequest] = Field(..., min_length=1)
+
+class BatchEvaluationItemResult(BaseModel):
+    """
+    Outcome of one item of a batch; either score/feedback or error is set.
+    status_code is what /evaluate would have answered for a failed item
+    (429, 503 or 500).
+    """
+    index: int
+    score: Optional[int] = None
+    feedback: Optional[str] = None
+    error: Optional[str] = None
+    status_code: Optional[int] = None
+
+class BatchEvaluationResponse(BaseModel):
+    """Response body for the batch evaluation endpoint, in input order."""
+    results: List[BatchEvaluationItemResult]
@@ -0,0 +1,56 @@
+from typing import List, Optional
+from beanie import Link, PydanticObjectId
+from pydantic import BaseModel, Field
+
+from app.db.database import User, QuestionSet, EmbeddedUser
+
+# Projection models: used with `.project(...)` so that MongoDB only returns
+# the fields a route actually serializes. `model_dump(mode="json")` of these
+# yields the same shape as the corresponding *Out models.
+
+class UserSummary(BaseModel):
+    """Public fields of a user (no password hash)."""
+    id: PydanticObjectId = Field(alias="_id")
+    username: str
+    email: str
+    role: str
+
+class QuestionSetTeacherRow(BaseModel):
+    """A question set as listed to its creator."""
+    id: PydanticObjectId = Field(alias="_id")
+    title: str
+    question: str
+    model_answer: str
+    assigned_students: List[Link[User]] = []
+    assigned_summaries: List[EmbeddedUser] = []
+
+class QuestionSetStudentRow(BaseModel):
+    """A question set as shown to students (no model answer)."""
+    id: PydanticObjectId = Field(alias="_id")
+    title: str
+    question: str
+    creator: Link[User]
+    creator_summary: Optional[EmbeddedUser] = None
+
+class SubmissionReviewRow(BaseModel):
+    """A submission as reviewed by the teacher."""
+    id: PydanticObjectId = Field(alias="_id")
+    student: Link[User]
+    student_summary: Optional[EmbeddedUser] = None
+    student_answer: str
+    ai_score: Optional[int] = None
+    ai_feedback: Optional[str] = None
+    final_score: Optional[int] = None
+    status: str = "graded"
+    grading_source: str = "llm"
+    similar_to: Optional[PydanticObjectId] = None
+
+class SubmissionStudentRow(BaseModel):
+    """A submission as shown to the student who made it."""
+    id: PydanticObjectId = Field(alias="_id")
+    question_set: Link[QuestionSet]
+    student_answer: str
+    ai_score: Optional[int] = None
+    ai_feedback: Optional[str] = None
+    final_score: Optional[int] = None
+    status: str = "graded"
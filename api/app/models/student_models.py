@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
 from typing import Optional, List
+from app.core.config import settings
 from .user_models import PyObjectId, UserOut 
 
 class QuestionSetForStudentOut(BaseModel):
@@ -16,16 +17,17 @@ class QuestionSetForStudentOut(BaseModel):
 class SubmissionCreate(BaseModel):
     """Request body for a student submitting an answer."""
     question_set_id: str
-    answer: str = Field(..., min_length=5)
+    answer: str = Field(..., min_length=5, max_length=settings.ANSWER_MAX_CHARS)
 
 class SubmissionResultOut(BaseModel):
     """Detailed result view for a student's own submission."""
     id: PyObjectId
     question_set: QuestionSetForStudentOut
     student_answer: str
-    ai_score: int
-    ai_feedback: str
+    ai_score: Optional[int] = None
+    ai_feedback: Optional[str] = None
     final_score: Optional[int] = None
+    status: str = "graded"
 
     class Config:
         from_attributes = True
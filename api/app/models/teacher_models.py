@@ -1,11 +1,13 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
-from .user_models import UserOut, PyObjectId
+from typing import Dict, List, Optional
+from beanie import PydanticObjectId
+from app.core.config import settings
+from .user_models import UserCreate, UserOut, PyObjectId
 
 class QuestionSetCreate(BaseModel):
     title: str = Field(..., min_length=3, max_length=100)
     question: str = Field(..., min_length=10)
-    model_answer: str = Field(..., min_length=10)
+    model_answer: str = Field(..., min_length=10, max_length=settings.ANSWER_MAX_CHARS)
     assigned_usernames: Optional[List[str]] = None
 
 class QuestionSetOut(BaseModel):
@@ -24,9 +26,12 @@ class SubmissionReviewOut(BaseModel):
     id: PyObjectId
     student: UserOut
     student_answer: str
-    ai_score: int
-    ai_feedback: str
+    ai_score: int | None
+    ai_feedback: str | None
     final_score: int | None
+    status: str = "graded"
+    grading_source: str = "llm"
+    similar_to: Optional[PyObjectId] = None
 
     class Config:
         from_attributes = True
@@ -34,3 +39,57 @@ class SubmissionReviewOut(BaseModel):
 
 class ScoreUpdate(BaseModel):
     final_score: int = Field(..., ge=0, le=10)
+
+class BulkScoreUpdateItem(BaseModel):
+    sub_id: PydanticObjectId
+    final_score: int = Field(..., ge=0, le=10)
+
+class BulkScoreUpdate(BaseModel):
+    """Request body for finalizing many submissions at once."""
+    items: List[BulkScoreUpdateItem] = Field(..., min_length=1)
+
+class BulkScoreUpdateItemResult(BaseModel):
+    """Outcome of one item; error is set when the submission was not updated."""
+    index: int
+    sub_id: PyObjectId
+    final_score: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkScoreUpdateResponse(BaseModel):
+    """Response body for bulk finalization, in input order."""
+    updated: int
+    results: List[BulkScoreUpdateItemResult]
+
+class StudentImportRow(UserCreate):
+    """One line of a roster import; the role defaults to student."""
+    role: str = "student"
+
+class ImportRowError(BaseModel):
+    line: int
+    error: str
+
+class ImportReport(BaseModel):
+    """Outcome of a JSONL import; rows not listed in errors were created."""
+    created: int = 0
+    errors: List[ImportRowError] = []
+
+class SimilarityClusterOut(BaseModel):
+    """Submissions of a question set whose answers are near copies of each other."""
+    submission_ids: List[PyObjectId]
+    students: List[UserOut]
+    # Lowest similarity among the pairs that link the cluster together.
+    min_similarity: float
+
+class QuestionSetAnalyticsOut(BaseModel):
+    """Grading statistics of a question set. Means are None when there is nothing to average."""
+    question_set_id: PyObjectId
+    submission_count: int
+    ai_scored_count: int
+    ai_score_mean: Optional[float]
+    ai_score_histogram: Dict[int, int]
+    finalized_count: int
+    final_score_mean: Optional[float]
+    final_score_histogram: Dict[int, int]
+    # Teacher's final score minus the AI score, over finalized submissions.
+    drift_mean: Optional[float]
+    drift_abs_mean: Optional[float]
@@ -12,3 +12,7 @@ class TokenData(BaseModel):
     Pydantic model for the data encoded within the JWT.
     """
     email: str | None = None
+    user_id: str | None = None
+    username: str | None = None
+    role: str | None = None
+    issued_at: float | None = None
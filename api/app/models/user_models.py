@@ -1,6 +1,7 @@
 from pydantic import BaseModel, EmailStr, Field, BeforeValidator
 from typing import Annotated
 from bson import ObjectId
+from beanie import PydanticObjectId
 
 def object_id_to_str(v):
     if isinstance(v, ObjectId):
@@ -26,3 +27,13 @@ class UserOut(BaseModel):
     class Config:
         from_attributes = True
         arbitrary_types_allowed = True
+
+class Principal(BaseModel):
+    """
+    The authenticated caller as described by the access token claims.
+    Read-only routes use it instead of loading the full User document.
+    """
+    id: PydanticObjectId
+    username: str
+    email: EmailStr
+    role: str
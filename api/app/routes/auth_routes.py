@@ -3,15 +3,14 @@ from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 
-from google.oauth2 import id_token
-from google.auth.transport import requests
-
 from app.db.database import User
-from app.models.user_models import UserCreate, UserOut
+from app.models.user_models import UserCreate, UserOut, Principal
 from app.models.token_models import Token
 from app.models.google_auth_models import GoogleCredential
-from app.services.auth_service import get_password_hash, verify_password, create_access_token
-from app.services.auth_dependencies import get_current_user
+from app.services.auth_service import async_get_password_hash, async_verify_and_update_password, create_user_access_token
+from app.services.auth_dependencies import get_current_principal
+from app.services.google_auth import KeyFetchError, verify_google_id_token
+from app.services.queries import login_filter
 from app.core.config import settings
 
 router = APIRouter()
@@ -24,7 +23,7 @@ async def create_user(user_in: UserCreate):
     if await User.find_one(User.username == user_in.username):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username is already taken")
     
-    hashed_password = get_password_hash(user_in.password)
+    hashed_password = await async_get_password_hash(user_in.password)
     
     new_user = User(
         username=user_in.username,
@@ -37,26 +36,32 @@ async def create_user(user_in: UserCreate):
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = await User.find_one({"$or": [{"email": form_data.username}, {"username": form_data.username}]})
+    user = await User.find_one(login_filter(form_data.username))
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if user:
+        is_valid, new_hash = await async_verify_and_update_password(form_data.password, user.hashed_password)
+    else:
+        is_valid, new_hash = False, None
+
+    if not is_valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    if new_hash:
+        await user.set({User.hashed_password: new_hash})
     
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(data={"sub": user.email}, expires_delta=access_token_expires)
+    access_token = create_user_access_token(user, expires_delta=access_token_expires)
     
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.post("/google", response_model=Token)
 async def login_with_google(cred: GoogleCredential):
     try:
-        idinfo = id_token.verify_oauth2_token(
-            cred.credential, requests.Request(), settings.GOOGLE_CLIENT_ID
-        )
+        idinfo = await verify_google_id_token(cred.credential, settings.GOOGLE_CLIENT_ID)
         email = idinfo.get("email")
         if not email:
             raise HTTPException(status_code=400, detail="Email not found in Google token")
@@ -78,14 +83,14 @@ async def login_with_google(cred: GoogleCredential):
             new_user = User(
                 username=username,
                 email=email,
-                hashed_password=get_password_hash(secrets.token_urlsafe(16)),
+                hashed_password=await async_get_password_hash(secrets.token_urlsafe(16)),
                 role="student"
             )
             await new_user.insert()
             user = new_user
 
         access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-        access_token = create_access_token(data={"sub": user.email}, expires_delta=access_token_expires)
+        access_token = create_user_access_token(user, expires_delta=access_token_expires)
         
         return {"access_token": access_token, "token_type": "bearer"}
 
@@ -94,9 +99,15 @@ async def login_with_google(cred: GoogleCredential):
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate Google credentials",
         )
+    except KeyFetchError as e:
+        print(f"Google sign-in unavailable: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Google sign-in is temporarily unavailable. Please try again shortly.",
+        )
 
 @router.get("/users/me", response_model=UserOut)
-async def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: Principal = Depends(get_current_principal)):
     """
     Get the details of the currently authenticated user.
     """
@@ -1,15 +1,25 @@
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException, status
-from app.db.database import User
-from app.models.evaluation_models import EvaluationRequest, EvaluationResponse
-from app.services.ai_service import get_ai_evaluation
-from app.services.auth_dependencies import get_current_user
+from fastapi.responses import StreamingResponse
+from app.core.config import settings
+from app.models.user_models import Principal
+from app.models.evaluation_models import (
+    EvaluationRequest, EvaluationResponse,
+    BatchEvaluationRequest, BatchEvaluationItemResult, BatchEvaluationResponse,
+)
+from app.services.admission import Requester
+from app.services.ai_service import (
+    EVALUATION_ERROR_MESSAGE, get_ai_evaluation, stream_ai_evaluation, invalidate_ai_evaluation, evaluation_failure,
+)
+from app.services.sse import format_sse, SSE_HEADERS
+from app.services.auth_dependencies import get_verified_principal
 
 router = APIRouter()
 
 @router.post("/evaluate", response_model=EvaluationResponse)
 async def evaluate_student_answer(
     request: EvaluationRequest,
-    current_user: User = Depends(get_current_user)
+    current_user: Principal = Depends(get_verified_principal)
 ):
     """
     AI-powered evaluation endpoint.
@@ -25,14 +35,95 @@ async def evaluate_student_answer(
 
     evaluation_result = await get_ai_evaluation(
         model_answer=request.model_answer,
-        student_answer=request.student_answer
+        student_answer=request.student_answer,
+        requester=Requester.teacher(current_user.id)
     )
 
     if evaluation_result["score"] == -1:
-            raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=evaluation_result["feedback"],
-        )
+        raise evaluation_failure(evaluation_result)
 
     return evaluation_result
-    
\ No newline at end of file
+
+@router.post("/evaluate/stream")
+async def stream_student_answer_evaluation(
+    request: EvaluationRequest,
+    current_user: Principal = Depends(get_verified_principal)
+):
+    """
+    Streaming variant of /evaluate. Responds with Server-Sent Events:
+    `score` as soon as it is known, `feedback` fragments, then `done`
+    with the full result (or `error`).
+    """
+    if current_user.role != "teacher":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to perform this action.",
+        )
+
+    async def event_stream():
+        async for event in stream_ai_evaluation(request.model_answer, request.student_answer, Requester.teacher(current_user.id)):
+            event_type = event.pop("type")
+            yield format_sse(event_type, event)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+async def _evaluate_batch_item(index: int, item: EvaluationRequest, requester: Requester) -> BatchEvaluationItemResult:
+    try:
+        evaluation_result = await get_ai_evaluation(
+            model_answer=item.model_answer,
+            student_answer=item.student_answer,
+            requester=requester
+        )
+    except Exception as e:
+        # The exception text may carry provider or driver details; it is logged, not returned.
+        print(f"Batch item {index} failed: {e!r}")
+        return BatchEvaluationItemResult(index=index, error=EVALUATION_ERROR_MESSAGE, status_code=500)
+
+    if evaluation_result.get("score", -1) == -1:
+        failure = evaluation_failure(evaluation_result)
+        return BatchEvaluationItemResult(index=index, error=failure.detail, status_code=failure.status_code)
+    return BatchEvaluationItemResult(index=index, score=evaluation_result["score"], feedback=evaluation_result["feedback"])
+
+@router.post("/evaluate/batch", response_model=BatchEvaluationResponse)
+async def evaluate_student_answers_batch(
+    request: BatchEvaluationRequest,
+    current_user: Principal = Depends(get_verified_principal)
+):
+    """
+    Evaluates many answers in one request. Items are graded concurrently
+    within the provider rate limits and returned in input order; a failed
+    item carries an error instead of failing the whole batch.
+    """
+    if current_user.role != "teacher":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to perform this action.",
+        )
+
+    if len(request.items) > settings.EVAL_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch may contain at most {settings.EVAL_BATCH_MAX_ITEMS} items.",
+        )
+
+    results = await asyncio.gather(*(
+        _evaluate_batch_item(index, item, Requester.teacher(current_user.id)) for index, item in enumerate(request.items)
+    ))
+    return BatchEvaluationResponse(results=results)
+
+@router.post("/evaluate/invalidate", status_code=status.HTTP_204_NO_CONTENT)
+async def invalidate_cached_evaluation(
+    request: EvaluationRequest,
+    current_user: Principal = Depends(get_verified_principal)
+):
+    """
+    Drops the cached evaluation for an answer pair so that the next
+    evaluation of the same pair is re-graded by the LLM.
+    """
+    if current_user.role != "teacher":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You do not have permission to perform this action.",
+        )
+
+    await invalidate_ai_evaluation(request.model_answer, request.student_answer)
@@ -1,48 +1,187 @@
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
 from beanie.odm.fields import PydanticObjectId
+from pymongo.errors import DuplicateKeyError
 from app.db.database import User, QuestionSet, Submission
 from app.models.student_models import QuestionSetForStudentOut, SubmissionCreate, SubmissionResultOut
-from app.models.user_models import UserOut
-from app.services.auth_dependencies import get_current_user
-from app.services.ai_service import get_ai_evaluation
+from app.models.user_models import Principal
+from app.models.projection_models import SubmissionStudentRow, QuestionSetStudentRow
+from app.core.responses import ORJSONResponse
+from app.services.auth_dependencies import get_current_user, get_current_principal
+from app.services.admission import Requester
+from app.services.ai_service import EVALUATION_ERROR_MESSAGE, stream_ai_evaluation, replay_evaluation, evaluation_failure
+from app.services.similarity import evaluate_answer_for_set, prescore_answer, remember_graded_answer
+from app.services.sse import format_sse, relay_detached, SSE_HEADERS
+from app.services.grading_queue import enqueue_submission
+from app.services.user_summaries import user_summary
+from app.services.queries import (
+    SUBMITTED_QUESTION_SET_FIELD, available_question_sets_pipeline, student_submission_filter, student_submissions_filter,
+)
+from app.services.link_resolver import resolve_users, resolve_users_from_summaries, resolve_question_sets_for_student
+from app.services.pagination import PageParams, paginate, set_next_cursor
+from app.services.question_set_stats import scores_of, record_submission_change
+from app.services.change_versions import (
+    ConditionalListing, QUESTION_SETS_KEY, USERS_KEY, bump_versions, question_set_key, student_key,
+)
+from app.core.config import settings
 
 router = APIRouter()
 
 @router.get("/question-sets", response_model=List[QuestionSetForStudentOut])
-async def get_available_question_sets(current_user: User = Depends(get_current_user)):
+async def get_available_question_sets(
+    request: Request,
+    page: PageParams = Depends(),
+    current_user: Principal = Depends(get_current_principal)
+):
+    """Question sets the student can still answer. Supports If-None-Match."""
     if current_user.role != "student":
         raise HTTPException(status.HTTP_403_FORBIDDEN, "Access denied.")
 
-    submitted_docs = [s async for s in Submission.find(Submission.student.id == current_user.id)]
-    submitted_qset_ids = [s.question_set.ref.id for s in submitted_docs]
-
-    unsubmitted_qsets_docs = [qs async for qs in QuestionSet.find({"_id": {"$nin": submitted_qset_ids}})]
+    # Submitting removes a set from the list; new sets and renamed creators change it too.
+    listing = ConditionalListing(request, [student_key(current_user.id), QUESTION_SETS_KEY, USERS_KEY])
+    cached = await listing.cached_response()
+    if cached is not None:
+        return cached
 
-    creator_ids = list(set([qs.creator.ref.id for qs in unsubmitted_qsets_docs]))
-    creators_cursor = User.find({"_id": {"$in": creator_ids}})
-    creators = [c async for c in creators_cursor]
-    creators_map = {creator.id: creator for creator in creators}
+    submitted_qset_ids = await Submission.distinct(SUBMITTED_QUESTION_SET_FIELD, student_submissions_filter(current_user.id))
+    pipeline = available_question_sets_pipeline(current_user.id, submitted_qset_ids, page)
 
-    available_qsets = []
-    for qs in unsubmitted_qsets_docs:
-        is_public = not qs.assigned_students
-        is_assigned = not is_public and current_user.id in [link.ref.id for link in qs.assigned_students]
+    if settings.DENORMALIZED_READS:
+        rows = await QuestionSet.aggregate(pipeline, projection_model=QuestionSetStudentRow).to_list()
+        rows, next_cursor = page.split(rows)
+        creators_map = await resolve_users_from_summaries((qs.creator.ref.id, qs.creator_summary) for qs in rows)
+        available_qsets = [
+            {**qs.model_dump(mode="json", exclude={'creator', 'creator_summary'}), "creator": creators_map[qs.creator.ref.id]}
+            for qs in rows
+            if qs.creator.ref.id in creators_map
+        ]
+    else:
+        pipeline += [
+            {"$lookup": {
+                "from": User.get_collection_name(),
+                "localField": "creator.$id",
+                "foreignField": "_id",
+                "as": "creator",
+            }},
+            {"$unwind": "$creator"},
+            {"$project": {
+                "title": 1, "question": 1,
+                "creator._id": 1, "creator.username": 1, "creator.email": 1, "creator.role": 1,
+            }},
+        ]
+        docs, next_cursor = page.split(await QuestionSet.aggregate(pipeline).to_list(), id_of=lambda doc: doc["_id"])
+        available_qsets = [
+            {
+                "id": str(doc["_id"]),
+                "title": doc["title"],
+                "question": doc["question"],
+                "creator": {
+                    "id": str(doc["creator"]["_id"]),
+                    "username": doc["creator"]["username"],
+                    "email": doc["creator"]["email"],
+                    "role": doc["creator"]["role"],
+                },
+            }
+            for doc in docs
+        ]
 
-        if is_public or is_assigned:
-            creator_doc = creators_map.get(qs.creator.ref.id)
-            if creator_doc:
-                creator_out = UserOut.model_validate(creator_doc, from_attributes=True)
-                qset_out = QuestionSetForStudentOut(**qs.model_dump(exclude={'creator'}), creator=creator_out)
-                available_qsets.append(qset_out)
-
-    return available_qsets
+    response = ORJSONResponse(available_qsets)
+    set_next_cursor(response, next_cursor)
+    return listing.finish(response)
 
 @router.post("/submissions", response_model=SubmissionResultOut, status_code=status.HTTP_201_CREATED)
 async def create_submission(
+    sub_data: SubmissionCreate,
+    response: Response,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Submits an answer. In "async" grading mode the submission is stored as
+    pending and 202 is returned; poll GET /submissions/{sub_id} for the grade.
+    """
+    if current_user.role != "student":
+        raise HTTPException(status.HTTP_403_FORBIDDEN, "Only students can submit answers.")
+
+    question_set = await QuestionSet.get(PydanticObjectId(sub_data.question_set_id))
+    if not question_set:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Question set not found.")
+
+    existing = await Submission.find_one(student_submission_filter(question_set.id, current_user.id))
+    if existing and existing.status != "failed":
+        raise HTTPException(status.HTTP_400_BAD_REQUEST, "You have already submitted an answer for this set.")
+
+    if settings.GRADING_MODE == "async":
+        if existing:
+            submission = existing
+            await submission.set({
+                Submission.student_answer: sub_data.answer,
+                Submission.status: "pending",
+                Submission.grading_attempts: 0,
+            })
+        else:
+            submission = Submission(
+                question_set=question_set,
+                student=current_user,
+                student_summary=user_summary(current_user),
+                student_answer=sub_data.answer,
+                status="pending"
+            )
+            try:
+                await submission.insert()
+            except DuplicateKeyError:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, "You have already submitted an answer for this set.")
+            await record_submission_change(question_set.id, after=scores_of(submission))
+        enqueue_submission(submission.id)
+        response.status_code = status.HTTP_202_ACCEPTED
+    else:
+        evaluation = await evaluate_answer_for_set(
+            question_set, sub_data.answer, Requester.student(current_user.id, question_set.creator.ref.id)
+        )
+        if evaluation["score"] == -1:
+            raise evaluation_failure(evaluation)
+
+        if existing:
+            await existing.delete()
+            await record_submission_change(question_set.id, before=scores_of(existing))
+        submission = Submission(
+            question_set=question_set,
+            student=current_user,
+            student_summary=user_summary(current_user),
+            student_answer=sub_data.answer,
+            ai_score=evaluation["score"],
+            ai_feedback=evaluation["feedback"],
+            grading_source=evaluation["grading_source"],
+            similar_to=evaluation["similar_to"]
+        )
+        try:
+            await submission.insert()
+        except DuplicateKeyError:
+            raise HTTPException(status.HTTP_400_BAD_REQUEST, "You have already submitted an answer for this set.")
+        await record_submission_change(question_set.id, after=scores_of(submission))
+        remember_graded_answer(question_set.id, submission)
+    await bump_versions([student_key(current_user.id), question_set_key(question_set.id)])
+
+    creators_map = await resolve_users([question_set.creator.ref.id])
+    creator_out = creators_map.get(question_set.creator.ref.id)
+    if not creator_out:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Question set creator not found.")
+    qset_out = QuestionSetForStudentOut(**question_set.model_dump(exclude={'creator'}), creator=creator_out)
+
+    return SubmissionResultOut(**submission.model_dump(exclude={'question_set', 'student'}), question_set=qset_out)
+
+@router.post("/submissions/stream")
+async def create_submission_streaming(
     sub_data: SubmissionCreate,
     current_user: User = Depends(get_current_user)
 ):
+    """
+    Submits an answer and streams the AI feedback as Server-Sent Events
+    (`score`, `feedback`, then `done` or `error`). The submission is only
+    stored once the evaluation has completed; `done` carries its id.
+    Grading and storing run independently of the connection, so a client
+    that disconnects mid-stream still finds its submission afterwards.
+    """
     if current_user.role != "student":
         raise HTTPException(status.HTTP_403_FORBIDDEN, "Only students can submit answers.")
 
@@ -50,56 +189,96 @@ async def create_submission(
     if not question_set:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Question set not found.")
 
-    existing = await Submission.find_one(Submission.question_set.id == question_set.id, Submission.student.id == current_user.id)
-    if existing:
+    existing = await Submission.find_one(student_submission_filter(question_set.id, current_user.id))
+    if existing and existing.status != "failed":
         raise HTTPException(status.HTTP_400_BAD_REQUEST, "You have already submitted an answer for this set.")
 
-    evaluation = await get_ai_evaluation(question_set.model_answer, sub_data.answer)
-    if evaluation["score"] == -1:
-        raise HTTPException(status.HTTP_500_INTERNAL_SERVER_ERROR, evaluation["feedback"])
+    async def event_stream():
+        prescored = await prescore_answer(question_set, sub_data.answer)
+        if prescored is not None:
+            events = replay_evaluation({"score": prescored["score"], "feedback": prescored["feedback"]})
+        else:
+            events = stream_ai_evaluation(
+                question_set.model_answer, sub_data.answer, Requester.student(current_user.id, question_set.creator.ref.id)
+            )
+        grading = prescored or {"grading_source": "llm", "similar_to": None}
+
+        async for event in events:
+            event_type = event.pop("type")
+            if event_type == "done":
+                if existing:
+                    await existing.delete()
+                    await record_submission_change(question_set.id, before=scores_of(existing))
+                submission = Submission(
+                    question_set=question_set,
+                    student=current_user,
+                    student_summary=user_summary(current_user),
+                    student_answer=sub_data.answer,
+                    ai_score=event["score"],
+                    ai_feedback=event["feedback"],
+                    grading_source=grading["grading_source"],
+                    similar_to=grading["similar_to"]
+                )
+                try:
+                    await submission.insert()
+                except DuplicateKeyError:
+                    yield format_sse("error", {"detail": "You have already submitted an answer for this set."})
+                    return
+                await record_submission_change(question_set.id, after=scores_of(submission))
+                remember_graded_answer(question_set.id, submission)
+                await bump_versions([student_key(current_user.id), question_set_key(question_set.id)])
+                event["id"] = str(submission.id)
+            yield format_sse(event_type, event)
 
-    submission = Submission(
-        question_set=question_set,
-        student=current_user,
-        student_answer=sub_data.answer,
-        ai_score=evaluation["score"],
-        ai_feedback=evaluation["feedback"]
+    return StreamingResponse(
+        relay_detached(event_stream(), EVALUATION_ERROR_MESSAGE), media_type="text/event-stream", headers=SSE_HEADERS
     )
-    await submission.insert()
-    
-    creator_doc = await User.get(question_set.creator.ref.id)
-    creator_out = UserOut.model_validate(creator_doc, from_attributes=True)
+
+@router.get("/submissions/{sub_id}", response_model=SubmissionResultOut)
+async def get_my_submission(sub_id: PydanticObjectId, current_user: Principal = Depends(get_current_principal)):
+    """Returns one of the caller's submissions; used to poll the grading status."""
+    submission = await Submission.get(sub_id)
+    if not submission or submission.student.ref.id != current_user.id:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Submission not found.")
+
+    question_set = await QuestionSet.get(submission.question_set.ref.id)
+    if not question_set:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Question set not found.")
+
+    creators_map = await resolve_users([question_set.creator.ref.id])
+    creator_out = creators_map.get(question_set.creator.ref.id)
+    if not creator_out:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Question set creator not found.")
     qset_out = QuestionSetForStudentOut(**question_set.model_dump(exclude={'creator'}), creator=creator_out)
 
     return SubmissionResultOut(**submission.model_dump(exclude={'question_set', 'student'}), question_set=qset_out)
 
 @router.get("/submissions", response_model=List[SubmissionResultOut])
-async def get_my_submissions(current_user: User = Depends(get_current_user)):
+async def get_my_submissions(
+    request: Request,
+    page: PageParams = Depends(),
+    current_user: Principal = Depends(get_current_principal)
+):
+    """The student's submissions with their grades. Supports If-None-Match."""
     if current_user.role != "student":
         raise HTTPException(status.HTTP_403_FORBIDDEN, "Access denied.")
 
-    submissions_docs = [sub async for sub in Submission.find(Submission.student.id == current_user.id)]
-    
-    response = []
-    if submissions_docs:
-        qset_ids = list(set([sub.question_set.ref.id for sub in submissions_docs]))
-        qsets_cursor = QuestionSet.find({"_id": {"$in": qset_ids}})
-        qsets = [qs async for qs in qsets_cursor]
-        
-        creator_ids = list(set([qs.creator.ref.id for qs in qsets]))
-        creators_cursor = User.find({"_id": {"$in": creator_ids}})
-        creators = [c async for c in creators_cursor]
-        creators_map = {creator.id: UserOut.model_validate(creator, from_attributes=True) for creator in creators}
-
-        qsets_map = {}
-        for qset in qsets:
-            creator_out = creators_map.get(qset.creator.ref.id)
-            if creator_out:
-                qsets_map[qset.id] = QuestionSetForStudentOut(**qset.model_dump(exclude={'creator'}), creator=creator_out)
-        
-        for sub in submissions_docs:
-            qset_out = qsets_map.get(sub.question_set.ref.id)
-            if qset_out:
-                response.append(SubmissionResultOut(**sub.model_dump(exclude={'question_set', 'student'}), question_set=qset_out))
-                
-    return response
+    listing = ConditionalListing(request, [student_key(current_user.id), USERS_KEY])
+    cached = await listing.cached_response()
+    if cached is not None:
+        return cached
+
+    submissions_rows, next_cursor = await paginate(
+        Submission, student_submissions_filter(current_user.id), page, projection_model=SubmissionStudentRow
+    )
+    qsets_map = await resolve_question_sets_for_student(sub.question_set.ref.id for sub in submissions_rows)
+
+    submissions_out = []
+    for sub in submissions_rows:
+        qset_out = qsets_map.get(sub.question_set.ref.id)
+        if qset_out:
+            submissions_out.append({**sub.model_dump(mode="json", exclude={'question_set'}), "question_set": qset_out})
+
+    response = ORJSONResponse(submissions_out)
+    set_next_cursor(response, next_cursor)
+    return listing.finish(response)
@@ -1,10 +1,31 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+from typing import List, Literal
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import StreamingResponse
 from beanie.odm.fields import PydanticObjectId
-from app.db.database import User, QuestionSet, Submission
-from app.models.teacher_models import QuestionSetCreate, QuestionSetOut, SubmissionReviewOut, ScoreUpdate
-from app.models.user_models import UserOut
-from app.services.auth_dependencies import get_current_user
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from app.db.database import User, QuestionSet, Submission, QuestionSetStats, EmbeddedUser
+from app.models.teacher_models import QuestionSetCreate, QuestionSetOut, SubmissionReviewOut, ScoreUpdate, QuestionSetAnalyticsOut
+from app.models.teacher_models import BulkScoreUpdate, BulkScoreUpdateItemResult, BulkScoreUpdateResponse, ImportReport
+from app.models.teacher_models import SimilarityClusterOut
+from app.models.user_models import UserOut, Principal
+from app.models.projection_models import QuestionSetTeacherRow, SubmissionReviewRow
+from app.core.responses import ORJSONResponse
+from app.services.user_summaries import user_summary
+from app.services.link_resolver import resolve_users, resolve_users_from_summaries
+from app.services.pagination import PageParams, paginate, set_next_cursor
+from app.services.similarity import find_plagiarism_clusters
+from app.services.bulk_import import import_question_sets, import_students
+from app.services.submission_export import export_submissions, EXPORT_MEDIA_TYPES
+from app.services.question_set_stats import (
+    scores_of, record_submission_change, record_submission_changes, recompute_question_set_stats,
+)
+from app.services.change_versions import (
+    ConditionalListing, QUESTION_SETS_KEY, USERS_KEY, bump_versions, question_set_key, student_key,
+)
+from app.core.config import settings
+from app.services.queries import question_set_submissions_filter, teacher_question_sets_filter
+from app.services.auth_dependencies import get_current_user, get_current_principal, get_verified_principal
 
 router = APIRouter()
 
@@ -25,77 +46,326 @@ async def create_question_set(qs_data: QuestionSetCreate, current_user: User = D
         question=qs_data.question,
         model_answer=qs_data.model_answer,
         creator=current_user,
-        assigned_students=assigned_student_list
+        assigned_students=assigned_student_list,
+        is_public=not assigned_student_list,
+        creator_summary=user_summary(current_user),
+        assigned_summaries=[user_summary(s) for s in assigned_student_list]
     )
     await question_set.insert()
+    await bump_versions([QUESTION_SETS_KEY])
     
     creator_out = UserOut.model_validate(current_user, from_attributes=True)
     assigned_students_out = [UserOut.model_validate(s, from_attributes=True) for s in assigned_student_list]
     
     return QuestionSetOut(
-        **question_set.model_dump(exclude={'creator', 'assigned_students'}),
+        **question_set.model_dump(exclude={'creator', 'assigned_students', 'creator_summary', 'assigned_summaries'}),
         creator=creator_out,
         assigned_students=assigned_students_out
     )
 
+@router.post("/question-sets/import", response_model=ImportReport)
+async def import_question_sets_from_jsonl(
+    file: UploadFile = File(..., description="One QuestionSetCreate object per line."),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Creates many question sets from a JSONL file. Valid rows are created;
+    the others are listed with their line number in the report.
+    """
+    if current_user.role != "teacher":
+        raise HTTPException(status.HTTP_403_FORBIDDEN, "Only teachers can create question sets.")
+    return await import_question_sets(file, current_user)
+
+@router.post("/students/import", response_model=ImportReport)
+async def import_student_roster(
+    file: UploadFile = File(..., description="One {username, email, password} object per line."),
+    current_user: Principal = Depends(get_verified_principal)
+):
+    """Creates student accounts from a JSONL roster, reporting rejected rows by line number."""
+    if current_user.role != "teacher":
+        raise HTTPException(status.HTTP_403_FORBIDDEN, "Only teachers can import students.")
+    return await import_students(file)
+
 @router.get("/question-sets", response_model=List[QuestionSetOut])
-async def get_teacher_question_sets(current_user: User = Depends(get_current_user)):
+async def get_teacher_question_sets(
+    page: PageParams = Depends(),
+    current_user: Principal = Depends(get_current_principal)
+):
     if current_user.role != "teacher":
         raise HTTPException(status.HTTP_403_FORBIDDEN, "Access denied.")
     
-    q_sets_docs = [qs async for qs in QuestionSet.find(QuestionSet.creator.id == current_user.id)]
-    
-    response = []
-    creator_out = UserOut.model_validate(current_user, from_attributes=True)
-    for qs in q_sets_docs:
-        assigned_students_out = []
-        if qs.assigned_students:
-            student_ids = [link.ref.id for link in qs.assigned_students]
-            students = [s async for s in User.find({"_id": {"$in": student_ids}})]
-            assigned_students_out = [UserOut.model_validate(s, from_attributes=True) for s in students]
-
-        response.append(QuestionSetOut(
-            **qs.model_dump(exclude={'creator', 'assigned_students'}), 
-            creator=creator_out,
-            assigned_students=assigned_students_out
-        ))
+    q_sets_rows, next_cursor = await paginate(
+        QuestionSet, teacher_question_sets_filter(current_user.id), page, projection_model=QuestionSetTeacherRow
+    )
+    student_refs = []
+    for qs in q_sets_rows:
+        summaries = {summary.id: summary for summary in qs.assigned_summaries}
+        student_refs.extend((link.ref.id, summaries.get(link.ref.id)) for link in qs.assigned_students)
+    students_map = await resolve_users_from_summaries(student_refs)
+
+    q_sets_out = []
+    creator_out = UserOut.model_validate(current_user, from_attributes=True).model_dump(mode="json")
+    for qs in q_sets_rows:
+        q_sets_out.append({
+            **qs.model_dump(mode="json", exclude={'assigned_students', 'assigned_summaries'}),
+            "creator": creator_out,
+            "assigned_students": [
+                students_map[link.ref.id] for link in qs.assigned_students if link.ref.id in students_map
+            ],
+        })
+
+    response = ORJSONResponse(q_sets_out)
+    set_next_cursor(response, next_cursor)
     return response
 
 @router.get("/question-sets/{qs_id}/submissions", response_model=List[SubmissionReviewOut])
-async def get_submissions_for_set(qs_id: PydanticObjectId, current_user: User = Depends(get_current_user)):
-    question_set = await QuestionSet.get(qs_id)
-    if not question_set or question_set.creator.ref.id != current_user.id:
+async def get_submissions_for_set(
+    request: Request,
+    qs_id: PydanticObjectId,
+    page: PageParams = Depends(),
+    current_user: Principal = Depends(get_current_principal)
+):
+    """The submissions to one of the teacher's question sets. Supports If-None-Match."""
+    if not await QuestionSet.find({"_id": qs_id, "creator.$id": current_user.id}).count():
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Question set not found or access denied.")
-    
-    submissions_docs = [sub async for sub in Submission.find(Submission.question_set.id == question_set.id)]
-    
-    response = []
-    if submissions_docs:
-        student_ids = list(set([sub.student.ref.id for sub in submissions_docs]))
-        students_cursor = User.find({"_id": {"$in": student_ids}})
-        students = [s async for s in students_cursor]
-        students_map = {student.id: UserOut.model_validate(student, from_attributes=True) for student in students}
-        
-        for sub in submissions_docs:
-            student_out = students_map.get(sub.student.ref.id)
-            if student_out:
-                response.append(SubmissionReviewOut(**sub.model_dump(exclude={'student'}), student=student_out))
-    return response
+
+    listing = ConditionalListing(request, [question_set_key(qs_id), USERS_KEY])
+    cached = await listing.cached_response()
+    if cached is not None:
+        return cached
+
+    submissions_rows, next_cursor = await paginate(
+        Submission, question_set_submissions_filter(qs_id), page, projection_model=SubmissionReviewRow
+    )
+    students_map = await resolve_users_from_summaries((sub.student.ref.id, sub.student_summary) for sub in submissions_rows)
+
+    submissions_out = []
+    for sub in submissions_rows:
+        student_out = students_map.get(sub.student.ref.id)
+        if student_out:
+            submissions_out.append({**sub.model_dump(mode="json", exclude={'student', 'student_summary'}), "student": student_out})
+
+    response = ORJSONResponse(submissions_out)
+    set_next_cursor(response, next_cursor)
+    return listing.finish(response)
         
+@router.get("/question-sets/{qs_id}/submissions/export")
+async def export_submissions_for_set(
+    qs_id: PydanticObjectId,
+    export_format: Literal["csv", "jsonl"] = Query("csv", alias="format"),
+    batch_size: int = Query(settings.EXPORT_BATCH_SIZE, ge=1, le=10000),
+    current_user: Principal = Depends(get_current_principal)
+):
+    """
+    Streams the grades of every submission of a question set as CSV or
+    JSON Lines. Rows are read and written in batches, so memory use does
+    not grow with the number of submissions.
+    """
+    if not await QuestionSet.find({"_id": qs_id, "creator.$id": current_user.id}).count():
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Question set not found or access denied.")
+
+    return StreamingResponse(
+        export_submissions(qs_id, export_format, batch_size),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f'attachment; filename="submissions-{qs_id}.{export_format}"'},
+    )
+
+@router.get("/question-sets/{qs_id}/similarity-clusters", response_model=List[SimilarityClusterOut])
+async def get_similarity_clusters(qs_id: PydanticObjectId, current_user: Principal = Depends(get_current_principal)):
+    """Groups of submissions whose answers are near copies of each other; likely plagiarism."""
+    if not await QuestionSet.find({"_id": qs_id, "creator.$id": current_user.id}).count():
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Question set not found or access denied.")
+
+    clusters = await find_plagiarism_clusters(qs_id)
+    students_map = await resolve_users_from_summaries(
+        (student_id, EmbeddedUser(**summary) if summary else None)
+        for cluster in clusters
+        for student_id, summary in cluster["students"]
+    )
+    return [
+        SimilarityClusterOut(
+            submission_ids=cluster["submission_ids"],
+            students=[students_map[student_id] for student_id, _ in cluster["students"] if student_id in students_map],
+            min_similarity=cluster["min_similarity"],
+        )
+        for cluster in clusters
+    ]
+
+@router.get("/question-sets/{qs_id}/analytics", response_model=QuestionSetAnalyticsOut)
+async def get_question_set_analytics(qs_id: PydanticObjectId, current_user: Principal = Depends(get_current_principal)):
+    """
+    Score distribution, means and AI-vs-final drift of a question set. Read
+    from its running statistics, so the cost does not grow with the number
+    of submissions.
+    """
+    if not await QuestionSet.find({"_id": qs_id, "creator.$id": current_user.id}).count():
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Question set not found or access denied.")
+
+    stats = await QuestionSetStats.get(qs_id) or QuestionSetStats(id=qs_id)
+
+    def mean(total, count):
+        return total / count if count else None
+
+    def histogram(buckets):
+        counts = {score: 0 for score in range(11)}
+        counts.update({int(score): n for score, n in buckets.items() if n})
+        return dict(sorted(counts.items()))
+
+    return QuestionSetAnalyticsOut(
+        question_set_id=qs_id,
+        submission_count=stats.submission_count,
+        ai_scored_count=stats.ai_count,
+        ai_score_mean=mean(stats.ai_sum, stats.ai_count),
+        ai_score_histogram=histogram(stats.ai_histogram),
+        finalized_count=stats.final_count,
+        final_score_mean=mean(stats.final_sum, stats.final_count),
+        final_score_histogram=histogram(stats.final_histogram),
+        drift_mean=mean(stats.drift_sum, stats.drift_count),
+        drift_abs_mean=mean(stats.drift_abs_sum, stats.drift_count),
+    )
+
+@router.put("/submissions/finalize", response_model=BulkScoreUpdateResponse)
+async def finalize_scores(scores: BulkScoreUpdate, current_user: Principal = Depends(get_verified_principal)):
+    """
+    Finalizes the scores of many submissions at once. All items are
+    authorized with one query and written with one unordered bulk_write;
+    items that cannot be applied carry an error instead of failing the
+    whole request. Each write only applies if the final score is still the
+    one read for the statistics; a submission finalized concurrently is
+    reported as a conflict.
+    """
+    if current_user.role != "teacher":
+        raise HTTPException(status.HTTP_403_FORBIDDEN, "Access denied.")
+
+    if len(scores.items) > settings.FINALIZE_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            f"A request may finalize at most {settings.FINALIZE_BATCH_MAX_ITEMS} submissions.",
+        )
+
+    # Only the submissions of question sets created by this teacher.
+    pipeline = [
+        {"$match": {"_id": {"$in": list({item.sub_id for item in scores.items})}}},
+        {"$lookup": {
+            "from": QuestionSet.get_collection_name(),
+            "localField": "question_set.$id",
+            "foreignField": "_id",
+            "as": "owner",
+        }},
+        {"$match": {"owner.creator.$id": current_user.id}},
+        {"$project": {"question_set": 1, "student": 1, "ai_score": 1, "final_score": 1}},
+    ]
+    owned = {doc["_id"]: doc async for doc in Submission.get_motor_collection().aggregate(pipeline)}
+
+    results = []
+    operations = []
+    changes = []
+    # position in `results` of the item written by each operation
+    operation_items = []
+    # the submission written by each operation, as it was before
+    operation_docs = []
+    seen = set()
+    for index, item in enumerate(scores.items):
+        if item.sub_id in seen:
+            results.append(BulkScoreUpdateItemResult(index=index, sub_id=item.sub_id, error="Duplicate submission id."))
+            continue
+        seen.add(item.sub_id)
+
+        previous = owned.get(item.sub_id)
+        if previous is None:
+            results.append(BulkScoreUpdateItemResult(
+                index=index, sub_id=item.sub_id, error="Submission not found or access denied."
+            ))
+            continue
+
+        operation_items.append(len(results))
+        operation_docs.append(previous)
+        operations.append(UpdateOne(
+            {"_id": item.sub_id, "final_score": previous.get("final_score")},
+            {"$set": {"final_score": item.final_score}},
+        ))
+        changes.append((
+            previous["question_set"].id,
+            scores_of(previous),
+            {**scores_of(previous), "final_score": item.final_score},
+        ))
+        results.append(BulkScoreUpdateItemResult(index=index, sub_id=item.sub_id, final_score=item.final_score))
+
+    failed = set()
+    # question sets whose statistics are rebuilt instead of updated
+    recount = set()
+    if operations:
+        collection = Submission.get_motor_collection()
+        try:
+            matched = (await collection.bulk_write(operations, ordered=False)).matched_count
+        except BulkWriteError as e:
+            matched = e.details.get("nMatched", 0)
+            for error in e.details.get("writeErrors", []):
+                failed.add(error["index"])
+                result = results[operation_items[error["index"]]]
+                result.final_score, result.error = None, error.get("errmsg", "Update failed.")
+
+        if matched < len(operations) - len(failed):
+            # Some submissions changed since they were read. Those that do
+            # not hold the requested score now were not written by us.
+            pending = [n for n in range(len(operations)) if n not in failed]
+            current = {
+                doc["_id"]: doc.get("final_score")
+                async for doc in collection.find({"_id": {"$in": [operation_docs[n]["_id"] for n in pending]}}, {"final_score": 1})
+            }
+            for n in pending:
+                result = results[operation_items[n]]
+                if current.get(operation_docs[n]["_id"]) != result.final_score:
+                    failed.add(n)
+                    result.final_score, result.error = None, "The submission was changed concurrently; reload it and try again."
+            if matched < len(operations) - len(failed):
+                # A concurrent write set the same score, so which of these
+                # writes applied is unknown; count their sets from scratch.
+                recount = {operation_docs[n]["question_set"].id for n in pending if n not in failed}
+
+        await record_submission_changes(
+            change for n, change in enumerate(changes) if n not in failed and change[0] not in recount
+        )
+        for qset_id in recount:
+            await recompute_question_set_stats(qset_id)
+        written = [doc for n, doc in enumerate(operation_docs) if n not in failed]
+        await bump_versions(
+            [student_key(doc["student"].id) for doc in written] + [question_set_key(doc["question_set"].id) for doc in written]
+        )
+
+    return BulkScoreUpdateResponse(updated=len(operations) - len(failed), results=results)
+
 @router.put("/submissions/{sub_id}/finalize", response_model=SubmissionReviewOut)
-async def finalize_score(sub_id: PydanticObjectId, score_update: ScoreUpdate, current_user: User = Depends(get_current_user)):
+async def finalize_score(sub_id: PydanticObjectId, score_update: ScoreUpdate, current_user: Principal = Depends(get_verified_principal)):
     submission = await Submission.get(sub_id)
     if not submission:
         raise HTTPException(status.HTTP_404_NOT_FOUND, "Submission not found.")
     
-    question_set = await QuestionSet.get(submission.question_set.ref.id)
-    if not question_set or question_set.creator.ref.id != current_user.id:
+    if not await QuestionSet.find({"_id": submission.question_set.ref.id, "creator.$id": current_user.id}).count():
         raise HTTPException(status.HTTP_403_FORBIDDEN, "Access denied.")
 
+    # Atomic, so that the statistics are updated from the exact previous score.
+    previous = await Submission.get_motor_collection().find_one_and_update(
+        {"_id": sub_id},
+        {"$set": {"final_score": score_update.final_score}},
+        return_document=ReturnDocument.BEFORE,
+    )
+    if previous is None:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Submission not found.")
+    await record_submission_change(
+        submission.question_set.ref.id,
+        before=scores_of(previous),
+        after={**scores_of(previous), "final_score": score_update.final_score},
+    )
+    await bump_versions([student_key(submission.student.ref.id), question_set_key(submission.question_set.ref.id)])
     submission.final_score = score_update.final_score
-    await submission.save()
-    
-    student = await User.get(submission.student.ref.id)
-    student_out = UserOut.model_validate(student, from_attributes=True)
+    submission.ai_score = previous.get("ai_score")
+    submission.ai_feedback = previous.get("ai_feedback")
+    submission.status = previous.get("status", submission.status)
+
+    students_map = await resolve_users([submission.student.ref.id])
+    student_out = students_map.get(submission.student.ref.id)
+    if not student_out:
+        raise HTTPException(status.HTTP_404_NOT_FOUND, "Student not found.")
 
     return SubmissionReviewOut(**submission.model_dump(exclude={'student'}), student=student_out)
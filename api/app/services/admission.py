@@ -0,0 +1,212 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from app.core.config import settings
+
+# Lower values are admitted first.
+PRIORITY_STUDENT = 0
+PRIORITY_TEACHER = 1
+
+class AdmissionRejected(Exception):
+    """An evaluation was shed: a budget is used up or the queue is full. Maps to 429 + Retry-After."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = retry_after
+
+class Requester:
+    """
+    Who an evaluation is for: the user it is charged to, the teacher whose
+    budget it also counts against (the question set's creator, or the
+    teacher themself) and its priority class.
+    """
+
+    def __init__(self, user_id, teacher_id=None, priority: int = PRIORITY_TEACHER):
+        self.user_id = str(user_id)
+        self.teacher_id = str(teacher_id) if teacher_id is not None else None
+        self.priority = priority
+
+    @classmethod
+    def student(cls, student_id, teacher_id) -> "Requester":
+        return cls(student_id, teacher_id, PRIORITY_STUDENT)
+
+    @classmethod
+    def teacher(cls, teacher_id) -> "Requester":
+        return cls(teacher_id, teacher_id, PRIORITY_TEACHER)
+
+class SlidingWindowBudget:
+    """
+    At most `limit` tokens per key in any `window` seconds. Reservations
+    are made with the estimated tokens and corrected with the actual usage
+    once it is known. A limit of 0 disables the budget.
+    """
+
+    def __init__(self, name: str, limit: int, window: float):
+        self.name = name
+        self.limit = limit
+        self.window = window
+        # key -> deque of [time, tokens]
+        self._usage: Dict[str, deque] = {}
+
+    def _entries(self, key: str) -> deque:
+        entries = self._usage.get(key)
+        if entries is None:
+            entries = self._usage[key] = deque()
+        horizon = time.monotonic() - self.window
+        while entries and entries[0][0] <= horizon:
+            entries.popleft()
+        return entries
+
+    def reserve(self, key: str, tokens: int) -> Optional[list]:
+        """Reserves tokens for key; raises AdmissionRejected if they do not fit."""
+        if self.limit <= 0 or key is None:
+            return None
+        # A request larger than the whole budget would otherwise never fit.
+        tokens = min(tokens, self.limit)
+        entries = self._entries(key)
+        used = sum(entry[1] for entry in entries)
+        if used + tokens > self.limit:
+            # Wait until enough of the oldest usage has left the window.
+            excess = used + tokens - self.limit
+            retry_after = self.window
+            for entry_time, entry_tokens in entries:
+                excess -= entry_tokens
+                if excess <= 0:
+                    retry_after = entry_time + self.window - time.monotonic()
+                    break
+            raise AdmissionRejected(f"The {self.name} evaluation budget is used up.", max(1.0, retry_after))
+        entry = [time.monotonic(), tokens]
+        entries.append(entry)
+        return entry
+
+    def settle(self, entry: Optional[list], tokens: int):
+        """Replaces a reservation's estimate with the tokens actually used (0 to refund it)."""
+        if entry is not None:
+            entry[1] = min(tokens, self.limit)
+
+class AdmissionController:
+    """
+    Admits at most `max_in_flight` evaluations at a time. Waiting
+    evaluations are admitted by priority, then in arrival order. An
+    evaluation is shed instead of queued when its class already has
+    `max_queued` waiting, or when it has waited `max_wait` seconds.
+    """
+
+    def __init__(self, max_in_flight: int, max_queued: Dict[int, int], max_wait: float):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.max_wait = max_wait
+        self._in_flight = 0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._queued = {priority: 0 for priority in max_queued}
+        self._seq = itertools.count()
+        # Moving average of how long an admitted evaluation takes.
+        self._service_seconds = 1.0
+
+    def retry_after(self) -> float:
+        waiting = sum(self._queued.values()) + 1
+        return max(1.0, waiting * self._service_seconds / self.max_in_flight)
+
+    def _next(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._in_flight -= 1
+
+    async def _acquire(self, priority: int):
+        if self._in_flight < self.max_in_flight and not self._waiters:
+            self._in_flight += 1
+            return
+        if self._queued[priority] >= self.max_queued[priority]:
+            raise AdmissionRejected("Too many evaluations are waiting.", self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = (priority, next(self._seq), future)
+        heapq.heappush(self._waiters, waiter)
+        self._queued[priority] += 1
+        try:
+            # The slot is handed over by _next, so _in_flight already counts it.
+            await asyncio.wait_for(future, self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                self._next()
+            elif waiter in self._waiters:
+                # _next may already have popped and skipped the cancelled waiter.
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            if isinstance(e, asyncio.TimeoutError):
+                raise AdmissionRejected("Evaluations are backed up; try again shortly.", self.retry_after())
+            raise
+        finally:
+            self._queued[priority] -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int):
+        await self._acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_seconds = 0.9 * self._service_seconds + 0.1 * (time.monotonic() - started)
+            self._next()
+
+class Ticket:
+    """An admitted evaluation; `report` the actual token usage once it is known."""
+
+    def __init__(self, estimated_tokens: int):
+        self.tokens = estimated_tokens
+        self.reported = False
+
+    def report(self, tokens: Optional[int]):
+        if tokens is not None:
+            self.tokens = tokens
+            self.reported = True
+
+admission_controller = AdmissionController(
+    settings.ADMISSION_MAX_IN_FLIGHT,
+    {PRIORITY_STUDENT: settings.ADMISSION_MAX_QUEUED_STUDENT, PRIORITY_TEACHER: settings.ADMISSION_MAX_QUEUED_TEACHER},
+    settings.ADMISSION_MAX_WAIT_SECONDS,
+)
+user_budget = SlidingWindowBudget("user", settings.LLM_USER_TOKEN_BUDGET, settings.LLM_BUDGET_WINDOW_SECONDS)
+teacher_budget = SlidingWindowBudget("teacher", settings.LLM_TEACHER_TOKEN_BUDGET, settings.LLM_BUDGET_WINDOW_SECONDS)
+
+@asynccontextmanager
+async def admit(requester: Optional[Requester], estimated_tokens: int):
+    """
+    Admits one LLM evaluation. The estimated tokens are reserved in the
+    requester's user and teacher budgets and settled with the ticket's
+    tokens afterwards; a failed evaluation without reported usage is
+    refunded. Without a requester (internal callers) only the priority
+    queue applies, at teacher priority.
+
+    Raises:
+        AdmissionRejected: if a budget is used up or the queue is full.
+    """
+    user_entry = teacher_entry = None
+    if requester is not None:
+        user_entry = user_budget.reserve(requester.user_id, estimated_tokens)
+        try:
+            teacher_entry = teacher_budget.reserve(requester.teacher_id, estimated_tokens)
+        except AdmissionRejected:
+            user_budget.settle(user_entry, 0)
+            raise
+
+    ticket = Ticket(estimated_tokens)
+    try:
+        async with admission_controller.slot(requester.priority if requester else PRIORITY_TEACHER):
+            yield ticket
+    except BaseException:
+        if not ticket.reported:
+            ticket.tokens = 0
+        raise
+    finally:
+        user_budget.settle(user_entry, ticket.tokens)
+        teacher_budget.settle(teacher_entry, ticket.tokens)
@@ -1,47 +1,168 @@
-import json
-from groq import AsyncGroq 
+import math
+import re
+from typing import AsyncIterator, Dict, Optional
+from fastapi import HTTPException, status
 from app.core.config import settings
+from app.services.admission import AdmissionRejected, Requester, admit
+from app.services.evaluators import PROMPT_VERSION, SYSTEM_PROMPT, STREAM_SYSTEM_PROMPT, build_evaluator
+from app.services.llm_client import LLMUnavailableError
+from app.services.micro_batching import MicroBatcher
+from app.services.rate_limiter import estimate_tokens
+from app.services.evaluation_cache import make_cache_key, get_cached_evaluation, store_evaluation, invalidate_evaluation
 
-client = AsyncGroq(api_key=settings.GROQ_API_KEY)
+# The grading backend(s) selected by EVALUATOR_BACKENDS.
+evaluator = build_evaluator()
+# Concurrent evaluations against the same model answer share one LLM call.
+batcher = MicroBatcher(
+    evaluator,
+    settings.EVAL_MICROBATCH_MAX_SIZE,
+    settings.EVAL_MICROBATCH_WINDOW_MS / 1000,
+    settings.EVAL_MICROBATCH_MAX_TOKENS,
+)
 
-async def get_ai_evaluation(model_answer: str, student_answer: str) -> dict:
+_SCORE_LINE_RE = re.compile(r"SCORE:\s*(\d+)", re.IGNORECASE)
+
+EVALUATION_ERROR_MESSAGE = "An error occurred while evaluating the answer. Please try again."
+EVALUATION_UNAVAILABLE_MESSAGE = "The evaluation service is temporarily unavailable. Please try again shortly."
+
+def evaluation_failure(evaluation: dict) -> HTTPException:
+    """
+    The HTTP error for a failed evaluation (score -1): 429 with Retry-After
+    when admission control shed it, 503 with Retry-After when the provider
+    is unavailable, 500 otherwise.
+    """
+    if evaluation.get("rejected"):
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=evaluation["feedback"],
+            headers={"Retry-After": str(math.ceil(evaluation["retry_after"] or 1))},
+        )
+    if "retry_after" in evaluation:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=evaluation["feedback"],
+            headers={"Retry-After": str(math.ceil(evaluation["retry_after"] or 1))},
+        )
+    return HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=evaluation["feedback"])
+
+def _cache_keys(model_answer: str, student_answer: str) -> Dict[str, str]:
+    """
+    The cache key of the answer pair for each model of the evaluator,
+    preferred model first. Grades of a fallback model are cached under its
+    own name and served while the preferred model has none for the pair.
+    """
+    return {name: make_cache_key(model_answer, student_answer, name, PROMPT_VERSION) for name in evaluator.model_names}
+
+async def _store(cache_keys: Dict[str, str], model: Optional[str], result: dict):
+    if model in cache_keys:
+        await store_evaluation(cache_keys[model], result, model, PROMPT_VERSION)
+
+async def get_ai_evaluation(model_answer: str, student_answer: str, requester: Optional[Requester] = None) -> dict:
     """
-    Compares a student's answer to a model answer using the Groq LLM.
+    Compares a student's answer to a model answer using the configured
+    evaluator. Identical (normalized) answer pairs are served from the
+    evaluation cache; other evaluations go through admission control, are
+    charged to the requester's token budgets and may be graded together
+    with concurrent answers to the same model answer.
 
     Returns:
         A dictionary with 'score' and 'feedback'.
     """
-    system_prompt = """
-    You are an expert AI evaluator for an online learning platform. Your task is to evaluate a student's answer based on a model answer provided by the teacher.
+    cache_keys = _cache_keys(model_answer, student_answer)
+    cached = await get_cached_evaluation(*cache_keys.values())
+    if cached is not None:
+        return cached
+
+    try:
+        async with admit(requester, estimate_tokens(SYSTEM_PROMPT, model_answer, student_answer)) as ticket:
+            result = await batcher.evaluate(model_answer, student_answer)
+            ticket.report(result.pop("tokens", None))
+    except AdmissionRejected as e:
+        return {"score": -1, "feedback": e.message, "retry_after": e.retry_after, "rejected": True}
+    except LLMUnavailableError as e:
+        print(f"AI evaluation unavailable: {e}")
+        return {"score": -1, "feedback": EVALUATION_UNAVAILABLE_MESSAGE, "retry_after": e.retry_after}
+    except Exception as e:
+        print(f"An error occurred during AI evaluation: {e}")
+        return {"score": -1, "feedback": EVALUATION_ERROR_MESSAGE}
 
-    You must provide two things in your response:
-    1.  A 'score' from 0 to 10. The score should reflect how well the student's answer matches the key concepts of the model answer.
-    2.  A 'feedback' string. The feedback should be constructive, personalized, and written directly to the student. Explain what they did well and what they can improve.
+    await _store(cache_keys, result.pop("model"), result)
+    return result
 
-    Respond ONLY with a valid JSON object in the following format:
-    {"score": <integer>, "feedback": "<string>"}
+async def stream_ai_evaluation(
+    model_answer: str, student_answer: str, requester: Optional[Requester] = None
+) -> AsyncIterator[dict]:
     """
+    Streaming variant of get_ai_evaluation. Yields events as they become available:
 
+        {"type": "score", "score": int}       as soon as the score line is parsed
+        {"type": "feedback", "delta": str}    for each feedback fragment
+        {"type": "done", "score": int, "feedback": str}
+        {"type": "error", "detail": str}      instead of "done" on failure
+                                              (with "retry_after" if it was shed)
+    """
+    cache_keys = _cache_keys(model_answer, student_answer)
+    cached = await get_cached_evaluation(*cache_keys.values())
+    if cached is not None:
+        async for event in replay_evaluation(cached):
+            yield event
+        return
+
+    model = None
+    score = None
+    head = ""
+    feedback_parts = []
+    estimated_tokens = estimate_tokens(STREAM_SYSTEM_PROMPT, model_answer, student_answer)
     try:
-        chat_completion = await client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt,
-                },
-                {
-                    "role": "user",
-                    "content": f'Please evaluate the following submission:\n\n**Model Answer:** "{model_answer}"\n\n**Student\'s Answer:** "{student_answer}"',
-                },
-            ],
-            model="llama3-70b-8192",
-            temperature=0.2,
-            response_format={"type": "json_object"},
-        )
-        
-        response_content = chat_completion.choices[0].message.content
-        return json.loads(response_content)
+        async with admit(requester, estimated_tokens) as ticket:
+            async for model, delta in evaluator.stream(model_answer, student_answer):
+                if score is None:
+                    head += delta
+                    if "\n" not in head:
+                        continue
+                    score_line, delta = head.split("\n", 1)
+                    score = _parse_score_line(score_line)
+                    yield {"type": "score", "score": score}
+                    delta = delta.lstrip()
+                if delta:
+                    feedback_parts.append(delta)
+                    yield {"type": "feedback", "delta": delta}
 
+            if score is None:
+                raise ValueError("The response did not contain a feedback section.")
+            # Streams report no usage here; count the prompt and the text actually generated.
+            generated = len(head) + sum(len(part) for part in feedback_parts)
+            ticket.report(estimated_tokens - settings.LLM_EXPECTED_COMPLETION_TOKENS + generated // 4)
+
+    except AdmissionRejected as e:
+        yield {"type": "error", "detail": e.message, "retry_after": math.ceil(e.retry_after)}
+        return
+    except LLMUnavailableError as e:
+        print(f"Streamed AI evaluation unavailable: {e}")
+        yield {"type": "error", "detail": EVALUATION_UNAVAILABLE_MESSAGE}
+        return
     except Exception as e:
-        print(f"An error occurred during AI evaluation: {e}")
-        return {"score": -1, "feedback": "An error occurred while evaluating the answer. Please try again."}
+        print(f"An error occurred during streamed AI evaluation: {e}")
+        yield {"type": "error", "detail": EVALUATION_ERROR_MESSAGE}
+        return
+
+    result = {"score": score, "feedback": "".join(feedback_parts).strip()}
+    await _store(cache_keys, model, result)
+    yield {"type": "done", **result}
+
+async def replay_evaluation(result: dict) -> AsyncIterator[dict]:
+    """Yields an already known evaluation as the events of stream_ai_evaluation."""
+    yield {"type": "score", "score": result["score"]}
+    yield {"type": "feedback", "delta": result["feedback"]}
+    yield {"type": "done", **result}
+
+def _parse_score_line(line: str) -> int:
+    match = _SCORE_LINE_RE.search(line)
+    if not match:
+        raise ValueError(f"Could not parse a score from {line!r}.")
+    return max(0, min(10, int(match.group(1))))
+
+async def invalidate_ai_evaluation(model_answer: str, student_answer: str) -> None:
+    """Forgets the cached evaluation for an answer pair so the next call re-grades it."""
+    for cache_key in _cache_keys(model_answer, student_answer).values():
+        await invalidate_evaluation(cache_key)
@@ -1,3 +1,4 @@
+import time
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
@@ -5,14 +6,39 @@ from jose import JWTError, jwt
 from app.core.config import settings
 from app.db.database import User
 from app.models.token_models import TokenData
+from app.models.user_models import Principal
+from app.services.ttl_cache import TTLCache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+# token -> (user, cached_at)
+_principal_cache = TTLCache(settings.PRINCIPAL_CACHE_MAX_ENTRIES, settings.PRINCIPAL_CACHE_TTL_SECONDS, name="principal")
+
+# user id -> time of the last change; anything cached or issued before it is stale.
+_invalidated_at: dict[str, float] = {}
+
+def invalidate_user(user_id) -> None:
     """
-    Decodes the JWT token to get the user's email, then fetches the user
-    from the database. This function acts as a dependency for protected routes.
+    Marks a user as changed (role update, deletion, ...). Cached principals
+    and token claims of that user issued before now are no longer trusted.
+
+    This is per process: other workers only notice the change once their
+    cached principal expires, or once the token is older than
+    PRINCIPAL_CACHE_TTL_SECONDS for claim-authorized reads.
     """
+    now = time.time()
+    _invalidated_at[str(user_id)] = now
+
+    # Tokens older than their own lifetime are rejected anyway.
+    horizon = now - settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    for key in [k for k, t in _invalidated_at.items() if t < horizon]:
+        del _invalidated_at[key]
+
+def _is_stale(user_id, since: float) -> bool:
+    changed_at = _invalidated_at.get(str(user_id))
+    return changed_at is not None and since <= changed_at
+
+def _decode_token(token: str) -> TokenData:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -23,11 +49,68 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         email: str | None = payload.get("sub")
         if email is None:
             raise credentials_exception
-        token_data = TokenData(email=email)
+        return TokenData(
+            email=email,
+            user_id=payload.get("uid"),
+            username=payload.get("username"),
+            role=payload.get("role"),
+            issued_at=payload.get("iat"),
+        )
     except JWTError:
         raise credentials_exception
 
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    """
+    Decodes the JWT token to get the user's email, then fetches the user
+    from the database. This function acts as a dependency for protected routes.
+
+    Users are cached per token for a short time to save a database round trip.
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    token_data = _decode_token(token)
+
+    cached = _principal_cache.get(token)
+    if cached is not None:
+        user, cached_at = cached
+        if not _is_stale(user.id, cached_at):
+            return user
+        _principal_cache.pop(token)
+
     user = await User.find_one(User.email == token_data.email)
     if user is None:
         raise credentials_exception
+    _principal_cache.set(token, (user, time.time()))
     return user
+
+async def get_current_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    """
+    Lightweight alternative to get_current_user for read-only routes. When
+    the token carries the user claims, was issued less than
+    PRINCIPAL_CACHE_TTL_SECONDS ago and the user has not changed since, no
+    database lookup is made; a role change or deletion is therefore seen
+    by every worker within that time. Routes that write or spend LLM
+    budget use get_verified_principal instead.
+    """
+    token_data = _decode_token(token)
+    if (
+        token_data.user_id and token_data.username and token_data.role and token_data.issued_at
+        and time.time() - token_data.issued_at < settings.PRINCIPAL_CACHE_TTL_SECONDS
+        and not _is_stale(token_data.user_id, token_data.issued_at)
+    ):
+        return Principal(
+            id=token_data.user_id,
+            username=token_data.username,
+            email=token_data.email,
+            role=token_data.role,
+        )
+
+    return await get_verified_principal(token)
+
+async def get_verified_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    """get_current_user as a Principal: the user is always loaded (or cached) from the database."""
+    user = await get_current_user(token)
+    return Principal(id=user.id, username=user.username, email=user.email, role=user.role)
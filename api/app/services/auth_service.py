@@ -1,10 +1,19 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import List, Optional, Tuple
+from fastapi import HTTPException, status
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=settings.BCRYPT_ROUNDS)
+_import_pwd_context = pwd_context.copy(bcrypt__rounds=settings.IMPORT_BCRYPT_ROUNDS)
+
+# bcrypt releases the GIL, so a thread pool keeps hashing off the event loop
+# while still running several hashes in parallel.
+_hashing_executor = ThreadPoolExecutor(max_workers=settings.HASHING_WORKERS, thread_name_prefix="bcrypt")
+_pending_hashes = 0
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifies a plain password against a hashed one."""
@@ -14,6 +23,54 @@ def get_password_hash(password: str) -> str:
     """Hashes a plain password."""
     return pwd_context.hash(password)
 
+async def _run_in_hashing_pool(func, *args, always_queue: bool = False):
+    """
+    Runs a hashing function in the hashing pool. Rejects the call with 503
+    instead of queueing once HASHING_MAX_PENDING calls are waiting, unless
+    `always_queue` (imports, which bound their own share of the pool).
+    """
+    global _pending_hashes
+    if _pending_hashes >= settings.HASHING_MAX_PENDING and not always_queue:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The server is busy, please try again shortly.",
+            headers={"Retry-After": "1"},
+        )
+    _pending_hashes += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hashing_executor, func, *args)
+    finally:
+        _pending_hashes -= 1
+
+async def async_get_password_hash(password: str) -> str:
+    """Hashes a plain password without blocking the event loop."""
+    return await _run_in_hashing_pool(pwd_context.hash, password)
+
+async def async_hash_passwords_for_import(passwords: List[str]) -> List[str]:
+    """
+    Hashes many passwords in parallel for a bulk import, using
+    IMPORT_BCRYPT_ROUNDS. At most HASHING_WORKERS hashes are submitted at a
+    time, so logins running meanwhile are not starved of the pool. They
+    wait for the pool rather than being rejected when it is busy, since an
+    import may already have created part of its rows.
+    """
+    hashes = []
+    step = settings.HASHING_WORKERS
+    for start in range(0, len(passwords), step):
+        hashes += await asyncio.gather(*(
+            _run_in_hashing_pool(_import_pwd_context.hash, password, always_queue=True)
+            for password in passwords[start:start + step]
+        ))
+    return hashes
+
+async def async_verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifies a password without blocking the event loop. When the stored
+    hash uses outdated settings (e.g. a different BCRYPT_ROUNDS) a new hash
+    is returned as the second element so that the caller can store it.
+    """
+    return await _run_in_hashing_pool(pwd_context.verify_and_update, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     """
     Creates a JWT access token.
@@ -24,6 +81,17 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
     
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc)})
     encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
     return encoded_jwt
+
+def create_user_access_token(user, expires_delta: Optional[timedelta] = None) -> str:
+    """
+    Creates an access token for a user. Besides the email in `sub`, the id,
+    username and role are carried as claims so that read-only routes can
+    authenticate without a database lookup.
+    """
+    return create_access_token(
+        data={"sub": user.email, "uid": str(user.id), "username": user.username, "role": user.role},
+        expires_delta=expires_delta,
+    )
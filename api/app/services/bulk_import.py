@@ -0,0 +1,168 @@
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+from beanie import Link
+from bson import DBRef
+from fastapi import UploadFile
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from app.core.config import settings
+from app.db.database import User, QuestionSet
+from app.models.teacher_models import QuestionSetCreate, StudentImportRow, ImportReport, ImportRowError
+from app.models.projection_models import UserSummary
+from app.services.auth_service import async_hash_passwords_for_import
+from app.services.change_versions import QUESTION_SETS_KEY, bump_versions
+from app.services.user_summaries import user_summary
+
+_READ_SIZE = 64 * 1024
+
+async def iter_jsonl(upload: UploadFile) -> AsyncIterator[Tuple[int, bytes]]:
+    """Yields the non-empty lines of an uploaded JSONL file with their 1-based line numbers."""
+    line_number = 0
+    pending = b""
+    while True:
+        chunk = await upload.read(_READ_SIZE)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            line_number += 1
+            if line.strip():
+                yield line_number, line
+    if pending.strip():
+        yield line_number + 1, pending
+
+async def iter_row_chunks(upload: UploadFile, model, report: ImportReport, chunk_size: int):
+    """
+    Parses and validates the rows of a JSONL upload with `model`, yielding
+    lists of (line number, row) of at most chunk_size. Invalid rows are
+    added to the report instead.
+    """
+    chunk = []
+    async for line_number, line in iter_jsonl(upload):
+        try:
+            chunk.append((line_number, model.model_validate(orjson.loads(line))))
+        except orjson.JSONDecodeError as e:
+            report.errors.append(ImportRowError(line=line_number, error=f"Invalid JSON: {e}"))
+            continue
+        except ValidationError as e:
+            report.errors.append(ImportRowError(line=line_number, error=_validation_message(e)))
+            continue
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, e['loc'])) or 'row'}: {e['msg']}" for e in error.errors())
+
+def _user_link(user_id) -> Link:
+    return Link(DBRef(User.get_collection_name(), user_id), User)
+
+async def _insert_chunk(model, documents: List, line_numbers: List[int], report: ImportReport):
+    """insert_many for one chunk; rows the database rejected are reported."""
+    try:
+        await model.insert_many(documents, ordered=False)
+        report.created += len(documents)
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors", [])
+        for error in write_errors:
+            report.errors.append(ImportRowError(line=line_numbers[error["index"]], error=error.get("errmsg", "Insert failed.")))
+        report.created += len(documents) - len(write_errors)
+
+async def import_question_sets(upload: UploadFile, creator: User) -> ImportReport:
+    """
+    Creates question sets from a JSONL upload of QuestionSetCreate rows.
+    Assigned usernames are resolved with one $in query per chunk, and each
+    username is looked up at most once per import.
+    """
+    report = ImportReport()
+    students: Dict[str, Optional[UserSummary]] = {}
+    creator_summary = user_summary(creator)
+
+    async for chunk in iter_row_chunks(upload, QuestionSetCreate, report, settings.IMPORT_CHUNK_SIZE):
+        unknown = {name for _, row in chunk for name in row.assigned_usernames or [] if name not in students}
+        if unknown:
+            students.update(dict.fromkeys(unknown))
+            async for student in User.find(
+                {"username": {"$in": list(unknown)}, "role": "student"}, projection_model=UserSummary
+            ):
+                students[student.username] = student
+
+        documents, line_numbers = [], []
+        for line_number, row in chunk:
+            usernames = list(dict.fromkeys(row.assigned_usernames or []))
+            missing = [name for name in usernames if students[name] is None]
+            if missing:
+                report.errors.append(ImportRowError(line=line_number, error=f"Student usernames not found: {', '.join(missing)}"))
+                continue
+            assigned = [students[name] for name in usernames]
+            documents.append(QuestionSet(
+                title=row.title,
+                question=row.question,
+                model_answer=row.model_answer,
+                creator=_user_link(creator.id),
+                assigned_students=[_user_link(student.id) for student in assigned],
+                is_public=not assigned,
+                creator_summary=creator_summary,
+                assigned_summaries=[user_summary(student) for student in assigned],
+            ))
+            line_numbers.append(line_number)
+
+        if documents:
+            await _insert_chunk(QuestionSet, documents, line_numbers, report)
+
+    report.errors.sort(key=lambda error: error.line)
+    if report.created:
+        await bump_versions([QUESTION_SETS_KEY])
+    return report
+
+async def import_students(upload: UploadFile) -> ImportReport:
+    """
+    Creates student accounts from a JSONL upload of StudentImportRow rows.
+    Passwords are hashed in parallel in the hashing pool; existing and
+    repeated emails or usernames are reported per row.
+    """
+    report = ImportReport()
+    seen_emails, seen_usernames = set(), set()
+
+    async for chunk in iter_row_chunks(upload, StudentImportRow, report, settings.IMPORT_CHUNK_SIZE):
+        emails = [row.email for _, row in chunk]
+        usernames = [row.username for _, row in chunk]
+        async for user in User.find(
+            {"$or": [{"email": {"$in": emails}}, {"username": {"$in": usernames}}]}, projection_model=UserSummary
+        ):
+            seen_emails.add(user.email)
+            seen_usernames.add(user.username)
+
+        accepted = []
+        for line_number, row in chunk:
+            if row.role != "student":
+                error = "Only student accounts can be imported."
+            elif row.email in seen_emails:
+                error = "Email already registered"
+            elif row.username in seen_usernames:
+                error = "Username is already taken"
+            else:
+                error = None
+            if error:
+                report.errors.append(ImportRowError(line=line_number, error=error))
+                continue
+            seen_emails.add(row.email)
+            seen_usernames.add(row.username)
+            accepted.append((line_number, row))
+
+        if not accepted:
+            continue
+        hashes = await async_hash_passwords_for_import([row.password for _, row in accepted])
+        documents = [
+            User(username=row.username, email=row.email, hashed_password=hashed_password, role="student")
+            for (_, row), hashed_password in zip(accepted, hashes)
+        ]
+        await _insert_chunk(User, documents, [line_number for line_number, _ in accepted], report)
+
+    report.errors.sort(key=lambda error: error.line)
+    return report
@@ -0,0 +1,104 @@
+import hashlib
+from typing import Dict, Iterable, List, Optional
+
+from fastapi import Request, Response
+from pymongo import UpdateOne
+
+from app.core.config import settings
+from app.db.database import ChangeVersion
+from app.services.ttl_cache import TTLCache
+
+# Version keys. A listing's ETag is derived from the versions of the keys
+# it depends on, so every write that can change a listing bumps its keys
+# once it has been applied.
+QUESTION_SETS_KEY = "question_sets"  # any question set was created
+USERS_KEY = "users"  # a user's public fields (shown in listings) changed
+
+def student_key(student_id) -> str:
+    """A student's submissions were created, graded, failed or finalized."""
+    return f"student:{student_id}"
+
+def question_set_key(qset_id) -> str:
+    """A submission to the question set was created, graded, failed or finalized."""
+    return f"question_set:{qset_id}"
+
+# Serialized listings by ETag, so an unchanged listing polled without
+# If-None-Match (another tab, another worker's ETag) is not rebuilt either.
+# Unpaginated listings can be large, so the cache is bounded by body bytes.
+_bodies = TTLCache(
+    settings.LIST_RESPONSE_CACHE_MAX_ENTRIES,
+    settings.LIST_RESPONSE_CACHE_TTL_SECONDS,
+    name="list_response",
+    max_bytes=settings.LIST_RESPONSE_CACHE_MAX_BYTES,
+    sizeof=lambda cached: len(cached[0]),
+)
+
+async def bump_versions(keys: Iterable[str]):
+    keys = set(keys)
+    if not keys:
+        return
+    await ChangeVersion.get_motor_collection().bulk_write(
+        [UpdateOne({"_id": key}, {"$inc": {"version": 1}}, upsert=True) for key in sorted(keys)], ordered=False
+    )
+
+async def get_versions(keys: List[str]) -> Dict[str, int]:
+    """The current version of each key (0 if it was never bumped), in one _id lookup."""
+    versions = dict.fromkeys(keys, 0)
+    async for doc in ChangeVersion.get_motor_collection().find({"_id": {"$in": keys}}):
+        versions[doc["_id"]] = doc["version"]
+    return versions
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # Weak comparison: W/"x" and "x" match.
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+class ConditionalListing:
+    """
+    Conditional GET for a polled listing. The ETag is computed from the
+    versions of `keys` and the request's URL, before the listing itself is
+    queried:
+
+        listing = ConditionalListing(request, [student_key(user.id), USERS_KEY])
+        cached = await listing.cached_response()
+        if cached is not None:
+            return cached
+        ...
+        return listing.finish(response)
+
+    A matching If-None-Match gets 304; a listing already serialized for
+    that ETag is served from memory.
+    """
+
+    def __init__(self, request: Request, keys: List[str]):
+        self.request = request
+        self.keys = keys
+        self.etag: Optional[str] = None
+
+    async def cached_response(self) -> Optional[Response]:
+        versions = await get_versions(self.keys)
+        state = ";".join(f"{key}={versions[key]}" for key in self.keys)
+        url = f"{self.request.url.path}?{self.request.url.query}"
+        self.etag = 'W/"' + hashlib.blake2b(f"{url}|{state}".encode(), digest_size=12).hexdigest() + '"'
+
+        if _etag_matches(self.request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers=self._headers())
+        cached = _bodies.get(self.etag)
+        if cached is not None:
+            body, headers = cached
+            return Response(body, media_type="application/json", headers={**headers, **self._headers()})
+        return None
+
+    def finish(self, response: Response) -> Response:
+        """Adds the ETag to the freshly built listing and caches its body."""
+        response.headers.update(self._headers())
+        if response.status_code == 200:
+            extra = {name: value for name, value in response.headers.items() if name.lower().startswith("x-")}
+            _bodies.set(self.etag, (response.body, extra))
+        return response
+
+    def _headers(self) -> Dict[str, str]:
+        # Clients may keep the listing but must revalidate it before reuse.
+        return {"ETag": self.etag, "Cache-Control": "private, no-cache"}
@@ -0,0 +1,97 @@
+import hashlib
+import re
+import unicodedata
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from app.core.config import settings
+from app.db.database import EvaluationCacheEntry
+from app.services.ttl_cache import TTLCache
+
+_memory_cache = TTLCache(settings.EVAL_CACHE_MAX_ENTRIES, settings.EVAL_CACHE_TTL_SECONDS, name="evaluation")
+
+cache_stats = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+def normalize_answer(text: str) -> str:
+    """Normalizes an answer so that formatting-only differences share a cache key."""
+    text = unicodedata.normalize("NFKC", text)
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+def make_cache_key(model_answer: str, student_answer: str, model: str, prompt_version: str) -> str:
+    """
+    Builds a content-addressed key for an evaluation. Changing the model or
+    the prompt version produces a new key, so stale grades are never reused.
+    """
+    parts = [model, prompt_version, normalize_answer(model_answer), normalize_answer(student_answer)]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+async def get_cached_evaluation(*keys: str) -> Optional[dict]:
+    """
+    The cached evaluation of the first of `keys` that has one. The keys are
+    looked up in the in-process LRU first and in MongoDB second, with one
+    query for all of them. A database hit is promoted into the in-process
+    tier.
+    """
+    if not settings.EVAL_CACHE_ENABLED:
+        return None
+
+    for key in keys:
+        result = _memory_cache.get(key)
+        if result is not None:
+            cache_stats["memory_hits"] += 1
+            return dict(result)
+
+    try:
+        entries: List[EvaluationCacheEntry] = await EvaluationCacheEntry.find(
+            {"key": {"$in": list(keys)}}
+        ).to_list()
+    except Exception as e:
+        print(f"An error occurred while reading the evaluation cache: {e}")
+        entries = []
+
+    if not entries:
+        cache_stats["misses"] += 1
+        return None
+
+    cache_stats["db_hits"] += 1
+    entry = min(entries, key=lambda entry: keys.index(entry.key))
+    result = {"score": entry.score, "feedback": entry.feedback}
+    _memory_cache.set(entry.key, result)
+    return dict(result)
+
+def _expires_at() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=settings.EVAL_CACHE_DB_TTL_SECONDS)
+
+async def store_evaluation(key: str, result: dict, model: str, prompt_version: str) -> None:
+    """Writes a successful evaluation to both cache tiers."""
+    if not settings.EVAL_CACHE_ENABLED:
+        return
+    if not isinstance(result.get("score"), int) or result["score"] < 0 or not isinstance(result.get("feedback"), str):
+        return
+
+    cached = {"score": result["score"], "feedback": result["feedback"]}
+    _memory_cache.set(key, cached)
+    try:
+        await EvaluationCacheEntry.get_motor_collection().update_one(
+            {"key": key},
+            {"$set": {**cached, "model": model, "prompt_version": prompt_version, "expires_at": _expires_at()},
+             "$currentDate": {"created_at": True}},
+            upsert=True,
+        )
+    except Exception as e:
+        print(f"An error occurred while writing the evaluation cache: {e}")
+
+async def invalidate_evaluation(key: str) -> None:
+    """Removes a single evaluation from both cache tiers."""
+    _memory_cache.pop(key)
+    await EvaluationCacheEntry.find(EvaluationCacheEntry.key == key).delete()
+
+async def clear_evaluation_cache() -> None:
+    """Drops every cached evaluation."""
+    _memory_cache.clear()
+    await EvaluationCacheEntry.find_all().delete()
+
+def get_cache_stats() -> dict:
+    return {**cache_stats, "memory_entries": len(_memory_cache)}
@@ -0,0 +1,132 @@
+import asyncio
+import re
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+
+import httpx
+from jose import JWTError, jwt
+
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v3/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+# Returns the JWKS document and how many seconds it may be cached for.
+KeySource = Callable[[], Awaitable[Tuple[dict, float]]]
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+class KeyFetchError(Exception):
+    """The signing keys could not be fetched (provider unreachable or failing)."""
+
+async def fetch_google_jwks() -> Tuple[dict, float]:
+    """Fetches Google's signing keys, honoring the Cache-Control max-age."""
+    async with httpx.AsyncClient(timeout=10) as http_client:
+        response = await http_client.get(GOOGLE_CERTS_URL)
+        response.raise_for_status()
+    match = _MAX_AGE_RE.search(response.headers.get("cache-control", ""))
+    max_age = float(match.group(1)) if match else 3600.0
+    return response.json(), max_age
+
+class JWKSCache:
+    """
+    In-memory cache of a JSON Web Key Set.
+
+    Keys are refreshed in the background shortly before they expire, so
+    verification only ever waits for the network on the very first call or
+    when a token is signed with a key id that is not known yet.
+    """
+
+    def __init__(self, key_source: KeySource, refresh_margin: float = 300, min_refresh_interval: float = 30):
+        self._key_source = key_source
+        self._refresh_margin = refresh_margin
+        self._min_refresh_interval = min_refresh_interval
+        self._keys: dict = {}
+        self._expires_at = 0.0
+        self._fetched_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def refresh(self, if_fetched_before: Optional[float] = None):
+        """
+        Fetches the keys. With `if_fetched_before`, nothing is fetched if
+        another caller refreshed them after that time while this one was
+        waiting for the lock.
+
+        Raises:
+            KeyFetchError: if the key source fails.
+        """
+        async with self._lock:
+            if if_fetched_before is not None and self._fetched_at > if_fetched_before:
+                return
+            try:
+                jwks, max_age = await self._key_source()
+            except Exception as e:
+                raise KeyFetchError(f"Could not fetch the signing keys: {e}") from e
+            self._keys = {key["kid"]: key for key in jwks.get("keys", [])}
+            self._fetched_at = time.monotonic()
+            self._expires_at = self._fetched_at + max_age
+
+    def _schedule_refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_in_background())
+
+    async def _refresh_in_background(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            print(f"An error occurred while refreshing signing keys: {e}")
+
+    async def get_key(self, kid: str) -> Optional[dict]:
+        """
+        The key with id `kid`, or None if the provider does not have it.
+
+        Raises:
+            KeyFetchError: if keys are needed and cannot be fetched.
+        """
+        now = time.monotonic()
+        fetched_at = self._fetched_at
+        if not self._keys:
+            await self.refresh(fetched_at)
+        elif now >= self._expires_at:
+            try:
+                await self.refresh(fetched_at)
+            except KeyFetchError as e:
+                # Expired keys are still better than failing every login.
+                print(f"{e}; using the expired keys.")
+        elif now >= self._expires_at - self._refresh_margin:
+            self._schedule_refresh()
+
+        key = self._keys.get(kid)
+        fetched_at = self._fetched_at
+        if key is None and time.monotonic() - fetched_at >= self._min_refresh_interval:
+            # The provider may have rotated its keys before our copy expired.
+            await self.refresh(fetched_at)
+            key = self._keys.get(kid)
+        return key
+
+_google_key_cache = JWKSCache(fetch_google_jwks)
+
+async def verify_google_id_token(token: str, audience: str, key_cache: Optional[JWKSCache] = None) -> dict:
+    """
+    Verifies a Google ID token's signature, audience, issuer and expiry
+    and returns its claims.
+
+    Raises:
+        ValueError: if the token is invalid.
+        KeyFetchError: if Google's signing keys cannot be fetched.
+    """
+    key_cache = key_cache or _google_key_cache
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = await key_cache.get_key(kid) if kid else None
+        if key is None:
+            raise ValueError("Token signed with an unknown key.")
+        return jwt.decode(
+            token,
+            key,
+            algorithms=["RS256"],
+            audience=audience,
+            issuer=GOOGLE_ISSUERS,
+            options={"verify_at_hash": False},
+        )
+    except JWTError as e:
+        raise ValueError(f"Invalid Google ID token: {e}")
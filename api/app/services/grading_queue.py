@@ -0,0 +1,141 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+from beanie.odm.fields import PydanticObjectId
+from pymongo import ReturnDocument
+
+from app.core.config import settings
+from app.db.database import QuestionSet, Submission
+from app.services.admission import Requester
+from app.services.similarity import evaluate_answer_for_set, remember_graded_answer
+from app.services.question_set_stats import scores_of, record_submission_change
+from app.services.change_versions import bump_versions, question_set_key, student_key
+
+_queue: Optional["asyncio.Queue[PydanticObjectId]"] = None
+_workers: List[asyncio.Task] = []
+
+async def start_grading_workers():
+    """
+    Starts the background grading workers and re-enqueues every submission
+    that was still pending when the previous process stopped. Every process
+    does this, but each submission is claimed by one worker only (see
+    _claim), so it is sent to the LLM once.
+    """
+    global _queue
+    _queue = asyncio.Queue()
+    for n in range(settings.GRADING_WORKERS):
+        _workers.append(asyncio.create_task(_worker(n)))
+
+    resumed = 0
+    async for submission in Submission.find(claimable_filter(_now())):
+        _queue.put_nowait(submission.id)
+        resumed += 1
+    print(f"Grading workers started ({settings.GRADING_WORKERS}), resumed {resumed} pending submissions.")
+
+async def stop_grading_workers():
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+def enqueue_submission(sub_id: PydanticObjectId):
+    """
+    Schedules a pending submission for grading. If the workers are not
+    running the submission stays pending and is picked up on the next start.
+    """
+    if _queue is not None:
+        _queue.put_nowait(sub_id)
+
+async def _worker(n: int):
+    while True:
+        sub_id = await _queue.get()
+        try:
+            await grade_submission(sub_id)
+        except Exception as e:
+            print(f"Grading worker {n} failed on submission {sub_id}: {e}")
+        finally:
+            _queue.task_done()
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def claimable_filter(now: datetime) -> dict:
+    """Pending submissions that no worker holds a lease on."""
+    return {"status": "pending", "$or": [{"grading_lease_until": None}, {"grading_lease_until": {"$lte": now}}]}
+
+async def _claim(sub_id: PydanticObjectId) -> Optional[Submission]:
+    """
+    Atomically leases a pending submission for GRADING_LEASE_SECONDS.
+    Returns None if it is not pending or another worker holds the lease.
+    """
+    now = _now()
+    doc = await Submission.get_motor_collection().find_one_and_update(
+        {"_id": sub_id, **claimable_filter(now)},
+        {"$set": {"grading_lease_until": now + timedelta(seconds=settings.GRADING_LEASE_SECONDS)}},
+        return_document=ReturnDocument.AFTER,
+    )
+    return Submission.model_validate(doc) if doc is not None else None
+
+async def _release(sub_id: PydanticObjectId, changes: Optional[dict] = None):
+    await Submission.get_motor_collection().update_one(
+        {"_id": sub_id}, {"$set": {**(changes or {}), "grading_lease_until": None}}
+    )
+
+async def grade_submission(sub_id: PydanticObjectId):
+    """
+    Grades one pending submission once this worker has claimed it. A failed
+    attempt is retried with exponential backoff until GRADING_MAX_ATTEMPTS
+    is reached, after which the submission is marked as failed.
+    """
+    submission = await _claim(sub_id)
+    if submission is None:
+        return
+
+    changed = [student_key(submission.student.ref.id), question_set_key(submission.question_set.ref.id)]
+    question_set = await QuestionSet.get(submission.question_set.ref.id)
+    if not question_set:
+        await _release(sub_id, {"status": "failed"})
+        await bump_versions(changed)
+        return
+
+    evaluation = await evaluate_answer_for_set(
+        question_set, submission.student_answer, Requester.student(submission.student.ref.id, question_set.creator.ref.id)
+    )
+    if evaluation["score"] != -1:
+        graded = {
+            "ai_score": evaluation["score"],
+            "ai_feedback": evaluation["feedback"],
+            "grading_source": evaluation["grading_source"],
+            "similar_to": evaluation["similar_to"],
+        }
+        previous = await Submission.get_motor_collection().find_one_and_update(
+            {"_id": sub_id, "status": "pending"},
+            {"$set": {**graded, "status": "graded", "grading_lease_until": None}},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if previous is not None:
+            await record_submission_change(
+                question_set.id,
+                before=scores_of(previous),
+                after={**scores_of(previous), "ai_score": evaluation["score"]},
+            )
+            remember_graded_answer(question_set.id, submission.model_copy(update=graded))
+            await bump_versions(changed)
+        return
+
+    if "retry_after" in evaluation:
+        # The provider is unavailable or the evaluation was shed; wait without using up an attempt.
+        delay = evaluation["retry_after"] or settings.GRADING_RETRY_BACKOFF_SECONDS
+        await _release(sub_id)
+        asyncio.get_running_loop().call_later(delay, enqueue_submission, sub_id)
+        return
+
+    attempts = submission.grading_attempts + 1
+    if attempts >= settings.GRADING_MAX_ATTEMPTS:
+        await _release(sub_id, {"grading_attempts": attempts, "status": "failed"})
+        await bump_versions(changed)
+        return
+
+    await _release(sub_id, {"grading_attempts": attempts})
+    delay = settings.GRADING_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1)
+    asyncio.get_running_loop().call_later(delay, enqueue_submission, sub_id)
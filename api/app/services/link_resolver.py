@@ -0,0 +1,54 @@
+from typing import Dict, Iterable, Optional, Tuple
+from beanie.odm.fields import PydanticObjectId
+
+from app.core.config import settings
+from app.db.database import User, QuestionSet, EmbeddedUser
+from app.models.projection_models import UserSummary, QuestionSetStudentRow
+
+async def resolve_users(user_ids: Iterable[PydanticObjectId]) -> Dict[PydanticObjectId, dict]:
+    """
+    Resolves any number of user references with a single query.
+    Returns JSON-ready UserOut dicts; ids that no longer exist are missing.
+    """
+    unique_ids = list(set(user_ids))
+    if not unique_ids:
+        return {}
+    users = await User.find({"_id": {"$in": unique_ids}}, projection_model=UserSummary).to_list()
+    return {user.id: user.model_dump(mode="json") for user in users}
+
+async def resolve_users_from_summaries(
+    refs: Iterable[Tuple[PydanticObjectId, Optional[EmbeddedUser]]]
+) -> Dict[PydanticObjectId, dict]:
+    """
+    Like resolve_users, but takes (user id, embedded summary) pairs. With
+    DENORMALIZED_READS the embedded summaries are used as they are and only
+    the users without one are fetched.
+    """
+    resolved = {}
+    missing = []
+    for user_id, summary in refs:
+        if settings.DENORMALIZED_READS and summary is not None:
+            resolved[user_id] = summary.model_dump(mode="json")
+        else:
+            missing.append(user_id)
+    resolved.update(await resolve_users(missing))
+    return resolved
+
+async def resolve_question_sets_for_student(qset_ids: Iterable[PydanticObjectId]) -> Dict[PydanticObjectId, dict]:
+    """
+    Resolves question set references together with their creators in two
+    queries, whatever the number of sets. Returns JSON-ready
+    QuestionSetForStudentOut dicts.
+    """
+    unique_ids = list(set(qset_ids))
+    if not unique_ids:
+        return {}
+    qsets = await QuestionSet.find({"_id": {"$in": unique_ids}}, projection_model=QuestionSetStudentRow).to_list()
+    creators_map = await resolve_users_from_summaries((qs.creator.ref.id, qs.creator_summary) for qs in qsets)
+
+    qsets_map = {}
+    for qset in qsets:
+        creator_out = creators_map.get(qset.creator.ref.id)
+        if creator_out:
+            qsets_map[qset.id] = {**qset.model_dump(mode="json", exclude={'creator', 'creator_summary'}), "creator": creator_out}
+    return qsets_map
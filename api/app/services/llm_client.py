@@ -0,0 +1,322 @@
+import asyncio
+import json
+import random
+import time
+from contextlib import AsyncExitStack
+from types import SimpleNamespace
+from typing import Optional
+
+import httpx
+from groq import AsyncGroq, APIConnectionError, APIStatusError, RateLimitError
+
+from app.core.config import settings
+
+class LLMUnavailableError(Exception):
+    """
+    The provider could not be reached in time: the circuit breaker is open,
+    or every attempt failed with a retryable error before the deadline.
+    `retry_after` is a hint in seconds for the caller's own clients.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Fails fast while the provider is down. After `failure_threshold`
+    consecutive failures the circuit opens for `reset_timeout` seconds; then
+    a single trial call is let through, which closes the circuit again on
+    success or re-opens it on failure.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def retry_after(self) -> float:
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def before_call(self):
+        """Raises LLMUnavailableError if no call may be made right now."""
+        state = self.state
+        if state == "open" or (state == "half_open" and self._trial_in_flight):
+            raise LLMUnavailableError("The evaluation provider is unavailable.", retry_after=self.retry_after() or 1.0)
+        if state == "half_open":
+            self._trial_in_flight = True
+
+    def cancel_call(self):
+        """A call was abandoned before it completed (e.g. the losing side of a hedge)."""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._trial_in_flight or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+
+def _is_rate_limited(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429
+    return isinstance(error, RateLimitError)
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, APIConnectionError, httpx.TransportError)) or _is_rate_limited(error):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+def _retry_after_header(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+class _SlotHeldStream:
+    """
+    A streamed response that keeps the provider limiter's slot until it has
+    been read to the end, failed, or was closed with aclose(). Closing it
+    closes the underlying stream too, so an abandoned stream does not keep
+    its pooled connection.
+    """
+
+    def __init__(self, stream, slot: AsyncExitStack):
+        self._stream = stream
+        self._iterator = stream.__aiter__()
+        self._slot = slot
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._iterator.__anext__()
+        except BaseException:
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        slot, self._slot = self._slot, None
+        if slot is None:
+            return
+        try:
+            # Groq's AsyncStream has close(); the OpenAI-compatible client returns an async generator.
+            close = getattr(self._stream, "close", None) or getattr(self._stream, "aclose", None)
+            if close is not None:
+                await close()
+        finally:
+            await slot.aclose()
+
+class ResilientLLMClient:
+    """
+    Wraps an AsyncGroq (or any OpenAI-compatible) client's chat completions
+    with a per-attempt timeout, an overall deadline, jittered exponential
+    retries on 429/5xx/timeouts that honor Retry-After, a circuit breaker
+    and optional hedging. With a `limiter` (a ProviderLimiter), every
+    attempt, retries and hedges included, takes its own slot and tokens, and
+    gives the slot back before any backoff sleep.
+    """
+
+    def __init__(
+        self,
+        client,
+        breaker: CircuitBreaker,
+        attempt_timeout: float,
+        deadline: float,
+        max_attempts: int,
+        backoff_base: float,
+        backoff_max: float,
+        hedge_after: float = 0,
+        limiter=None,
+    ):
+        self.client = client
+        self.breaker = breaker
+        self.attempt_timeout = attempt_timeout
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self.limiter = limiter
+
+    async def _attempt(self, kwargs: dict, timeout: float, estimated_tokens: int):
+        async with AsyncExitStack() as slot:
+            if self.limiter is not None:
+                await slot.enter_async_context(self.limiter.slot(estimated_tokens))
+            self.breaker.before_call()
+            try:
+                result = await asyncio.wait_for(self.client.chat.completions.create(**kwargs), timeout)
+            except asyncio.CancelledError:
+                self.breaker.cancel_call()
+                raise
+            except Exception as e:
+                # A 429 means the provider is up but limiting us; it does not trip the breaker.
+                if _is_retryable(e) and not _is_rate_limited(e):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            if kwargs.get("stream"):
+                # The call is in flight until the stream has been read.
+                return _SlotHeldStream(result, slot.pop_all())
+            return result
+
+    async def _hedged_attempt(self, kwargs: dict, timeout: float, estimated_tokens: int):
+        """Starts a second identical request if the first is slower than hedge_after; the first success wins."""
+        first = asyncio.ensure_future(self._attempt(kwargs, timeout, estimated_tokens))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        second = self._attempt(kwargs, max(0.001, timeout - self.hedge_after), estimated_tokens)
+        pending = {first, asyncio.ensure_future(second)}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def create(self, estimated_tokens: int = 0, **kwargs):
+        """
+        chat.completions.create with the resilience policy applied. Streams
+        (stream=True) are retried until the response starts and never
+        hedged; their limiter slot is held until they are read to the end or
+        closed. `estimated_tokens` is charged to the limiter per attempt.
+
+        Raises:
+            LLMUnavailableError: if the breaker is open or the retries ran out.
+        """
+        started = time.monotonic()
+        hedge = self.hedge_after > 0 and not kwargs.get("stream")
+        attempt = 0
+        while True:
+            attempt += 1
+            # No attempt may run past the overall deadline.
+            timeout = min(self.attempt_timeout, max(0.001, self.deadline - (time.monotonic() - started)))
+            try:
+                if hedge and timeout > self.hedge_after:
+                    return await self._hedged_attempt(kwargs, timeout, estimated_tokens)
+                return await self._attempt(kwargs, timeout, estimated_tokens)
+            except LLMUnavailableError:
+                raise
+            except Exception as e:
+                if not _is_retryable(e):
+                    raise
+                retry_after = _retry_after_header(e)
+                delay = retry_after if retry_after is not None else \
+                    random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+                remaining = self.deadline - (time.monotonic() - started)
+                if attempt >= self.max_attempts or delay >= remaining:
+                    raise LLMUnavailableError(
+                        f"The evaluation provider failed after {attempt} attempts: {e}",
+                        retry_after=retry_after or self.breaker.retry_after() or None,
+                    ) from e
+                print(f"LLM call failed ({type(e).__name__}: {e}), retrying in {delay:.2f}s.")
+                await asyncio.sleep(delay)
+
+class _Payload(SimpleNamespace):
+    """A JSON object with attribute access; absent fields read as None, as with the SDK models."""
+
+    def __getattr__(self, name):
+        return None
+
+def _payload(value):
+    if isinstance(value, dict):
+        return _Payload(**{key: _payload(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_payload(item) for item in value]
+    return value
+
+class OpenAICompatibleClient:
+    """
+    A minimal client for OpenAI-compatible chat completions servers (vLLM,
+    Ollama, llama.cpp, ...) with the same `chat.completions.create` shape as
+    AsyncGroq, so that ResilientLLMClient can wrap either. HTTP errors are
+    raised as httpx.HTTPStatusError.
+    """
+
+    def __init__(self, base_url: str, api_key: str, http_client: httpx.AsyncClient):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.http_client = http_client
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        if not kwargs.get("stream"):
+            response = await self.http_client.post(self.url, json=kwargs, headers=self.headers)
+            response.raise_for_status()
+            return _payload(response.json())
+
+        request = self.http_client.build_request("POST", self.url, json=kwargs, headers=self.headers)
+        response = await self.http_client.send(request, stream=True)
+        if response.is_error:
+            await response.aread()
+            await response.aclose()
+            response.raise_for_status()
+        return self._chunks(response)
+
+    async def _chunks(self, response: httpx.Response):
+        """The server-sent events of a streamed completion as chunk objects."""
+        try:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                yield _payload(json.loads(data))
+        finally:
+            await response.aclose()
+
+def _create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+        timeout=httpx.Timeout(settings.LLM_ATTEMPT_TIMEOUT_SECONDS, connect=settings.LLM_CONNECT_TIMEOUT_SECONDS),
+    )
+
+def create_groq_client() -> AsyncGroq:
+    """AsyncGroq with explicit connection-pool limits; retries are left to ResilientLLMClient."""
+    return AsyncGroq(
+        api_key=settings.GROQ_API_KEY,
+        base_url=settings.GROQ_BASE_URL or None,
+        max_retries=0,
+        http_client=_create_http_client(),
+    )
+
+def create_openai_compatible_client() -> OpenAICompatibleClient:
+    """The client for OPENAI_COMPATIBLE_BASE_URL, with the same pool limits as Groq."""
+    return OpenAICompatibleClient(
+        settings.OPENAI_COMPATIBLE_BASE_URL, settings.OPENAI_COMPATIBLE_API_KEY, _create_http_client()
+    )
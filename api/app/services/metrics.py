@@ -0,0 +1,291 @@
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from pymongo import monitoring
+
+from app.core.config import settings
+
+# Metrics are kept in-process and rendered in the Prometheus text format by
+# GET /metrics. Mongo command events arrive on Motor's executor threads,
+# hence the lock.
+_lock = threading.Lock()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple, float] = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with _lock:
+            self._values[key] += amount
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, key)} {value}" for key, value in sorted(self._values.items())]
+        return "\n".join(lines)
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket (the last one is +Inf), sum]
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with _lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return "\n".join(lines)
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time to handle a request, until its response headers were sent.",
+    ("method", "route", "status"),
+)
+request_db_operations = Counter(
+    "http_request_db_operations_total", "MongoDB commands issued while handling requests.", ("route",)
+)
+request_db_seconds = Counter(
+    "http_request_db_seconds_total", "Time spent in MongoDB commands while handling requests.", ("route",)
+)
+request_llm_seconds = Counter(
+    "http_request_llm_seconds_total", "Time spent obtaining evaluations while handling requests.", ("route",)
+)
+mongo_command_duration = Histogram(
+    "mongo_command_duration_seconds", "Duration of MongoDB commands.", ("command", "outcome"), buckets=DB_BUCKETS
+)
+llm_request_duration = Histogram(
+    "llm_request_duration_seconds",
+    "Time to obtain an evaluation from a backend, including rate limiter waits and retries.",
+    ("model", "outcome"),
+)
+llm_tokens = Counter("llm_tokens_total", "Tokens reported by the LLM provider.", ("model", "type"))
+
+class RequestMetrics:
+    """What one request spent in MongoDB and LLM calls."""
+
+    __slots__ = ("db_operations", "db_seconds", "llm_calls", "llm_seconds")
+
+    def __init__(self):
+        self.db_operations = 0
+        self.db_seconds = 0.0
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Counts MongoDB commands, globally and for the request that issued them.
+    Motor runs commands in an executor with a copy of the caller's context,
+    so the request's RequestMetrics is visible here.
+    """
+
+    def _record(self, event, outcome: str):
+        seconds = event.duration_micros / 1e6
+        mongo_command_duration.observe(seconds, command=event.command_name, outcome=outcome)
+        current = _current.get()
+        if current is not None:
+            with _lock:
+                current.db_operations += 1
+                current.db_seconds += seconds
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, "ok")
+
+    def failed(self, event):
+        self._record(event, "error")
+
+class _LLMCall:
+    __slots__ = ("usage",)
+
+    def __init__(self):
+        self.usage = None
+
+@contextmanager
+def track_llm_call(model: str):
+    """
+    Times an evaluation by `model` around the block. Set `.usage` on the
+    yielded object to the provider's token usage to count the tokens.
+    """
+    call = _LLMCall()
+    started = time.monotonic()
+    outcome = "ok"
+    try:
+        yield call
+    except (asyncio.CancelledError, GeneratorExit):
+        outcome = "cancelled"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        seconds = time.monotonic() - started
+        llm_request_duration.observe(seconds, model=model, outcome=outcome)
+        if call.usage is not None:
+            llm_tokens.inc(getattr(call.usage, "prompt_tokens", 0) or 0, model=model, type="prompt")
+            llm_tokens.inc(getattr(call.usage, "completion_tokens", 0) or 0, model=model, type="completion")
+        current = _current.get()
+        if current is not None:
+            current.llm_calls += 1
+            current.llm_seconds += seconds
+
+def current_request_metrics() -> Optional[RequestMetrics]:
+    """The RequestMetrics of the request being handled, if any."""
+    return _current.get()
+
+@contextmanager
+def charge_llm_calls(requests):
+    """
+    Collects the LLM calls made in the block and charges their count and
+    time to each of `requests` (RequestMetrics or None). For work shared by
+    several requests, such as a micro-batch, run outside of their contexts.
+    """
+    shared = RequestMetrics()
+    token = _current.set(shared)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+        with _lock:
+            for request in requests:
+                if request is not None:
+                    request.llm_calls += shared.llm_calls
+                    request.llm_seconds += shared.llm_seconds
+
+def _route_of(scope) -> str:
+    """The route template of a request, e.g. /api/student/submissions/{sub_id}."""
+    if scope.get("endpoint") is None:
+        return "unmatched"
+    names = {str(value): name for name, value in scope.get("path_params", {}).items()}
+    return "/".join(f"{{{names[part]}}}" if part in names else part for part in scope["path"].split("/"))
+
+def _server_timing(current: RequestMetrics, total: float) -> bytes:
+    app_seconds = max(0.0, total - current.db_seconds - current.llm_seconds)
+    return (
+        f'db;dur={current.db_seconds * 1000:.1f};desc="{current.db_operations} ops", '
+        f'llm;dur={current.llm_seconds * 1000:.1f};desc="{current.llm_calls} calls", '
+        f"app;dur={app_seconds * 1000:.1f}, total;dur={total * 1000:.1f}"
+    ).encode("latin-1")
+
+class MetricsMiddleware:
+    """
+    Records the latency of each request per route, with the MongoDB and LLM
+    time it caused. With METRICS_TIMING_HEADER, responses carry a
+    Server-Timing header splitting the time into db, llm and the rest (app).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        current = RequestMetrics()
+        token = _current.set(current)
+        started = time.monotonic()
+        status = 500
+        headers_sent_at = None
+
+        async def send_with_timing(message):
+            nonlocal status, headers_sent_at
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers_sent_at = time.monotonic()
+                if settings.METRICS_TIMING_HEADER:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", _server_timing(current, headers_sent_at - started))
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            route = _route_of(scope)
+            http_request_duration.observe(
+                (headers_sent_at or time.monotonic()) - started, method=scope["method"], route=route, status=str(status)
+            )
+            request_db_operations.inc(current.db_operations, route=route)
+            request_db_seconds.inc(current.db_seconds, route=route)
+            request_llm_seconds.inc(current.llm_seconds, route=route)
+
+def _cache_metrics() -> str:
+    from app.services.evaluation_cache import get_cache_stats
+    from app.services.ttl_cache import caches
+
+    stats = get_cache_stats()
+    lines = [
+        "# HELP evaluation_cache_lookups_total Evaluation cache lookups by result.",
+        "# TYPE evaluation_cache_lookups_total counter",
+    ]
+    for result in ("memory_hits", "db_hits", "misses"):
+        lines.append(f'evaluation_cache_lookups_total{{result="{result}"}} {stats[result]}')
+    lines += [
+        "# HELP cache_hits_total Hits of the in-process caches.",
+        "# TYPE cache_hits_total counter",
+    ]
+    lines += [f'cache_hits_total{{cache="{name}"}} {cache.hits}' for name, cache in sorted(caches.items())]
+    lines += ["# HELP cache_misses_total Misses of the in-process caches.", "# TYPE cache_misses_total counter"]
+    lines += [f'cache_misses_total{{cache="{name}"}} {cache.misses}' for name, cache in sorted(caches.items())]
+    lines += ["# HELP cache_entries Entries held by the in-process caches.", "# TYPE cache_entries gauge"]
+    lines += [f'cache_entries{{cache="{name}"}} {len(cache)}' for name, cache in sorted(caches.items())]
+    lines += ["# HELP cache_bytes Bytes held by the size-bounded in-process caches.", "# TYPE cache_bytes gauge"]
+    lines += [
+        f'cache_bytes{{cache="{name}"}} {cache.bytes}'
+        for name, cache in sorted(caches.items()) if cache.max_bytes is not None
+    ]
+    return "\n".join(lines)
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    metrics = [
+        http_request_duration, request_db_operations, request_db_seconds, request_llm_seconds,
+        mongo_command_duration, llm_request_duration, llm_tokens,
+    ]
+    with _lock:
+        parts = [metric.render() for metric in metrics]
+    parts.append(_cache_metrics())
+    return "\n".join(parts) + "\n"
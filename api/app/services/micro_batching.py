@@ -0,0 +1,132 @@
+import asyncio
+import contextvars
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.core.config import settings
+from app.services.evaluators import Evaluator
+from app.services.llm_client import LLMUnavailableError
+from app.services.metrics import RequestMetrics, charge_llm_calls, current_request_metrics
+
+_pending_tasks: Set[asyncio.Task] = set()
+
+# An answer waiting in a batch: its text, the future of its result and the
+# metrics of the request waiting for it.
+_Item = Tuple[str, asyncio.Future, Optional[RequestMetrics]]
+
+class _Batch:
+    __slots__ = ("items", "tokens", "timer")
+
+    def __init__(self):
+        self.items: List[_Item] = []
+        self.tokens = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+class MicroBatcher:
+    """
+    Packs concurrent evaluations of answers to the same model answer (i.e.
+    the same question set) into a single evaluate_many() call, so the
+    system prompt and the model answer are sent once per batch instead of
+    once per answer.
+
+    An answer is sent at once while no other batch for its model answer is
+    being graded, so a lone submission never waits. Otherwise it opens a
+    batch that is sent `window` seconds later, or as soon as it holds
+    `max_size` answers or about `max_tokens` tokens of answers. A batch of
+    one is graded with evaluate(). When the shared response cannot be used
+    (it does not parse, or leaves answers out), the affected answers are
+    graded one by one; a provider outage is reported to every caller
+    instead. `max_size` 1 disables batching.
+
+    Batches are graded in a task of their own, outside of any request's
+    context; the LLM time is then charged to every request of the batch.
+    """
+
+    def __init__(self, evaluator: Evaluator, max_size: int, window: float, max_tokens: int):
+        self.evaluator = evaluator
+        self.max_size = max_size
+        self.window = window
+        self.max_tokens = max_tokens
+        self._open: Dict[str, _Batch] = {}
+        # Batches being graded, per model answer.
+        self._in_flight: Dict[str, int] = {}
+
+    async def evaluate(self, model_answer: str, student_answer: str) -> dict:
+        """Same contract as Evaluator.evaluate."""
+        if self.max_size <= 1:
+            return await self.evaluator.evaluate(model_answer, student_answer)
+
+        # Each answer also adds its own feedback to the response.
+        tokens = len(student_answer) // 4 + settings.LLM_EXPECTED_COMPLETION_TOKENS
+        batch = self._open.get(model_answer)
+        if batch is not None and batch.items and batch.tokens + tokens > self.max_tokens:
+            self._send(model_answer, batch)
+            batch = None
+        loop = asyncio.get_running_loop()
+        if batch is None:
+            batch = self._open[model_answer] = _Batch()
+            if self._in_flight.get(model_answer):
+                batch.timer = loop.call_later(self.window, self._send, model_answer, batch)
+
+        future = loop.create_future()
+        batch.items.append((student_answer, future, current_request_metrics()))
+        batch.tokens += tokens
+        if batch.timer is None or len(batch.items) >= self.max_size:
+            self._send(model_answer, batch)
+        return await future
+
+    def _send(self, model_answer: str, batch: _Batch):
+        if self._open.get(model_answer) is not batch:
+            return
+        del self._open[model_answer]
+        if batch.timer is not None:
+            batch.timer.cancel()
+        self._in_flight[model_answer] = self._in_flight.get(model_answer, 0) + 1
+        # A fresh context: the task must not charge its LLM calls to the request that happened to send it.
+        task = asyncio.get_running_loop().create_task(
+            self._grade(model_answer, batch.items), context=contextvars.Context()
+        )
+        _pending_tasks.add(task)
+        task.add_done_callback(_pending_tasks.discard)
+        task.add_done_callback(lambda _: self._graded(model_answer))
+
+    def _graded(self, model_answer: str):
+        remaining = self._in_flight.pop(model_answer) - 1
+        if remaining:
+            self._in_flight[model_answer] = remaining
+
+    async def _grade(self, model_answer: str, items: List[_Item]):
+        results: List[Optional[dict]] = [None] * len(items)
+        if len(items) > 1:
+            try:
+                with charge_llm_calls([metrics for _, _, metrics in items]):
+                    results = await self.evaluator.evaluate_many(model_answer, [answer for answer, _, _ in items])
+            except LLMUnavailableError as e:
+                for _, future, _ in items:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            except Exception as e:
+                print(f"The batched evaluation of {len(items)} answers failed; grading them one by one: {e}")
+
+        singles = []
+        for (answer, future, metrics), result in zip(items, results):
+            if result is not None:
+                if not future.done():
+                    future.set_result(result)
+            elif not future.done():
+                singles.append(self._grade_one(model_answer, answer, future, metrics))
+        if singles:
+            await asyncio.gather(*singles)
+
+    async def _grade_one(
+        self, model_answer: str, student_answer: str, future: asyncio.Future, metrics: Optional[RequestMetrics]
+    ):
+        try:
+            with charge_llm_calls([metrics]):
+                result = await self.evaluator.evaluate(model_answer, student_answer)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
@@ -0,0 +1,90 @@
+from typing import List, Literal, Optional, Tuple, Type
+
+from beanie import Document
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Query, Response, status
+from pydantic import BaseModel
+
+from app.core.config import settings
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+class PageParams:
+    """
+    Keyset pagination parameters shared by the list endpoints. Results are
+    ordered by `_id` (i.e. creation time); `after` is the `next_cursor`
+    returned with the previous page.
+
+    Without `limit` and `after` the whole list is returned, as before
+    pagination existed (clients that do not follow X-Next-Cursor); with
+    only `after`, pages hold PAGE_SIZE_DEFAULT rows.
+    """
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=settings.PAGE_SIZE_MAX, description="Rows per page."),
+        after: Optional[str] = Query(None, description="Cursor returned as X-Next-Cursor by the previous page."),
+        sort: Literal["oldest", "newest"] = Query("oldest"),
+    ):
+        self.sort = sort
+        self.after: Optional[ObjectId] = None
+        if after:
+            try:
+                self.after = ObjectId(after)
+            except InvalidId:
+                raise HTTPException(status.HTTP_400_BAD_REQUEST, "Invalid pagination cursor.")
+        # None: no paging, everything is returned.
+        self.limit: Optional[int] = limit if limit is not None or self.after is None else settings.PAGE_SIZE_DEFAULT
+
+    @property
+    def direction(self) -> int:
+        return 1 if self.sort == "oldest" else -1
+
+    def filter(self) -> dict:
+        """The `_id` range condition selecting everything after the cursor."""
+        if self.after is None:
+            return {}
+        return {"_id": {"$gt" if self.direction == 1 else "$lt": self.after}}
+
+    def query(self, query: dict) -> dict:
+        """`query` restricted to the rows after the cursor, as run by paginate()."""
+        return {**query, **self.filter()}
+
+    def sort_spec(self) -> List[Tuple[str, int]]:
+        return [("_id", self.direction)]
+
+    def pipeline_stages(self) -> List[dict]:
+        """$match/$sort/$limit stages for aggregation-based listings."""
+        stages = [{"$match": self.filter()}, {"$sort": {"_id": self.direction}}]
+        if self.limit is not None:
+            # One extra row tells us whether there is a next page.
+            stages.append({"$limit": self.limit + 1})
+        return stages
+
+    def split(self, rows: list, id_of=lambda row: row.id) -> Tuple[list, Optional[str]]:
+        """Trims the look-ahead row and returns the page with its next cursor."""
+        if self.limit is None or len(rows) <= self.limit:
+            return rows, None
+        rows = rows[:self.limit]
+        return rows, str(id_of(rows[-1]))
+
+async def paginate(
+    model: Type[Document],
+    query: dict,
+    page: PageParams,
+    projection_model: Optional[Type[BaseModel]] = None,
+) -> Tuple[list, Optional[str]]:
+    """
+    Fetches one page of `model` documents matching `query`, optionally
+    projected onto `projection_model`.
+    """
+    cursor = model.find(page.query(query), projection_model=projection_model).sort(page.sort_spec())
+    if page.limit is not None:
+        cursor = cursor.limit(page.limit + 1)
+    return page.split(await cursor.to_list())
+
+def set_next_cursor(response: Response, next_cursor: Optional[str]):
+    """Exposes the cursor of the next page, if any, as a response header."""
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
@@ -0,0 +1,47 @@
+"""
+The filters and pipelines of the queries behind the routes. The routes
+build their queries here, and tests/test_indexes.py explains these same
+queries against a real server to check that they are index-backed.
+"""
+from typing import List
+
+from beanie.odm.fields import PydanticObjectId
+
+from app.services.pagination import PageParams
+
+def available_question_sets_filter(student_id: PydanticObjectId, submitted_qset_ids: List[PydanticObjectId]) -> dict:
+    """
+    Question sets a student can still answer: public or assigned to them,
+    and not submitted to yet. Both $or branches are indexed (see QuestionSet).
+    """
+    return {
+        "_id": {"$nin": submitted_qset_ids},
+        "$or": [{"is_public": True}, {"assigned_students.$id": student_id}],
+    }
+
+def available_question_sets_pipeline(
+    student_id: PydanticObjectId, submitted_qset_ids: List[PydanticObjectId], page: PageParams
+) -> List[dict]:
+    """The match/sort/limit stages of a student's available question sets listing."""
+    return [{"$match": available_question_sets_filter(student_id, submitted_qset_ids)}, *page.pipeline_stages()]
+
+# Submission.distinct(SUBMITTED_QUESTION_SET_FIELD, student_submissions_filter(id))
+# lists the question sets a student has submitted to.
+SUBMITTED_QUESTION_SET_FIELD = "question_set.$id"
+
+def student_submissions_filter(student_id: PydanticObjectId) -> dict:
+    return {"student.$id": student_id}
+
+def student_submission_filter(qset_id: PydanticObjectId, student_id: PydanticObjectId) -> dict:
+    """A student's (only) submission to a question set."""
+    return {"question_set.$id": qset_id, "student.$id": student_id}
+
+def question_set_submissions_filter(qset_id: PydanticObjectId) -> dict:
+    return {"question_set.$id": qset_id}
+
+def teacher_question_sets_filter(teacher_id: PydanticObjectId) -> dict:
+    return {"creator.$id": teacher_id}
+
+def login_filter(login: str) -> dict:
+    """The user signing in with `login` as their email or username."""
+    return {"$or": [{"email": login}, {"username": login}]}
@@ -0,0 +1,101 @@
+from collections import Counter, defaultdict
+from typing import Iterable, Optional, Tuple
+from beanie.odm.fields import PydanticObjectId
+from pymongo import UpdateOne
+
+from app.db.database import QuestionSet, Submission, QuestionSetStats
+
+def scores_of(submission) -> dict:
+    """The fields of a submission (document or raw dict) that the statistics depend on."""
+    if isinstance(submission, dict):
+        return {"ai_score": submission.get("ai_score"), "final_score": submission.get("final_score")}
+    return {"ai_score": submission.ai_score, "final_score": submission.final_score}
+
+def _contribution(scores: Optional[dict]) -> Counter:
+    """What a single submission adds to the counters of its question set."""
+    counters = Counter()
+    if scores is None:
+        return counters
+    ai_score, final_score = scores.get("ai_score"), scores.get("final_score")
+
+    counters["submission_count"] = 1
+    if ai_score is not None:
+        counters["ai_count"] = 1
+        counters["ai_sum"] = ai_score
+        counters[f"ai_histogram.{ai_score}"] = 1
+    if final_score is not None:
+        counters["final_count"] = 1
+        counters["final_sum"] = final_score
+        counters[f"final_histogram.{final_score}"] = 1
+    if ai_score is not None and final_score is not None:
+        counters["drift_count"] = 1
+        counters["drift_sum"] = final_score - ai_score
+        counters["drift_abs_sum"] = abs(final_score - ai_score)
+    return counters
+
+async def record_submission_change(
+    qset_id: PydanticObjectId,
+    before: Optional[dict] = None,
+    after: Optional[dict] = None,
+):
+    """
+    Applies the change of one submission to its question set statistics.
+    `before`/`after` are scores_of() the submission before and after the
+    write; None means it did not exist (insert) or no longer exists (delete).
+    """
+    await record_submission_changes([(qset_id, before, after)])
+
+async def record_submission_changes(changes: Iterable[Tuple[PydanticObjectId, Optional[dict], Optional[dict]]]):
+    """
+    Like record_submission_change for many (qset_id, before, after) changes
+    at once; the deltas are summed per question set and written in one
+    bulk_write.
+    """
+    deltas = defaultdict(Counter)
+    for qset_id, before, after in changes:
+        deltas[qset_id].update(_contribution(after))
+        deltas[qset_id].subtract(_contribution(before))
+
+    operations = []
+    for qset_id, delta in deltas.items():
+        increments = {field: value for field, value in delta.items() if value}
+        if increments:
+            operations.append(UpdateOne({"_id": qset_id}, {"$inc": increments}, upsert=True))
+    if operations:
+        await QuestionSetStats.get_motor_collection().bulk_write(operations, ordered=False)
+
+async def recompute_question_set_stats(qset_id: PydanticObjectId) -> dict:
+    """
+    Rebuilds the statistics of a question set from its submissions, for
+    repairing counters that drifted (e.g. after a crash between a write and
+    its $inc). Submissions are grouped by (ai_score, final_score) in MongoDB,
+    so at most a few hundred rows are transferred whatever their number.
+    """
+    pipeline = [
+        {"$match": {"question_set.$id": qset_id}},
+        {"$group": {"_id": {"ai_score": "$ai_score", "final_score": "$final_score"}, "count": {"$sum": 1}}},
+    ]
+    totals = Counter()
+    async for group in Submission.get_motor_collection().aggregate(pipeline):
+        for field, value in _contribution(group["_id"]).items():
+            totals[field] += value * group["count"]
+
+    stats = {"submission_count": 0, "ai_histogram": {}, "final_histogram": {}}
+    for field, value in totals.items():
+        if "." in field:
+            histogram, bucket = field.split(".", 1)
+            stats[histogram][bucket] = value
+        else:
+            stats[field] = value
+    stats = QuestionSetStats(**stats).model_dump(exclude={"id", "revision_id"})
+
+    await QuestionSetStats.get_motor_collection().replace_one({"_id": qset_id}, stats, upsert=True)
+    return stats
+
+async def recompute_all_question_set_stats() -> int:
+    """Recomputes the statistics of every question set; returns how many were rebuilt."""
+    count = 0
+    async for doc in QuestionSet.get_motor_collection().find({}, {"_id": 1}):
+        await recompute_question_set_stats(doc["_id"])
+        count += 1
+    return count
@@ -0,0 +1,65 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from app.core.config import settings
+
+class TokenBucket:
+    """
+    An async token bucket. `acquire` waits until enough tokens have been
+    refilled; waiters are served in arrival order.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.refill_per_second)
+        self._updated_at = now
+
+    async def acquire(self, amount: float = 1):
+        # A request larger than the whole bucket would otherwise wait forever.
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) / self.refill_per_second)
+                self._refill()
+            self._tokens -= amount
+
+class ProviderLimiter:
+    """
+    Keeps LLM traffic inside the provider's limits: at most `max_concurrency`
+    calls in flight, `requests_per_minute` calls and `tokens_per_minute`
+    estimated tokens per rolling minute.
+    """
+
+    def __init__(self, max_concurrency: int, requests_per_minute: int, tokens_per_minute: int):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._requests = TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self._tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        async with self._semaphore:
+            await self._requests.acquire(1)
+            await self._tokens.acquire(estimated_tokens)
+            yield
+
+def estimate_tokens(*texts: str) -> int:
+    """
+    Rough token estimate for a request (about four characters per token)
+    plus the expected completion length.
+    """
+    return sum(len(text) for text in texts) // 4 + settings.LLM_EXPECTED_COMPLETION_TOKENS
+
+provider_limiter = ProviderLimiter(
+    settings.LLM_MAX_CONCURRENCY,
+    settings.LLM_REQUESTS_PER_MINUTE,
+    settings.LLM_TOKENS_PER_MINUTE,
+)
@@ -0,0 +1,239 @@
+import asyncio
+import re
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from beanie.odm.fields import PydanticObjectId
+
+from app.core.config import settings
+from app.db.database import QuestionSet, Submission
+from app.services.admission import Requester
+from app.services.ai_service import get_ai_evaluation
+from app.services.evaluation_cache import normalize_answer
+from app.services.ttl_cache import TTLCache
+
+# MinHash over character shingles. Signatures are compared position by
+# position; the fraction of equal positions estimates the Jaccard
+# similarity of the two shingle sets.
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 64
+# Locality-sensitive hashing for clustering: 16 bands of 4 rows make pairs
+# above ~0.5 similarity very likely to share at least one band.
+LSH_BANDS = 16
+
+_PRIME = (1 << 31) - 1
+# Fixed seed, so that signatures are comparable across processes and restarts.
+_rng = np.random.default_rng(20240601)
+_HASH_A = _rng.integers(1, _PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+_HASH_B = _rng.integers(0, _PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+# Words, numbers and single symbols, so "E = mc^2" or "O(n log n)" count as content.
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+TRIVIAL_ANSWER_FEEDBACK = "The answer does not contain enough content to be evaluated."
+MODEL_ANSWER_FEEDBACK = "The answer matches the model answer."
+
+def is_trivial_answer(answer: str) -> bool:
+    """
+    An answer without a single letter or digit (blank, "...", "???").
+    Short answers such as "H2O" or "Photosynthesis" may be right, so they
+    are left to the LLM.
+    """
+    return not any(ch.isalnum() for ch in answer)
+
+def distinct_tokens(answer: str) -> int:
+    """Distinct words, numbers and symbols of a normalized answer."""
+    return len(set(_TOKEN_RE.findall(normalize_answer(answer).lower())))
+
+def minhash_signature(text: str) -> np.ndarray:
+    """MinHash signature of the character shingles of a normalized text."""
+    text = _PUNCTUATION_RE.sub("", normalize_answer(text).lower())
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # a < 2^31 and crc32 < 2^32, so the products fit in 64 bits.
+    return ((np.outer(_HASH_A, hashes) + _HASH_B[:, None]) % _PRIME).min(axis=1)
+
+def similarities(signature: np.ndarray, signatures: np.ndarray) -> np.ndarray:
+    """Estimated Jaccard similarity of one signature to each row of `signatures`."""
+    return (signatures == signature).mean(axis=1)
+
+class SimilarityIndex:
+    """The MinHash signatures of the LLM-graded answers of one question set."""
+
+    def __init__(self, model_answer: str):
+        self.model_signature = minhash_signature(model_answer)
+        self.submission_ids: List[PydanticObjectId] = []
+        self.grades: List[Tuple[int, str]] = []
+        self.signatures = np.empty((0, NUM_PERMUTATIONS), dtype=np.uint64)
+
+    def add(self, submission_id: PydanticObjectId, signature: np.ndarray, score: int, feedback: str):
+        self.submission_ids.append(submission_id)
+        self.grades.append((score, feedback))
+        self.signatures = np.vstack([self.signatures, signature])
+        overflow = len(self.submission_ids) - settings.PRESCORE_INDEX_MAX_ANSWERS
+        if overflow > 0:
+            del self.submission_ids[:overflow], self.grades[:overflow]
+            self.signatures = self.signatures[overflow:]
+
+    def best_match(self, signature: np.ndarray) -> Optional[Tuple[int, float]]:
+        """Position and similarity of the most similar indexed answer."""
+        if not self.submission_ids:
+            return None
+        scores = similarities(signature, self.signatures)
+        position = int(scores.argmax())
+        return position, float(scores[position])
+
+_indexes = TTLCache(settings.PRESCORE_INDEX_MAX_SETS, settings.PRESCORE_INDEX_TTL_SECONDS, name="similarity_index")
+_loading: Dict[PydanticObjectId, asyncio.Task] = {}
+
+async def _load_index(question_set: QuestionSet) -> SimilarityIndex:
+    index = SimilarityIndex(question_set.model_answer)
+    cursor = Submission.get_motor_collection().find(
+        {
+            "question_set.$id": question_set.id,
+            "ai_score": {"$ne": None},
+            "grading_source": {"$in": [None, "llm"]},
+        },
+        {"student_answer": 1, "ai_score": 1, "ai_feedback": 1},
+    ).sort("_id", -1).limit(settings.PRESCORE_INDEX_MAX_ANSWERS)
+    docs = await cursor.to_list(length=None)
+    for doc in reversed(docs):
+        index.add(doc["_id"], minhash_signature(doc["student_answer"]), doc["ai_score"], doc.get("ai_feedback") or "")
+    _indexes.set(question_set.id, index)
+    return index
+
+async def _get_index(question_set: QuestionSet) -> SimilarityIndex:
+    """The index of a question set, loaded from its graded submissions on first use."""
+    index = _indexes.get(question_set.id)
+    if index is not None:
+        return index
+    task = _loading.get(question_set.id)
+    if task is None:
+        task = asyncio.ensure_future(_load_index(question_set))
+        _loading[question_set.id] = task
+        task.add_done_callback(lambda _: _loading.pop(question_set.id, None))
+    return await task
+
+async def prescore_answer(question_set: QuestionSet, answer: str) -> Optional[dict]:
+    """
+    Grades an answer locally when possible. Returns None when the LLM is
+    needed, otherwise a dict with score, feedback, grading_source
+    ("trivial", "model_answer" or "duplicate") and similar_to (the
+    submission whose grade was reused).
+    """
+    if not settings.PRESCORE_ENABLED:
+        return None
+
+    # Compared with the model answer first: a one-word model answer is not filler.
+    index = await _get_index(question_set)
+    signature = minhash_signature(answer)
+    if similarities(signature, index.model_signature[None, :])[0] >= settings.PRESCORE_DUPLICATE_THRESHOLD:
+        return {"score": 10, "feedback": MODEL_ANSWER_FEEDBACK, "grading_source": "model_answer", "similar_to": None}
+
+    match = index.best_match(signature)
+    if match and match[1] >= settings.PRESCORE_DUPLICATE_THRESHOLD:
+        score, feedback = index.grades[match[0]]
+        return {"score": score, "feedback": feedback, "grading_source": "duplicate", "similar_to": index.submission_ids[match[0]]}
+
+    if is_trivial_answer(answer):
+        return {"score": 0, "feedback": TRIVIAL_ANSWER_FEEDBACK, "grading_source": "trivial", "similar_to": None}
+    return None
+
+async def evaluate_answer_for_set(question_set: QuestionSet, answer: str, requester: Optional[Requester] = None) -> dict:
+    """
+    Grades a submission's answer: locally when prescore_answer can,
+    otherwise with get_ai_evaluation on behalf of requester. The result
+    always carries grading_source and similar_to; a failed LLM call has
+    score -1.
+    """
+    prescored = await prescore_answer(question_set, answer)
+    if prescored is not None:
+        return prescored
+    evaluation = await get_ai_evaluation(question_set.model_answer, answer, requester)
+    return {**evaluation, "grading_source": "llm", "similar_to": None}
+
+def remember_graded_answer(qset_id: PydanticObjectId, submission: Submission):
+    """
+    Adds a freshly LLM-graded submission to its question set's index, if
+    that index is loaded. Reused and deterministic grades are not indexed.
+    """
+    index = _indexes.get(qset_id)
+    if index is None or submission.grading_source != "llm" or submission.ai_score is None:
+        return
+    index.add(submission.id, minhash_signature(submission.student_answer), submission.ai_score, submission.ai_feedback or "")
+
+def find_similarity_clusters(signatures: np.ndarray, threshold: float) -> List[Tuple[List[int], float]]:
+    """
+    Groups rows whose signatures are at least `threshold` similar, directly
+    or through other rows. Candidate pairs come from LSH buckets, so the
+    cost grows with the number of near matches rather than quadratically.
+    Returns (row positions, weakest linking similarity) per cluster.
+    """
+    count = len(signatures)
+    parent = list(range(count))
+    weakest: Dict[int, float] = {}
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows_per_band = NUM_PERMUTATIONS // LSH_BANDS
+    for band in range(LSH_BANDS):
+        keys = signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        _, buckets = np.unique(keys, axis=0, return_inverse=True)
+        buckets = buckets.ravel()
+        order = np.argsort(buckets, kind="stable")
+        for bucket in np.split(order, np.flatnonzero(np.diff(buckets[order])) + 1):
+            if len(bucket) < 2:
+                continue
+            for position, i in enumerate(bucket[:-1]):
+                others = bucket[position + 1:]
+                scores = similarities(signatures[i], signatures[others])
+                similar = scores >= threshold
+                for j, score in zip(others[similar], scores[similar]):
+                    root_i, root_j = find(int(i)), find(int(j))
+                    if root_i == root_j:
+                        continue
+                    parent[root_j] = root_i
+                    weakest[root_i] = min(weakest.get(root_i, 1.0), weakest.pop(root_j, 1.0), float(score))
+
+    clusters: Dict[int, List[int]] = {}
+    for i in range(count):
+        clusters.setdefault(find(i), []).append(i)
+    return [(members, weakest[root]) for root, members in clusters.items() if len(members) > 1]
+
+async def find_plagiarism_clusters(qset_id: PydanticObjectId) -> List[dict]:
+    """
+    Clusters the submissions of a question set by answer similarity
+    (PLAGIARISM_SIMILARITY_THRESHOLD). Answers of fewer than
+    PLAGIARISM_MIN_DISTINCT_TOKENS distinct tokens are left out, since
+    short answers (filler, or a correct "H2O") all look alike. Returns
+    submission_ids, student (id, summary) refs and min_similarity per
+    cluster, largest clusters first.
+    """
+    cursor = Submission.get_motor_collection().find(
+        {"question_set.$id": qset_id}, {"student": 1, "student_summary": 1, "student_answer": 1}
+    ).sort("_id", 1)
+    docs = [doc async for doc in cursor if distinct_tokens(doc["student_answer"]) >= settings.PLAGIARISM_MIN_DISTINCT_TOKENS]
+    if len(docs) < 2:
+        return []
+
+    def cluster():
+        signatures = np.array([minhash_signature(doc["student_answer"]) for doc in docs])
+        return find_similarity_clusters(signatures, settings.PLAGIARISM_SIMILARITY_THRESHOLD)
+
+    # CPU bound; keep it off the event loop.
+    clusters = await asyncio.to_thread(cluster)
+    clusters.sort(key=lambda c: (-len(c[0]), -c[1]))
+    return [
+        {
+            "submission_ids": [docs[i]["_id"] for i in members],
+            "students": [(docs[i]["student"].id, docs[i].get("student_summary")) for i in members],
+            "min_similarity": round(similarity, 3),
+        }
+        for members, similarity in clusters
+    ]
@@ -0,0 +1,41 @@
+import asyncio
+import json
+from typing import AsyncIterator, Set
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    # Stops reverse proxies such as nginx from buffering the stream.
+    "X-Accel-Buffering": "no",
+}
+
+_detached_tasks: Set[asyncio.Task] = set()
+
+def format_sse(event: str, data: dict) -> str:
+    """Formats a single Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def relay_detached(messages: AsyncIterator[str], error_detail: str) -> AsyncIterator[str]:
+    """
+    Runs `messages` to completion in a task of its own and relays what it
+    yields. If the client disconnects, the task carries on (e.g. to store
+    the result it has paid for) and its remaining messages are dropped. If
+    `messages` raises, the stream ends with an `error` event carrying
+    `error_detail`, so clients can tell a failure from a dropped connection.
+    """
+    queue: "asyncio.Queue" = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for message in messages:
+                queue.put_nowait(message)
+        except Exception as e:
+            print(f"An error occurred in a detached event stream: {e}")
+            queue.put_nowait(format_sse("error", {"detail": error_detail}))
+        finally:
+            queue.put_nowait(None)
+
+    task = asyncio.get_running_loop().create_task(produce())
+    _detached_tasks.add(task)
+    task.add_done_callback(_detached_tasks.discard)
+    while (message := await queue.get()) is not None:
+        yield message
@@ -0,0 +1,84 @@
+import csv
+import io
+from typing import AsyncIterator, List
+
+import orjson
+from beanie.odm.fields import PydanticObjectId
+
+from app.db.database import Submission, EmbeddedUser
+from app.services.link_resolver import resolve_users_from_summaries
+
+EXPORT_COLUMNS = ["submission_id", "student_id", "username", "email", "status", "ai_score", "final_score"]
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+}
+
+_EXPORT_PROJECTION = {"student": 1, "student_summary": 1, "status": 1, "ai_score": 1, "final_score": 1}
+
+async def _rows_for_batch(docs: List[dict]) -> List[dict]:
+    students_map = await resolve_users_from_summaries(
+        (doc["student"].id, EmbeddedUser(**doc["student_summary"]) if doc.get("student_summary") else None)
+        for doc in docs
+    )
+    rows = []
+    for doc in docs:
+        student = students_map.get(doc["student"].id, {})
+        rows.append({
+            "submission_id": str(doc["_id"]),
+            "student_id": str(doc["student"].id),
+            "username": student.get("username"),
+            "email": student.get("email"),
+            "status": doc.get("status", "graded"),
+            "ai_score": doc.get("ai_score"),
+            "final_score": doc.get("final_score"),
+        })
+    return rows
+
+async def iter_submission_batches(qset_id: PydanticObjectId, batch_size: int) -> AsyncIterator[List[dict]]:
+    """
+    Yields the export rows of a question set's submissions, batch_size at a
+    time. Only one batch is held in memory; the students of each batch are
+    resolved with a single $in query.
+    """
+    cursor = Submission.get_motor_collection().find(
+        {"question_set.$id": qset_id}, _EXPORT_PROJECTION, batch_size=batch_size
+    ).sort("_id", 1)
+
+    batch = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield await _rows_for_batch(batch)
+            batch = []
+    if batch:
+        yield await _rows_for_batch(batch)
+
+# Spreadsheets evaluate cells starting with these as formulas.
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def _csv_safe(value):
+    """Neutralizes user-chosen text (usernames, ...) that a spreadsheet would run as a formula."""
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def _render_csv(rows: List[dict], header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    if header:
+        writer.writeheader()
+    writer.writerows({column: _csv_safe(value) for column, value in row.items()} for row in rows)
+    return buffer.getvalue().encode()
+
+async def export_submissions(qset_id: PydanticObjectId, export_format: str, batch_size: int) -> AsyncIterator[bytes]:
+    """Renders the submissions of a question set as CSV (with a header row) or JSON Lines."""
+    if export_format == "csv":
+        yield _render_csv([], header=True)
+
+    async for rows in iter_submission_batches(qset_id, batch_size):
+        if export_format == "csv":
+            yield _render_csv(rows)
+        else:
+            yield b"".join(orjson.dumps(row) + b"\n" for row in rows)
@@ -0,0 +1,103 @@
+import asyncio
+from typing import Set
+from beanie.odm.fields import PydanticObjectId
+
+from app.db.database import User, QuestionSet, Submission, EmbeddedUser
+from app.models.projection_models import UserSummary
+from app.services.change_versions import USERS_KEY, bump_versions
+
+_pending_tasks: Set[asyncio.Task] = set()
+
+def user_summary(user) -> EmbeddedUser:
+    """Builds the embedded summary for a User document (or any object with the same fields)."""
+    return EmbeddedUser(id=user.id, username=user.username, email=user.email, role=user.role)
+
+def schedule_user_summary_propagation(user_id: PydanticObjectId):
+    """
+    Refreshes the summaries embedded for a user in the background.
+    Called from the User document events, so it must not block.
+    """
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    task = loop.create_task(_propagate_in_background(user_id))
+    _pending_tasks.add(task)
+    task.add_done_callback(_pending_tasks.discard)
+
+async def _propagate_in_background(user_id: PydanticObjectId):
+    try:
+        await propagate_user_summary(user_id)
+    except Exception as e:
+        print(f"An error occurred while propagating the summary of user {user_id}: {e}")
+
+async def propagate_user_summary(user_id: PydanticObjectId):
+    """
+    Rewrites every embedded copy of a user's summary from the current
+    database state, so concurrent changes converge on the latest one.
+    """
+    user = await User.find_one({"_id": user_id}, projection_model=UserSummary)
+    if user is None:
+        return
+    summary = user_summary(user).model_dump()
+
+    results = [
+        await QuestionSet.get_motor_collection().update_many(
+            {"creator.$id": user_id},
+            {"$set": {"creator_summary": summary}},
+        ),
+        await Submission.get_motor_collection().update_many(
+            {"student.$id": user_id},
+            {"$set": {"student_summary": summary}},
+        ),
+        await QuestionSet.get_motor_collection().update_many(
+            {"assigned_students.$id": user_id},
+            {"$set": {"assigned_summaries.$[summary]": summary}},
+            array_filters=[{"summary.id": user_id}],
+        ),
+    ]
+    if any(result.modified_count for result in results):
+        await bump_versions([USERS_KEY])
+
+async def backfill_user_summaries(batch_size: int = 500) -> dict:
+    """
+    Fills in the summaries of question sets and submissions written before
+    they existed. Safe to run repeatedly; only documents missing a summary
+    are touched.
+    """
+    counts = {"question_sets": 0, "submissions": 0}
+    summaries = {}
+
+    async def summaries_for(user_ids):
+        missing = [uid for uid in set(user_ids) if uid not in summaries]
+        if missing:
+            async for user in User.find({"_id": {"$in": missing}}, projection_model=UserSummary):
+                summaries[user.id] = user_summary(user).model_dump()
+        return summaries
+
+    qsets_collection = QuestionSet.get_motor_collection()
+    cursor = qsets_collection.find(
+        {"$or": [{"creator_summary": None}, {"assigned_summaries": {"$exists": False}}]},
+        {"creator": 1, "assigned_students": 1},
+        batch_size=batch_size,
+    )
+    async for doc in cursor:
+        assigned_ids = [ref.id for ref in doc.get("assigned_students", [])]
+        known = await summaries_for([doc["creator"].id, *assigned_ids])
+        await qsets_collection.update_one({"_id": doc["_id"]}, {"$set": {
+            "creator_summary": known.get(doc["creator"].id),
+            "assigned_summaries": [known[uid] for uid in assigned_ids if uid in known],
+        }})
+        counts["question_sets"] += 1
+
+    submissions_collection = Submission.get_motor_collection()
+    cursor = submissions_collection.find({"student_summary": None}, {"student": 1}, batch_size=batch_size)
+    async for doc in cursor:
+        known = await summaries_for([doc["student"].id])
+        if doc["student"].id in known:
+            await submissions_collection.update_one(
+                {"_id": doc["_id"]}, {"$set": {"student_summary": known[doc["student"].id]}}
+            )
+            counts["submissions"] += 1
+
+    return counts
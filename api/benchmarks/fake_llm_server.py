@@ -0,0 +1,127 @@
+"""
+A local stand-in for the Groq / OpenAI chat completions API, for testing
+the LLM client layer under latency and errors without a real provider.
+
+It answers the JSON-mode request of get_ai_evaluation, its batched
+variant (several numbered answers, see app.services.micro_batching) and
+the streamed SCORE-line request of stream_ai_evaluation. Latency and failures
+are injected according to its configuration, which can also be changed
+while it runs with POST /fake/config (e.g. {"error_rate": 0.5}).
+
+Run from the `api` directory and point the app at it:
+
+    uvicorn benchmarks.fake_llm_server:app --port 9100
+    GROQ_BASE_URL=http://127.0.0.1:9100 GROQ_API_KEY=fake uvicorn app.main:app
+
+or, through the OpenAI-compatible backend:
+
+    EVALUATOR_BACKENDS=openai:fake OPENAI_COMPATIBLE_BASE_URL=http://127.0.0.1:9100/v1 uvicorn app.main:app
+"""
+import asyncio
+import json
+import os
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+config = {
+    # Mean latency of a completion and the +/- random spread around it.
+    "latency_ms": float(os.getenv("FAKE_LLM_LATENCY_MS", 200)),
+    "jitter_ms": float(os.getenv("FAKE_LLM_JITTER_MS", 50)),
+    # Share of requests answered with error_status instead of a completion.
+    "error_rate": float(os.getenv("FAKE_LLM_ERROR_RATE", 0)),
+    "error_status": int(os.getenv("FAKE_LLM_ERROR_STATUS", 503)),
+    # Sent as Retry-After with 429 and 503 errors when set.
+    "retry_after": os.getenv("FAKE_LLM_RETRY_AFTER"),
+    "score": int(os.getenv("FAKE_LLM_SCORE", 7)),
+    # Share of JSON-mode responses that are not valid JSON.
+    "malformed_rate": float(os.getenv("FAKE_LLM_MALFORMED_RATE", 0)),
+}
+
+stats = {"requests": 0, "errors": 0}
+
+app = FastAPI(title="Fake LLM provider")
+
+def _completion(content: str, model: str) -> dict:
+    return {
+        "id": f"chatcmpl-fake-{stats['requests']}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120},
+    }
+
+def _chunk(delta: dict, model: str, finish_reason=None) -> str:
+    payload = {
+        "id": f"chatcmpl-fake-{stats['requests']}",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n"
+
+def _batched_answer_ids(user_message: str) -> list:
+    """The ids of a batched prompt, whose last line is a JSON array of {"id", "answer"}."""
+    try:
+        answers = json.loads(user_message.rsplit("\n", 1)[-1])
+    except ValueError:
+        return []
+    if not isinstance(answers, list):
+        return []
+    return [answer["id"] for answer in answers if isinstance(answer, dict) and "id" in answer]
+
+@app.post("/openai/v1/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    model = body.get("model", "fake")
+    stats["requests"] += 1
+
+    latency = max(0.0, config["latency_ms"] + random.uniform(-config["jitter_ms"], config["jitter_ms"])) / 1000
+    await asyncio.sleep(latency)
+
+    if random.random() < config["error_rate"]:
+        stats["errors"] += 1
+        headers = {}
+        if config["retry_after"] and config["error_status"] in (429, 503):
+            headers["Retry-After"] = str(config["retry_after"])
+        return JSONResponse(
+            {"error": {"message": "Injected failure.", "type": "fake_error"}},
+            status_code=config["error_status"],
+            headers=headers,
+        )
+
+    feedback = "The answer covers the main ideas of the model answer."
+    if not body.get("stream"):
+        user_message = body["messages"][-1]["content"]
+        answers = _batched_answer_ids(user_message)
+        if answers:
+            content = json.dumps({"results": [{"id": n, "score": config["score"], "feedback": feedback} for n in answers]})
+        else:
+            content = json.dumps({"score": config["score"], "feedback": feedback})
+        if random.random() < config["malformed_rate"]:
+            content = content[: len(content) // 2]
+        return JSONResponse(_completion(content, model))
+
+    async def stream():
+        yield _chunk({"role": "assistant", "content": ""}, model)
+        yield _chunk({"content": f"SCORE: {config['score']}\n"}, model)
+        for word in feedback.split(" "):
+            yield _chunk({"content": word + " "}, model)
+        yield _chunk({}, model, finish_reason="stop")
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+@app.post("/fake/config")
+async def update_config(changes: dict):
+    config.update({key: value for key, value in changes.items() if key in config})
+    return config
+
+@app.get("/fake/stats")
+async def get_stats():
+    return stats
@@ -0,0 +1,437 @@
+"""
+In-process load test of the API. The FastAPI app is driven through an
+ASGI transport (no network) with a mix of realistic traffic: logins,
+students listing their question sets and submitting answers, teachers
+reviewing and finalizing submissions. Grading uses the "fake" evaluator,
+so no LLM provider is called.
+
+Requests are started on an open-loop schedule at the target rate, and
+latency is measured from the scheduled start, so a slow server shows up as
+growing latency rather than as fewer requests sent.
+
+The database is one of:
+
+    --mongo mock          mongomock-motor, in memory (in requirements-dev.txt).
+                          Measures the app's own overhead; Mongo costs are not realistic.
+    --mongo spawn         a throwaway mongod started from PATH (or --mongod-bin).
+    --mongo mongodb://... an existing server; the database is dropped afterwards.
+
+Per-route p50/p95/p99 latency and throughput are printed and written as
+JSON; pass an earlier result file to --compare to see the changes. Run
+from the `api` directory:
+
+    python -m benchmarks.load_test --rps 50 --duration 30 --mongo spawn
+    python -m benchmarks.load_test --rps 50 --duration 30 --compare benchmarks/results/<earlier>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_MIX = "login=5,list_question_sets=40,submit=20,review=25,finalize=10"
+PASSWORD = "benchmark-password"
+RESULTS_DIR = Path(__file__).parent / "results"
+
+_WORDS = (
+    "energy light plants cells water carbon oxygen sugar process leaves roots sun chlorophyll "
+    "glucose reaction membrane mitochondria nucleus protein enzyme transport diffusion gradient"
+).split()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rps", type=float, default=20, help="Target request rate.")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of measured load.")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of load before measuring.")
+    parser.add_argument("--arrivals", choices=["uniform", "poisson"], default="poisson")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="Requests beyond this are dropped and counted.")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Operation weights (default {DEFAULT_MIX}).")
+    parser.add_argument("--students", type=int, default=200)
+    parser.add_argument("--teachers", type=int, default=5)
+    parser.add_argument("--sets-per-teacher", type=int, default=4)
+    parser.add_argument("--submitted-fraction", type=float, default=0.5,
+                        help="Share of (student, set) pairs already submitted before the run.")
+    parser.add_argument("--mongo", default="mock", help="mock, spawn or a mongodb:// URL.")
+    parser.add_argument("--mongod-bin", default="mongod")
+    parser.add_argument("--grading-mode", choices=["sync", "async"], default="sync")
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="Median latency of the fake evaluator.")
+    parser.add_argument("--llm-latency-sigma", type=float, default=0.5)
+    parser.add_argument("--llm-error-rate", type=float, default=0)
+    parser.add_argument("--bcrypt-rounds", type=int, default=None, help="Defaults to the app's BCRYPT_ROUNDS.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Result file (default benchmarks/results/load-<commit>-<time>.json).")
+    parser.add_argument("--compare", help="An earlier result file to compare against.")
+    return parser.parse_args(argv)
+
+def configure_environment(args):
+    """Settings are read at import time, so this must run before the app is imported."""
+    os.environ["EVALUATOR_BACKENDS"] = "fake"
+    os.environ["FAKE_EVALUATOR_MEDIAN_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["FAKE_EVALUATOR_LATENCY_SIGMA"] = str(args.llm_latency_sigma)
+    os.environ["FAKE_EVALUATOR_ERROR_RATE"] = str(args.llm_error_rate)
+    os.environ["FAKE_EVALUATOR_SEED"] = str(args.seed)
+    os.environ["GRADING_MODE"] = args.grading_mode
+    if args.bcrypt_rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+
+def _patch_mongomock():
+    """
+    mongomock does not follow DBRefs in dotted paths such as "student.$id",
+    which every Link query of the app uses, and rejects the `sort` argument
+    of UpdateOne in bulk writes. Teach it both.
+    """
+    from bson import DBRef
+    from mongomock import collection, filtering, helpers
+
+    def expand(value):
+        if isinstance(value, DBRef):
+            return {"$ref": value.collection, "$id": value.id}
+        if isinstance(value, dict):
+            return {key: expand(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [expand(item) for item in value]
+        return value
+
+    iter_key_candidates = filtering.iter_key_candidates
+    filtering.iter_key_candidates = lambda key, doc: iter_key_candidates(key, expand(doc))
+
+    get_value_by_dot = helpers.get_value_by_dot
+    helpers.get_value_by_dot = lambda doc, key, can_generate_array=False: \
+        get_value_by_dot(expand(doc) if "$" in key else doc, key, can_generate_array)
+
+    add_update = collection.BulkOperationBuilder.add_update
+    collection.BulkOperationBuilder.add_update = lambda self, *a, sort=None, **kw: add_update(self, *a, **kw)
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def open_database(args):
+    """Returns (database, cleanup coroutine function) for --mongo."""
+    if args.mongo == "mock":
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--mongo mock needs mongomock-motor: pip install -r requirements-dev.txt")
+        _patch_mongomock()
+        database = AsyncMongoMockClient()["perception_load_test"]
+
+        async def cleanup():
+            pass
+        return database, cleanup
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    from app.services.metrics import MongoCommandListener
+
+    process = data_dir = None
+    url = args.mongo
+    if args.mongo == "spawn":
+        binary = shutil.which(args.mongod_bin)
+        if binary is None:
+            sys.exit(f"{args.mongod_bin} not found; install MongoDB or use --mongo mock.")
+        data_dir = tempfile.mkdtemp(prefix="perception-load-")
+        port = _free_port()
+        process = subprocess.Popen(
+            [binary, "--dbpath", data_dir, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+            stdout=subprocess.DEVNULL,
+        )
+        url = f"mongodb://127.0.0.1:{port}"
+
+    client = AsyncIOMotorClient(url, serverSelectionTimeoutMS=20000, event_listeners=[MongoCommandListener()])
+    await client.admin.command("ping")
+    database = client[f"perception_load_test_{int(time.time())}"]
+
+    async def cleanup():
+        await client.drop_database(database.name)
+        client.close()
+        if process is not None:
+            process.terminate()
+            process.wait()
+            shutil.rmtree(data_dir, ignore_errors=True)
+    return database, cleanup
+
+def random_answer(rng: random.Random, model_answer: str) -> str:
+    """A plausible answer: some of the model answer's words plus filler, unique enough to need grading."""
+    words = model_answer.split()
+    picked = rng.sample(words, k=max(1, len(words) // 2)) + rng.choices(_WORDS, k=rng.randint(8, 30))
+    rng.shuffle(picked)
+    return " ".join(picked)
+
+class Population:
+    """The users, question sets and submissions the traffic draws from."""
+
+    def __init__(self):
+        self.students = []
+        self.teachers = []
+        self.question_sets = []  # (id, model answer, owner)
+        self.open_pairs = []     # (student, question set) not yet submitted
+        self.submissions = defaultdict(list)  # question set id -> submission ids
+
+async def seed(args, rng: random.Random) -> Population:
+    """Creates the users, question sets and already made submissions directly in the database."""
+    from beanie import Link
+    from bson import DBRef
+
+    from app.db.database import User, QuestionSet, Submission
+    from app.services.auth_service import create_user_access_token, get_password_hash
+    from app.services.question_set_stats import recompute_all_question_set_stats
+    from app.services.user_summaries import user_summary
+
+    def link(model, document_id):
+        return Link(DBRef(model.get_collection_name(), document_id), model)
+
+    population = Population()
+    hashed_password = get_password_hash(PASSWORD)
+    students = [User(username=f"student{i}", email=f"student{i}@example.com", hashed_password=hashed_password, role="student")
+                for i in range(args.students)]
+    teachers = [User(username=f"teacher{i}", email=f"teacher{i}@example.com", hashed_password=hashed_password, role="teacher")
+                for i in range(args.teachers)]
+    for user in students + teachers:
+        await user.insert()
+    population.students = [(user, create_user_access_token(user)) for user in students]
+    population.teachers = [(user, create_user_access_token(user)) for user in teachers]
+
+    for t, (teacher, _) in enumerate(population.teachers):
+        for s in range(args.sets_per_teacher):
+            model_answer = " ".join(rng.choices(_WORDS, k=40))
+            question_set = QuestionSet(
+                title=f"Benchmark set {t}-{s}",
+                question="Explain the process described in the lecture.",
+                model_answer=model_answer,
+                creator=link(User, teacher.id),
+                assigned_students=[link(User, student.id) for student in students],
+                creator_summary=user_summary(teacher),
+                assigned_summaries=[user_summary(student) for student in students],
+            )
+            await question_set.insert()
+            population.question_sets.append((question_set.id, model_answer, t))
+
+    submissions = []
+    for qset_id, model_answer, _ in population.question_sets:
+        for student_index, student in enumerate(students):
+            if rng.random() >= args.submitted_fraction:
+                population.open_pairs.append((student_index, qset_id, model_answer))
+                continue
+            submissions.append(Submission(
+                question_set=link(QuestionSet, qset_id),
+                student=link(User, student.id),
+                student_summary=user_summary(student),
+                student_answer=random_answer(rng, model_answer),
+                ai_score=rng.randint(0, 10),
+                ai_feedback="Seeded feedback.",
+            ))
+    for start in range(0, len(submissions), 1000):
+        await Submission.insert_many(submissions[start:start + 1000])
+    for submission in await Submission.find_all().to_list():
+        population.submissions[submission.question_set.ref.id].append(submission.id)
+    rng.shuffle(population.open_pairs)
+    await recompute_all_question_set_stats()
+    return population
+
+class Traffic:
+    """One operation per call, picked by weight; each returns (operation, HTTP status)."""
+
+    def __init__(self, client, population: Population, mix: dict, rng: random.Random):
+        self.client = client
+        self.population = population
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.rng = rng
+
+    def pick(self):
+        return self.rng.choices(self.operations, self.weights)[0]
+
+    def _auth(self, token):
+        return {"Authorization": f"Bearer {token}"}
+
+    def _teacher_set(self):
+        qset_id, _, owner = self.rng.choice(self.population.question_sets)
+        return qset_id, self.population.teachers[owner][1]
+
+    async def login(self):
+        user, _ = self.rng.choice(self.population.students + self.population.teachers)
+        return await self.client.post("/auth/token", data={"username": user.email, "password": PASSWORD})
+
+    async def list_question_sets(self):
+        _, token = self.rng.choice(self.population.students)
+        return await self.client.get("/api/student/question-sets", headers=self._auth(token))
+
+    async def submit(self):
+        if not self.population.open_pairs:
+            return await self.list_question_sets()
+        student_index, qset_id, model_answer = self.population.open_pairs.pop()
+        response = await self.client.post(
+            "/api/student/submissions",
+            json={"question_set_id": str(qset_id), "answer": random_answer(self.rng, model_answer)},
+            headers=self._auth(self.population.students[student_index][1]),
+        )
+        if response.status_code in (201, 202):
+            self.population.submissions[qset_id].append(response.json()["id"])
+        return response
+
+    async def review(self):
+        qset_id, token = self._teacher_set()
+        return await self.client.get(f"/api/teacher/question-sets/{qset_id}/submissions", headers=self._auth(token))
+
+    async def finalize(self):
+        qset_id, token = self._teacher_set()
+        if not self.population.submissions[qset_id]:
+            return await self.client.get(f"/api/teacher/question-sets/{qset_id}/submissions", headers=self._auth(token))
+        sub_id = self.rng.choice(self.population.submissions[qset_id])
+        return await self.client.put(
+            f"/api/teacher/submissions/{sub_id}/finalize",
+            json={"final_score": self.rng.randint(0, 10)},
+            headers=self._auth(token),
+        )
+
+async def run_load(traffic: Traffic, args, rng: random.Random):
+    """Runs warmup plus the measured period; returns samples and counters of the measured part."""
+    samples = defaultdict(list)      # operation -> latencies in seconds
+    statuses = defaultdict(lambda: defaultdict(int))
+    dropped = 0
+    in_flight = set()
+    total = args.warmup + args.duration
+    started = time.monotonic()
+    measure_from = started + args.warmup
+
+    async def issue(operation, scheduled):
+        try:
+            response = await getattr(traffic, operation)()
+            status = response.status_code
+        except Exception as e:
+            print(f"{operation} raised {type(e).__name__}: {e}")
+            status = "exception"
+        if scheduled >= measure_from:
+            samples[operation].append(time.monotonic() - scheduled)
+            statuses[operation][str(status)] += 1
+
+    scheduled = started
+    while True:
+        scheduled += rng.expovariate(args.rps) if args.arrivals == "poisson" else 1 / args.rps
+        if scheduled - started >= total:
+            break
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= args.max_in_flight:
+            dropped += scheduled >= measure_from
+            continue
+        task = asyncio.ensure_future(issue(traffic.pick(), scheduled))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    if in_flight:
+        await asyncio.wait(in_flight)
+    elapsed = time.monotonic() - measure_from
+    return samples, statuses, dropped, elapsed
+
+def summarize(latencies, statuses, elapsed) -> dict:
+    values = np.array(latencies) * 1000
+    errors = sum(count for status, count in statuses.items() if not status.startswith(("2", "3")))
+    summary = {
+        "count": len(values),
+        "errors": errors,
+        "statuses": dict(statuses),
+        "throughput_rps": round(len(values) / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    if len(values):
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        summary["latency_ms"] = {
+            "p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2),
+            "mean": round(float(values.mean()), 2), "max": round(float(values.max()), 2),
+        }
+    return summary
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def print_report(report: dict, baseline: dict = None):
+    header = f"{'operation':<20}{'count':>8}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    if baseline:
+        header += f"{'p95 vs base':>14}"
+    print(header)
+    rows = dict(report["routes"], overall=report["overall"])
+    for name, row in rows.items():
+        latency = row.get("latency_ms", {})
+        line = (f"{name:<20}{row['count']:>8}{row['errors']:>8}{row['throughput_rps']:>9}"
+                f"{latency.get('p50', '-'):>10}{latency.get('p95', '-'):>10}{latency.get('p99', '-'):>10}")
+        if baseline:
+            base = baseline["overall"] if name == "overall" else baseline["routes"].get(name, {})
+            base_p95 = base.get("latency_ms", {}).get("p95")
+            if base_p95 and "p95" in latency:
+                line += f"{(latency['p95'] - base_p95) / base_p95:>+14.1%}"
+        print(line)
+    if report["dropped"]:
+        print(f"{report['dropped']} requests were dropped at --max-in-flight.")
+
+async def main(args):
+    configure_environment(args)
+    import httpx
+
+    from app.db.database import init_db
+    from app.main import app
+    from app.services.grading_queue import start_grading_workers, stop_grading_workers
+
+    mix = {name: float(weight) for name, weight in (item.split("=") for item in args.mix.split(","))}
+    unknown = set(mix) - {"login", "list_question_sets", "submit", "review", "finalize"}
+    if unknown:
+        sys.exit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+
+    rng = random.Random(args.seed)
+    database, cleanup = await open_database(args)
+    try:
+        await init_db(database)
+        print("Seeding...")
+        population = await seed(args, rng)
+        await start_grading_workers()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=None) as client:
+            print(f"Running {args.warmup:.0f}s warmup + {args.duration:.0f}s at {args.rps} rps...")
+            samples, statuses, dropped, elapsed = await run_load(Traffic(client, population, mix, rng), args, rng)
+        await stop_grading_workers()
+    finally:
+        await cleanup()
+
+    all_statuses = defaultdict(int)
+    for counts in statuses.values():
+        for status, count in counts.items():
+            all_statuses[status] += count
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "routes": {name: summarize(samples[name], statuses[name], elapsed) for name in sorted(samples)},
+        "overall": summarize([value for name in samples for value in samples[name]], all_statuses, elapsed),
+        "dropped": dropped,
+    }
+
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print_report(report, baseline)
+
+    output = Path(args.output) if args.output else \
+        RESULTS_DIR / f"load-{report['commit']}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
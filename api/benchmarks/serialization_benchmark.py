@@ -0,0 +1,120 @@
+"""
+Micro-benchmark of the response path of GET /api/teacher/question-sets/{qs_id}/submissions.
+
+"before" mirrors the original route: full Beanie documents (password hashes
+included) are validated, dumped, re-validated into SubmissionReviewOut and
+validated once more by FastAPI's response_model before being serialized.
+"after" is the current route: projected rows are validated once and
+serialized with orjson.
+
+Beanie needs a database to initialize its document classes; nothing is read
+or written. Run from the `api` directory:
+
+    python -m benchmarks.serialization_benchmark --submissions 500
+"""
+import argparse
+import asyncio
+import time
+import tracemalloc
+from typing import List
+
+import orjson
+from beanie import init_beanie
+from bson import DBRef, ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pydantic import TypeAdapter
+
+from app.core.config import settings
+from app.db.database import User, QuestionSet, Submission
+from app.models.projection_models import SubmissionReviewRow, UserSummary
+from app.models.teacher_models import SubmissionReviewOut
+from app.models.user_models import UserOut
+
+def make_raw_documents(count: int):
+    """Builds documents shaped like what MongoDB returns for the route."""
+    qset_id = ObjectId()
+    users = [
+        {
+            "_id": ObjectId(),
+            "username": f"student{i}",
+            "email": f"student{i}@example.com",
+            "hashed_password": "$2b$12$" + "x" * 53,
+            "role": "student",
+        }
+        for i in range(count)
+    ]
+    submissions = [
+        {
+            "_id": ObjectId(),
+            "question_set": DBRef("question_sets", qset_id),
+            "student": DBRef("users", user["_id"]),
+            "student_answer": "An answer of moderate length. " * 20,
+            "ai_score": 7,
+            "ai_feedback": "Constructive feedback for the student. " * 10,
+            "final_score": None,
+            "status": "graded",
+            "grading_attempts": 0,
+        }
+        for user in users
+    ]
+    return users, submissions
+
+def project(doc: dict, model) -> dict:
+    """Drops the fields a projection would not have returned."""
+    keys = {field.alias or name for name, field in model.model_fields.items()}
+    return {k: v for k, v in doc.items() if k in keys}
+
+response_adapter = TypeAdapter(List[SubmissionReviewOut])
+
+def render_before(raw_users, raw_submissions) -> bytes:
+    submissions = [Submission.model_validate(doc) for doc in raw_submissions]
+    students = [User.model_validate(doc) for doc in raw_users]
+    students_map = {s.id: UserOut.model_validate(s, from_attributes=True) for s in students}
+    out = [
+        SubmissionReviewOut(**sub.model_dump(exclude={'student'}), student=students_map[sub.student.ref.id])
+        for sub in submissions
+    ]
+    return response_adapter.dump_json(response_adapter.validate_python(out, from_attributes=True))
+
+def render_after(raw_users, raw_submissions) -> bytes:
+    rows = [SubmissionReviewRow.model_validate(project(doc, SubmissionReviewRow)) for doc in raw_submissions]
+    users = [UserSummary.model_validate(project(doc, UserSummary)) for doc in raw_users]
+    students_map = {u.id: u.model_dump(mode="json") for u in users}
+    out = [{**row.model_dump(mode="json", exclude={'student'}), "student": students_map[row.student.ref.id]} for row in rows]
+    return orjson.dumps(out)
+
+def measure(render, raw_users, raw_submissions, repeat: int) -> dict:
+    render(raw_users, raw_submissions)  # warm up
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        body = render(raw_users, raw_submissions)
+    cpu_ms = (time.perf_counter() - start) * 1000 / repeat
+
+    tracemalloc.start()
+    render(raw_users, raw_submissions)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"ms_per_response": round(cpu_ms, 3), "peak_kib": round(peak / 1024, 1), "bytes": len(body)}
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--submissions", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--database-url", default=settings.DATABASE_URL)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(args.database_url)
+    await init_beanie(
+        database=client.get_default_database(),
+        document_models=[User, QuestionSet, Submission],
+        skip_indexes=True,
+    )
+
+    raw_users, raw_submissions = make_raw_documents(args.submissions)
+    for name, render in (("before", render_before), ("after", render_after)):
+        print(name, measure(render, raw_users, raw_submissions, args.repeat))
+
+if __name__ == "__main__":
+    asyncio.run(main())
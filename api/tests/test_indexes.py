@@ -0,0 +1,240 @@
+"""
+Checks with explain() that the queries behind the routes are served by the
+indexes declared on the document models (IXSCAN, and no in-memory SORT for
+the paginated listings). The queries are built with the same functions the
+routes use (app.services.queries, PageParams, the grading queue's filter).
+
+Needs a real MongoDB: a throwaway mongod is started from MONGOD_BIN or
+PATH, or MONGODB_TEST_URL points at a server (a scratch database is created
+and dropped). The tests are skipped when neither is available.
+
+    cd api && pip install -r requirements-dev.txt && python -m pytest tests
+"""
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pytest
+from bson import DBRef, ObjectId
+from pymongo import MongoClient
+
+from app.db.database import QuestionSet, Submission, User, init_db
+from app.services.grading_queue import claimable_filter
+from app.services.pagination import PageParams
+from app.services.queries import (
+    SUBMITTED_QUESTION_SET_FIELD,
+    available_question_sets_pipeline,
+    login_filter,
+    question_set_submissions_filter,
+    student_submission_filter,
+    student_submissions_filter,
+    teacher_question_sets_filter,
+)
+
+@pytest.fixture(scope="module")
+def mongo_url():
+    url = os.getenv("MONGODB_TEST_URL")
+    if url:
+        yield url
+        return
+    binary = shutil.which(os.getenv("MONGOD_BIN", "mongod"))
+    if binary is None:
+        pytest.skip("mongod not found; set MONGOD_BIN or MONGODB_TEST_URL.")
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    data_dir = tempfile.mkdtemp(prefix="perception-test-")
+    process = subprocess.Popen(
+        [binary, "--dbpath", data_dir, "--port", str(port), "--bind_ip", "127.0.0.1", "--quiet"],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        yield f"mongodb://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+@pytest.fixture(scope="module")
+def client(mongo_url):
+    client = MongoClient(mongo_url, serverSelectionTimeoutMS=20000)
+    client.admin.command("ping")
+    yield client
+    client.close()
+
+def _init_db(mongo_url: str, name: str):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def run():
+        motor_client = AsyncIOMotorClient(mongo_url)
+        try:
+            await init_db(motor_client[name])
+        finally:
+            motor_client.close()
+    asyncio.run(run())
+
+@pytest.fixture(scope="module")
+def db(mongo_url, client):
+    """
+    A scratch database with the models' indexes. One student sees a few
+    question sets among many assigned to someone else, so a plan that scans
+    every set loses to the indexed one.
+    """
+    name = f"perception_index_test_{int(time.time())}"
+    _init_db(mongo_url, name)
+
+    database = client[name]
+    teacher, other, students = ObjectId(), ObjectId(), [ObjectId() for _ in range(20)]
+    database.users.insert_many(
+        [{"_id": teacher, "username": "teacher", "email": "teacher@example.com", "hashed_password": "x", "role": "teacher"},
+         {"_id": other, "username": "other", "email": "other@example.com", "hashed_password": "x", "role": "student"}]
+        + [{"_id": s, "username": f"s{i}", "email": f"s{i}@example.com", "hashed_password": "x", "role": "student"}
+           for i, s in enumerate(students)]
+    )
+    qsets = [ObjectId() for _ in range(10)]
+    database.question_sets.insert_many([
+        {"_id": q, "title": "t", "question": "q", "model_answer": "a", "creator": DBRef("users", teacher),
+         "assigned_students": [DBRef("users", s) for s in students[:i]], "is_public": i == 0}
+        for i, q in enumerate(qsets)
+    ] + [
+        {"title": "t", "question": "q", "model_answer": "a", "creator": DBRef("users", teacher),
+         "assigned_students": [DBRef("users", other)], "is_public": False}
+        for _ in range(500)
+    ])
+    database.submissions.insert_many([
+        {"question_set": DBRef("question_sets", q), "student": DBRef("users", s), "student_answer": "a",
+         "status": "pending" if i % 7 == 0 else "graded", "grading_lease_until": None}
+        for q in qsets[:5] for i, s in enumerate(students)
+    ])
+    yield database
+    client.drop_database(name)
+
+def _stages(plan) -> set:
+    """Every stage name in an explain() plan, classic or slot-based."""
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= _stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages |= _stages(item)
+    return stages
+
+def _index_names(plan) -> set:
+    names = set()
+    if isinstance(plan, dict):
+        if "indexName" in plan:
+            names.add(plan["indexName"])
+        for value in plan.values():
+            names |= _index_names(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            names |= _index_names(item)
+    return names
+
+def _winning_plan(explain: dict) -> dict:
+    planner = explain.get("queryPlanner") or explain["stages"][0]["$cursor"]["queryPlanner"]
+    return planner["winningPlan"]
+
+def _page(limit=20, after=None, sort="oldest") -> PageParams:
+    return PageParams(limit=limit, after=after, sort=sort)
+
+def _paginate_plan(collection, query: dict, page: PageParams) -> dict:
+    """The plan of paginate(model, query, page)."""
+    cursor = collection.find(page.query(query)).sort(page.sort_spec())
+    if page.limit is not None:
+        cursor = cursor.limit(page.limit + 1)
+    return _winning_plan(cursor.explain())
+
+def _assert_indexed(plan: dict):
+    stages = _stages(plan)
+    assert "IXSCAN" in stages, stages
+    assert "COLLSCAN" not in stages, stages
+
+def _assert_indexed_page(plan: dict):
+    _assert_indexed(plan)
+    assert "SORT" not in _stages(plan), _stages(plan)
+
+def _user_id(db, username: str):
+    return db.users.find_one({"username": username})["_id"]
+
+def test_signup_lookups(db):
+    for query in (User.find(User.email == "s1@example.com"), User.find(User.username == "s1")):
+        _assert_indexed(_winning_plan(db.users.find(query.get_filter_query()).explain()))
+
+def test_login_lookup(db):
+    _assert_indexed(_winning_plan(db.users.find(login_filter("s1")).explain()))
+
+@pytest.mark.parametrize("sort", ["oldest", "newest"])
+def test_student_submissions_page(db, sort):
+    student = _user_id(db, "s1")
+    first = _paginate_plan(db.submissions, student_submissions_filter(student), _page(sort=sort))
+    _assert_indexed_page(first)
+    after = db.submissions.find_one(student_submissions_filter(student))["_id"]
+    _assert_indexed_page(_paginate_plan(db.submissions, student_submissions_filter(student), _page(after=str(after), sort=sort)))
+
+def test_submitted_question_sets_of_student(db):
+    explain = db.command("explain", {
+        "distinct": Submission.get_collection_name(),
+        "key": SUBMITTED_QUESTION_SET_FIELD,
+        "query": student_submissions_filter(_user_id(db, "s1")),
+    })
+    _assert_indexed(_winning_plan(explain))
+
+def test_existing_submission_of_student_for_set(db):
+    submission = db.submissions.find_one()
+    query = student_submission_filter(submission["question_set"].id, submission["student"].id)
+    _assert_indexed(_winning_plan(db.submissions.find(query).explain()))
+
+@pytest.mark.parametrize("sort", ["oldest", "newest"])
+def test_question_set_submissions_page(db, sort):
+    qset = db.submissions.find_one()["question_set"].id
+    _assert_indexed_page(_paginate_plan(db.submissions, question_set_submissions_filter(qset), _page(sort=sort)))
+
+def test_claimable_submissions(db):
+    plan = _winning_plan(db.submissions.find(claimable_filter(datetime.now(timezone.utc))).explain())
+    _assert_indexed(plan)
+
+def test_teacher_question_sets_page(db):
+    teacher = _user_id(db, "teacher")
+    _assert_indexed_page(_paginate_plan(db.question_sets, teacher_question_sets_filter(teacher), _page()))
+
+@pytest.mark.parametrize("limit", [20, None])
+def test_available_question_sets(db, limit):
+    """The student listing: public or assigned sets, minus those already submitted to."""
+    student = _user_id(db, "s3")
+    submitted = db.submissions.distinct(SUBMITTED_QUESTION_SET_FIELD, student_submissions_filter(student))
+    pipeline = available_question_sets_pipeline(student, submitted, _page(limit=limit))
+    explain = db.command("aggregate", QuestionSet.get_collection_name(), pipeline=pipeline, explain=True, cursor={})
+    plan = _winning_plan(explain)
+    _assert_indexed_page(plan)
+    # Both $or branches come from the visibility indexes, not a walk of the _id index.
+    assert _index_names(plan) == {"is_public_1__id_1", "assigned_students.$id_1__id_1"}, _index_names(plan)
+
+def test_models_declare_the_indexes(db):
+    """The collections the tests query are the ones the models write to."""
+    assert {User.get_collection_name(), QuestionSet.get_collection_name(), Submission.get_collection_name()} <= set(
+        db.list_collection_names()
+    )
+
+def test_init_db_reports_duplicates(mongo_url, client):
+    """Rows that break a unique index make init_db fail with a pointer to the check, not a bare driver error."""
+    name = f"perception_duplicate_test_{int(time.time())}"
+    database = client[name]
+    try:
+        database.users.insert_many([
+            {"username": "a", "email": "same@example.com", "hashed_password": "x", "role": "student"},
+            {"username": "b", "email": "same@example.com", "hashed_password": "x", "role": "student"},
+        ])
+        with pytest.raises(RuntimeError, match="check_unique_indexes"):
+            _init_db(mongo_url, name)
+    finally:
+        client.drop_database(name)